@@ -1,19 +1,102 @@
 # -*- coding: utf-8 -*
+"""
+文件名：api/auth.py
+功能：API Key 校验 (缓存的哈希注册表)
+说明：
+- Key 来源：环境变量 SNOWBOARD_API_KEYS (逗号分隔) 以及可选的 SNOWBOARD_API_KEYS_FILE
+  文件每行一个："<key_id> <明文Key>" 或 "<key_id> sha256:<十六进制摘要>"，# 开头为注释
+- 内存里只保存 sha256 摘要 -> key_id，查询是一次哈希 + 一次字典查找 (按摘要查，不直接比较明文)
+- 环境变量或文件变化后自动重载 (最多每 KEY_RELOAD_INTERVAL 秒检查一次)
+"""
+import hashlib
 import os
+import threading
+import time
+from typing import Dict, Optional
+
 from fastapi import Header, HTTPException
 
+KEY_RELOAD_INTERVAL = 5.0
+
+_registry: Dict[str, str] = {}  # sha256 摘要 -> key_id
+_source_signature = None
+_last_check = 0.0
+_lock = threading.Lock()
+
+
+def hash_api_key(raw_key: str) -> str:
+    return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+
+def _default_key_id(digest: str) -> str:
+    """未命名的 Key 用摘要前缀当 ID，日志和计量里都不会出现明文"""
+    return f"key_{digest[:10]}"
+
+
+def _read_signature():
+    keys_file = os.getenv("SNOWBOARD_API_KEYS_FILE")
+    mtime = None
+    if keys_file and os.path.exists(keys_file):
+        mtime = os.path.getmtime(keys_file)
+    return os.getenv("SNOWBOARD_API_KEYS"), keys_file, mtime
+
+
+def _build_registry(env_keys: Optional[str], keys_file: Optional[str]) -> Dict[str, str]:
+    registry = {}
+    for k in (env_keys or "").split(","):
+        k = k.strip()
+        if k:
+            digest = hash_api_key(k)
+            registry[digest] = _default_key_id(digest)
+
+    if keys_file and os.path.exists(keys_file):
+        with open(keys_file, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                parts = line.split(None, 1)
+                key_id, secret = (parts[0], parts[1].strip()) if len(parts) == 2 else (None, parts[0])
+                if secret.startswith("sha256:"):
+                    digest = secret[len("sha256:"):].lower()
+                else:
+                    digest = hash_api_key(secret)
+                registry[digest] = key_id or _default_key_id(digest)
+    return registry
+
+
+def load_key_registry(force: bool = False) -> Dict[str, str]:
+    """返回当前注册表；来源变化时重建"""
+    global _registry, _source_signature, _last_check
+    now = time.monotonic()
+    if not force and now - _last_check < KEY_RELOAD_INTERVAL:
+        return _registry
+
+    with _lock:
+        _last_check = now
+        signature = _read_signature()
+        if force or signature != _source_signature:
+            _registry = _build_registry(signature[0], signature[1])
+            _source_signature = signature
+    return _registry
+
+
+def lookup_key_id(raw_key: str) -> Optional[str]:
+    registry = load_key_registry()
+    # 注册表只存 Key 的摘要：按摘要查字典，查找耗时与明文 Key 的内容无关
+    return registry.get(hash_api_key(raw_key))
+
+
 def verify_api_key(x_api_key: str = Header(...)):
     """
     API Key 校验依赖
+    :return: key_id (用于限流与计量，不是明文 Key)
     """
-    api_keys = os.getenv("SNOWBOARD_API_KEYS")
-
-    if not api_keys:
+    if not load_key_registry():
         raise HTTPException(status_code=500, detail="API keys not configured")
 
-    valid_keys = [k.strip() for k in api_keys.split(",")]
-
-    if x_api_key not in valid_keys:
+    key_id = lookup_key_id(x_api_key)
+    if key_id is None:
         raise HTTPException(status_code=401, detail="Invalid API Key")
 
-    return x_api_key
+    return key_id
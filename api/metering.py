@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+文件名：api/metering.py
+功能：按 API Key 计量 (请求数、分析图片数、大模型调用次数、token)，
+      以及按 接口/Key/模型/Prompt 版本 细分的模型调用成本 (token、图片大小、耗时、费用)
+说明：计数先在内存中累加，攒够一批或超过时间间隔后一次性写入 SQLite，进程退出时兜底刷盘
+"""
+import atexit
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from utils.db_manager import add_api_usage, get_api_usage, add_llm_usage, query_llm_usage
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+METER_FIELDS = ("requests", "images", "llm_calls", "input_tokens", "output_tokens")
+LLM_FIELDS = ("calls", "failures", "hinted_calls", "input_tokens", "output_tokens", "image_tokens",
+              "image_bytes", "latency_ms", "cost")
+METER_FLUSH_EVERY = int(os.getenv("METER_FLUSH_EVERY", "100"))  # 攒多少次事件刷一次
+METER_FLUSH_INTERVAL = float(os.getenv("METER_FLUSH_INTERVAL", "30"))  # 最长多久刷一次 (秒)
+
+_pending: Dict[tuple, Dict[str, int]] = defaultdict(lambda: dict.fromkeys(METER_FIELDS, 0))
+# (day, endpoint, key_id, model, kind, prompt_version) -> LLM_FIELDS
+_pending_llm: Dict[tuple, Dict[str, float]] = defaultdict(lambda: dict.fromkeys(LLM_FIELDS, 0))
+_pending_events = 0
+_last_flush = time.monotonic()
+_lock = threading.Lock()
+
+
+def record_usage(key_id: str, requests: int = 1, images: int = 0, llm_calls: int = 0,
+                 input_tokens: int = 0, output_tokens: int = 0):
+    global _pending_events
+    day = datetime.now().strftime("%Y-%m-%d")
+    with _lock:
+        bucket = _pending[(key_id, day)]
+        bucket["requests"] += requests
+        bucket["images"] += images
+        bucket["llm_calls"] += llm_calls
+        bucket["input_tokens"] += input_tokens
+        bucket["output_tokens"] += output_tokens
+        _pending_events += 1
+        should_flush = (_pending_events >= METER_FLUSH_EVERY
+                        or time.monotonic() - _last_flush >= METER_FLUSH_INTERVAL)
+    if should_flush:
+        flush_usage()
+
+
+def record_llm_calls(key_id: str, endpoint: str, calls: List[Dict[str, Any]]):
+    """把一次请求内的模型调用明细 (见 utils/usage_tracker.py) 按维度累加"""
+    if not calls:
+        return
+    day = datetime.now().strftime("%Y-%m-%d")
+    with _lock:
+        for call in calls:
+            bucket = _pending_llm[(day, endpoint, key_id, call.get("model", ""), call.get("kind", ""),
+                                   call.get("prompt_version") or "")]
+            bucket["calls"] += 1
+            bucket["failures"] += 0 if call.get("success", True) else 1
+            bucket["hinted_calls"] += 1 if call.get("hint_used") else 0
+            for field in ("input_tokens", "output_tokens", "image_tokens", "image_bytes", "latency_ms", "cost"):
+                bucket[field] += call.get(field, 0) or 0
+
+
+def flush_usage():
+    """把内存中的计数批量写入数据库"""
+    global _pending_events, _last_flush
+    with _lock:
+        batch = [(key_id, day, dict(counters)) for (key_id, day), counters in _pending.items()]
+        llm_batch = [(key, dict(counters)) for key, counters in _pending_llm.items()]
+        _pending.clear()
+        _pending_llm.clear()
+        _pending_events = 0
+        _last_flush = time.monotonic()
+
+    if batch:
+        try:
+            add_api_usage(batch)
+        except Exception as e:
+            logger.error("计量数据写入失败", extra={"error": str(e), "batch_size": len(batch)})
+            # 写失败就放回去，下次再试
+            with _lock:
+                for key_id, day, counters in batch:
+                    for field, value in counters.items():
+                        _pending[(key_id, day)][field] += value
+
+    if llm_batch:
+        try:
+            add_llm_usage(llm_batch)
+        except Exception as e:
+            logger.error("模型用量写入失败", extra={"error": str(e), "batch_size": len(llm_batch)})
+            with _lock:
+                for key, counters in llm_batch:
+                    for field, value in counters.items():
+                        _pending_llm[key][field] += value
+
+
+def get_key_usage(key_id: str, since_day: Optional[str] = None) -> Dict[str, Any]:
+    """查询某个 Key 的用量 (已落库 + 尚未刷盘的部分)"""
+    daily = {row["day"]: row for row in get_api_usage(key_id, since_day)}
+    with _lock:
+        for (k, day), counters in _pending.items():
+            if k != key_id or (since_day and day < since_day):
+                continue
+            row = daily.setdefault(day, dict({"day": day}, **dict.fromkeys(METER_FIELDS, 0)))
+            for field in METER_FIELDS:
+                row[field] += counters[field]
+
+    days = [daily[d] for d in sorted(daily)]
+    totals = {field: sum(d[field] for d in days) for field in METER_FIELDS}
+    return {"key_id": key_id, "totals": totals, "daily": days}
+
+
+def get_llm_usage(key_id: str, since_day: Optional[str] = None, group_by: List[str] = None) -> List[Dict[str, Any]]:
+    """按维度汇总模型用量；查询前先把内存里的部分刷盘，保证数据完整"""
+    flush_usage()
+    return query_llm_usage(key_id, since_day, group_by or ["endpoint", "prompt_version"])
+
+
+atexit.register(flush_usage)
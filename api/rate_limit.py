@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+文件名：api/rate_limit.py
+功能：令牌桶限流 (O(1) 判定 + 空闲 Key 淘汰 + 可跨 worker 共享状态)
+说明：
+- memory 后端：单进程字典，适合本地调试
+- sqlite 后端：多个 uvicorn worker 共用同一个 SQLite 文件，真实限额不再是 N × RATE_LIMIT
+- 限流库被锁或不可用时 fail open：退回进程内令牌桶，不能因为限流把所有接口变成 500
+"""
+
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Tuple, NamedTuple
+
+from utils.logger import get_logger
+from utils.metrics import RATE_LIMIT_FAIL_OPEN
+
+logger = get_logger(__name__)
+
+RATE_LIMIT = int(os.getenv("RATE_LIMIT", "50"))  # 桶容量 (突发上限)
+TIME_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "60"))  # 在这个窗口内补满整桶
+IDLE_TTL = int(os.getenv("RATE_LIMIT_IDLE_TTL", "600"))  # 超过这么久没请求的 Key 会被淘汰
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "sqlite").strip().lower()
+RATE_LIMIT_DB = os.getenv(
+    "RATE_LIMIT_DB",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rate_limit.db")
+)
+EVICT_EVERY = 500  # 每处理多少次请求顺带清理一次空闲 Key
+
+
+class RateLimitDecision(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_after: float  # 桶补满还需要的秒数
+    retry_after: float  # 被拒绝时，距离下一个令牌可用的秒数
+
+
+def _refill(tokens: float, updated_at: float, now: float, capacity: int, rate: float) -> float:
+    return min(capacity, tokens + max(0.0, now - updated_at) * rate)
+
+
+def _decide(tokens: float, capacity: int, rate: float) -> Tuple[bool, float, RateLimitDecision]:
+    """在已补充的令牌数上做一次判定，返回 (是否放行, 扣减后令牌数, 决策)"""
+    allowed = tokens >= 1.0
+    if allowed:
+        tokens -= 1.0
+    retry_after = 0.0 if allowed else (1.0 - tokens) / rate
+    decision = RateLimitDecision(
+        allowed=allowed,
+        limit=capacity,
+        remaining=int(tokens),
+        reset_after=(capacity - tokens) / rate,
+        retry_after=retry_after,
+    )
+    return allowed, tokens, decision
+
+
+# ==========================================
+# 1. 单进程后端
+# ==========================================
+class MemoryTokenBucket:
+    def __init__(self, capacity: int = RATE_LIMIT, window: int = TIME_WINDOW, idle_ttl: int = IDLE_TTL):
+        self.capacity = capacity
+        self.rate = capacity / float(window)
+        self.idle_ttl = idle_ttl
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def hit(self, key: str, now: float = None) -> RateLimitDecision:
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (float(self.capacity), now))
+            tokens = _refill(tokens, updated_at, now, self.capacity, self.rate)
+            _, tokens, decision = _decide(tokens, self.capacity, self.rate)
+            self._buckets[key] = (tokens, now)
+
+            self._calls += 1
+            if self._calls % EVICT_EVERY == 0:
+                self._evict(now)
+        return decision
+
+    def _evict(self, now: float):
+        expired = [k for k, (_, ts) in self._buckets.items() if now - ts > self.idle_ttl]
+        for k in expired:
+            del self._buckets[k]
+
+
+# ==========================================
+# 2. 跨进程后端 (SQLite)
+# ==========================================
+class SQLiteTokenBucket:
+    def __init__(self, db_path: str = RATE_LIMIT_DB, capacity: int = RATE_LIMIT,
+                 window: int = TIME_WINDOW, idle_ttl: int = IDLE_TTL):
+        self.db_path = db_path
+        self.capacity = capacity
+        self.rate = capacity / float(window)
+        self.idle_ttl = idle_ttl
+        self._local = threading.local()
+        self._calls = itertools.count(1)  # 多线程共享，next() 在 GIL 下是原子的
+        self._fallback = MemoryTokenBucket(capacity, window, idle_ttl)
+        self._init_db()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None：手动控制事务，BEGIN IMMEDIATE 保证读改写原子性
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        self._conn().execute('''
+        CREATE TABLE IF NOT EXISTS token_buckets (
+            bucket_key TEXT PRIMARY KEY,
+            tokens REAL,
+            updated_at REAL
+        )
+        ''')
+
+    def hit(self, key: str, now: float = None) -> RateLimitDecision:
+        now = time.time() if now is None else now
+        try:
+            return self._hit_db(key, now)
+        except sqlite3.OperationalError as e:
+            # 库被锁 (超过 timeout) 或文件不可用：按单进程限流放行，别让限流器拖垮接口
+            RATE_LIMIT_FAIL_OPEN.inc()
+            logger.warning("限流库不可用，退回进程内令牌桶", extra={"error": str(e), "sample_rate": 0.1})
+            return self._fallback.hit(key, now)
+
+    def _hit_db(self, key: str, now: float) -> RateLimitDecision:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM token_buckets WHERE bucket_key = ?", (key,)
+            ).fetchone()
+            tokens, updated_at = row if row else (float(self.capacity), now)
+            tokens = _refill(tokens, updated_at, now, self.capacity, self.rate)
+            _, tokens, decision = _decide(tokens, self.capacity, self.rate)
+            conn.execute(
+                "INSERT OR REPLACE INTO token_buckets (bucket_key, tokens, updated_at) VALUES (?, ?, ?)",
+                (key, tokens, now)
+            )
+
+            if next(self._calls) % EVICT_EVERY == 0:
+                conn.execute("DELETE FROM token_buckets WHERE updated_at < ?", (now - self.idle_ttl,))
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        return decision
+
+
+def create_rate_limiter(backend: str = RATE_LIMIT_BACKEND):
+    if backend == "memory":
+        return MemoryTokenBucket()
+    return SQLiteTokenBucket()
+
+
+def rate_limit_headers(decision: RateLimitDecision) -> Dict[str, str]:
+    headers = {
+        "X-RateLimit-Limit": str(decision.limit),
+        "X-RateLimit-Remaining": str(max(0, decision.remaining)),
+        "X-RateLimit-Reset": str(int(decision.reset_after + 0.999)),
+    }
+    if not decision.allowed:
+        headers["Retry-After"] = str(int(decision.retry_after + 0.999))
+    return headers
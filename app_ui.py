@@ -8,7 +8,10 @@ import requests
 import pandas as pd
 import sys
 import os
+import io
 import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # ---------------------------------------------------------
 # 1. 基础配置
@@ -25,9 +28,90 @@ except ImportError:
     get_recent_records = None
 
 # 🔥 注意：确保这里的 URL 没有空格
-BACKEND_URL = "http://127.0.0.1:8000/analyze-multiple"
-CORRECTION_URL = "http://127.0.0.1:8000/calculate-price"
-CHAT_URL = "http://127.0.0.1:8000/chat"
+API_BASE_URL = os.getenv("SNOWBOARD_API_URL", "http://127.0.0.1:8000").rstrip("/")
+BACKEND_URL = f"{API_BASE_URL}/analyze-multiple"
+CORRECTION_URL = f"{API_BASE_URL}/calculate-price"
+CHAT_URL = f"{API_BASE_URL}/chat"
+PRICE_CURVE_URL = f"{API_BASE_URL}/price-curve"
+
+# 网络参数 (移动网络下可适当调大读超时)
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+ANALYZE_TIMEOUT = float(os.getenv("HTTP_ANALYZE_TIMEOUT", "120"))  # 多图分析要等视觉模型，读超时给足
+CHAT_TIMEOUT = float(os.getenv("HTTP_CHAT_TIMEOUT", "60"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+
+# 上传前在浏览器这一侧先缩图：手机原图动辄 4000px / 5MB，视觉模型根本用不上
+UPLOAD_MAX_SIDE = int(os.getenv("UPLOAD_MAX_SIDE", "1600"))
+UPLOAD_JPEG_QUALITY = int(os.getenv("UPLOAD_JPEG_QUALITY", "85"))
+
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """
+    整个 Streamlit 进程共用一个带连接池的 Session，keep-alive 复用 TCP/TLS 连接
+    重试只针对建连失败、429 限流和 503：这些情况下请求没被处理，重发不会重复计费
+    """
+    retry = Retry(
+        total=HTTP_RETRIES, connect=HTTP_RETRIES, read=0, status=HTTP_RETRIES,
+        status_forcelist=(429, 503), allowed_methods=frozenset({"GET", "POST"}),
+        backoff_factor=0.5, respect_retry_after_header=True, raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_price_curve(brand: str, model: str):
+    """价格曲线按 (品牌, 型号) 缓存在会话里，请求失败返回 None"""
+    cache = st.session_state.setdefault("price_curves", {})
+    key = (brand.strip().upper(), model.strip().upper())
+    if key not in cache:
+        try:
+            resp = get_http_session().post(PRICE_CURVE_URL, json={"brand": brand, "model": model},
+                                           headers={"x-api-key": api_key}, timeout=(CONNECT_TIMEOUT, CHAT_TIMEOUT))
+            body = resp.json() if resp.status_code == 200 else {}
+        except requests.RequestException:
+            return None
+        if not body.get("success"):
+            return None
+        cache[key] = body["data"]
+    return cache[key]
+
+
+def lookup_curve(curve, score: float, is_old: bool):
+    """与 pricing_engine.price_from_curve 相同：分段左闭右开，最后一段包含 10 分"""
+    segments = curve["curves"]["old" if is_old else "new"]
+    for seg in segments:
+        if seg["min_score"] <= score < seg["max_score"]:
+            return seg
+    return segments[-1]
+
+
+def prepare_upload(uploaded_file):
+    """
+    缩到 UPLOAD_MAX_SIDE 以内并重新压成 JPEG；压缩后反而更大 (或没装 Pillow) 就原样上传
+    :return: (文件名, bytes, MIME 类型)
+    """
+    raw = uploaded_file.getvalue()
+    try:
+        from PIL import Image, ImageOps
+
+        with Image.open(io.BytesIO(raw)) as img:
+            img.draft("RGB", (UPLOAD_MAX_SIDE, UPLOAD_MAX_SIDE))
+            img = ImageOps.exif_transpose(img).convert("RGB")
+            img.thumbnail((UPLOAD_MAX_SIDE, UPLOAD_MAX_SIDE))
+            buf = io.BytesIO()
+            img.save(buf, format="JPEG", quality=UPLOAD_JPEG_QUALITY, optimize=True)
+    except Exception:
+        return uploaded_file.name, raw, uploaded_file.type
+
+    data = buf.getvalue()
+    if len(data) >= len(raw):
+        return uploaded_file.name, raw, uploaded_file.type
+    name = os.path.splitext(uploaded_file.name)[0] + ".jpg"
+    return name, data, "image/jpeg"
 
 # ---------------------------------------------------------
 # 2. 侧边栏与状态初始化
@@ -48,6 +132,15 @@ st.title("🏂 AI 二手雪板智能定价系统")
 # ---------------------------------------------------------
 # 3. 页面逻辑
 # ---------------------------------------------------------
+def show_quality_tips(image_checks):
+    """把后端本地质量检查的结论逐张展示出来，方便用户马上重拍"""
+    for check in image_checks or []:
+        quality = check.get('quality') or {}
+        if quality.get('verdict') in ('warn', 'reject'):
+            label = "不合格" if quality['verdict'] == 'reject' else "提示"
+            st.warning(f"📷 {check.get('filename')}（{label}）：{'；'.join(quality.get('tips', []))}")
+
+
 tab1, tab2 = st.tabs(["📷 鉴定与咨询", "📜 历史记录"])
 
 with tab1:
@@ -61,15 +154,27 @@ with tab1:
             if uploaded_files:
                 with st.spinner('🤖 正在分析...'):
                     try:
-                        files = [('images', (f.name, f, f.type)) for f in uploaded_files]
+                        prepared = [prepare_upload(f) for f in uploaded_files]
+                        files = [('images', item) for item in prepared]
                         form_data = {'hint': user_hint} if user_hint else {}
-                        resp = requests.post(BACKEND_URL, files=files, data=form_data, headers={"x-api-key": api_key})
+                        resp = get_http_session().post(
+                            BACKEND_URL, files=files, data=form_data, headers={"x-api-key": api_key},
+                            timeout=(CONNECT_TIMEOUT, ANALYZE_TIMEOUT)
+                        )
+                        raw_kb = sum(f.size for f in uploaded_files) / 1024
+                        sent_kb = sum(len(item[1]) for item in prepared) / 1024
+                        st.session_state.upload_stats = f"上传 {sent_kb:.0f} KB (原图 {raw_kb:.0f} KB)"
 
-                        if resp.status_code == 200 and resp.json().get('success'):
-                            st.session_state.current_data = resp.json()['data']
+                        body = resp.json() if resp.status_code == 200 else {}
+                        if body.get('success'):
+                            st.session_state.current_data = body['data']
+                            st.session_state.image_checks = body.get('image_checks') or []
                             # 清空之前的聊天记录，因为换了新板子
                             st.session_state.chat_history = []
                             st.rerun()
+                        elif body.get('error'):
+                            st.error(f"分析失败: {body['error']}")
+                            show_quality_tips(body.get('image_checks'))
                         else:
                             st.error(f"分析失败: {resp.text}")
                     except Exception as e:
@@ -90,12 +195,15 @@ with tab1:
         # 1. 鉴定报告卡片
         with st.container():
             st.success("✅ 鉴定完成")
+            if st.session_state.get('upload_stats'):
+                st.caption(f"📦 {st.session_state.upload_stats}")
             c1, c2, c3 = st.columns(3)
             c1.metric("📉 最低估价", f"¥{data.get('price_low', 0)}")
             c2.metric("🏷️ 建议均价", f"¥{data.get('suggest_price', 0)}")
             c3.metric("📈 最高估价", f"¥{data.get('price_high', 0)}")
 
             st.info(f"🗣️ **专家点评**：{data.get('expert_review', '无')}")
+            show_quality_tips(st.session_state.get('image_checks'))
 
         # 2. 聊天互动区 (LangChain 核心功能)
         st.divider()
@@ -121,11 +229,17 @@ with tab1:
                             "question": prompt,
                             "context": data  # 把当前的鉴定结果整个传过去
                         }
-                        chat_resp = requests.post(CHAT_URL, json=payload, headers={"x-api-key": api_key})
+                        chat_resp = get_http_session().post(
+                            CHAT_URL, json=payload, headers={"x-api-key": api_key},
+                            timeout=(CONNECT_TIMEOUT, CHAT_TIMEOUT)
+                        )
 
                         if chat_resp.status_code == 200:
-                            ans = chat_resp.json().get("answer", "系统开小差了...")
+                            chat_data = chat_resp.json()
+                            ans = chat_data.get("answer", "系统开小差了...")
                             st.write(ans)
+                            if chat_data.get("source") == "local":
+                                st.caption("⚡ 直接取自鉴定报告，未调用大模型")
                             st.session_state.chat_history.append({"role": "assistant", "content": ans})
                         else:
                             st.error(f"API Error: {chat_resp.text}")
@@ -135,13 +249,44 @@ with tab1:
         # 3. 纠错折叠区
         st.markdown("---")
         with st.expander("🛠️ 识别错了？手动修正"):
-            with st.form("fix_form"):
-                nb = st.text_input("品牌", value=data.get('brand', ''))
-                nm = st.text_input("型号", value=data.get('model', ''))
-                ns = st.slider("成色", 1.0, 10.0, float(data.get('condition_score', 8.0)))
-                if st.form_submit_button("重新计算"):
-                    # ... (此处省略调用 calculate-price 的代码，逻辑同前) ...
-                    st.toast("功能演示：请自行补充调用逻辑")
+            nb = st.text_input("品牌", value=data.get('brand', ''))
+            nm = st.text_input("型号", value=data.get('model', ''))
+            ns = st.slider("成色", 1.0, 10.0, float(data.get('condition_score', 8.0)))
+            n_old = st.checkbox("老款", value=bool(data.get('is_old_model', False)))
+
+            # 每个 (品牌, 型号) 只请求一次价格曲线，拖动滑块时本地查表
+            curve = fetch_price_curve(nb, nm)
+            if curve:
+                seg = lookup_curve(curve, ns, n_old)
+                st.caption(f"📊 预估：¥{seg['price_low']} - ¥{seg['price_high']}（均价 ¥{seg['suggest_price']}）")
+
+            col_apply, col_review = st.columns(2)
+            if col_apply.button("重新计算") and curve:
+                data.update({"brand": nb, "model": nm, "condition_score": ns, "is_old_model": n_old,
+                             "price_low": seg['price_low'], "price_high": seg['price_high'],
+                             "suggest_price": seg['suggest_price'],
+                             # 旧点评说的是修正前的品牌和价格，不能继续挂在新价格旁边
+                             "expert_review": "点评基于修正前的识别结果，已失效；点「重新计算并重写点评」可重新生成。"})
+                st.session_state.chat_history = []
+                st.rerun()
+            if col_review.button("重新计算并重写点评"):
+                with st.spinner("正在重写点评..."):
+                    try:
+                        payload = {"brand": nb, "model": nm, "condition_score": ns, "is_old_model": n_old,
+                                   "base_damage": data.get('base_damage') or "用户手动修正",
+                                   "regenerate_review": True}
+                        resp = get_http_session().post(CORRECTION_URL, json=payload, headers={"x-api-key": api_key},
+                                                       timeout=(CONNECT_TIMEOUT, CHAT_TIMEOUT))
+                        body = resp.json() if resp.status_code == 200 else {}
+                        if body.get('success'):
+                            data.update(body['data'])
+                            data['is_old_model'] = n_old
+                            st.session_state.chat_history = []
+                            st.rerun()
+                        else:
+                            st.error(f"修正失败: {body.get('error') or resp.text}")
+                    except requests.RequestException as e:
+                        st.error(f"网络错误: {e}")
 
 with tab2:
     if get_recent_records:
@@ -8,8 +8,10 @@ import pandas as pd
 import os
 import sys
 import tempfile
+import io
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -25,13 +27,17 @@ if current_dir not in sys.path:
 try:
     from llm.qwen_vl import analyze_snowboard_image
     from utils.analysis_merge import merge_analysis_results
-    from pricing.pricing_engine import estimate_secondhand_price
+    from pricing.pricing_engine import estimate_secondhand_price, estimate_price_curve, price_from_curve
     from pricing.review_generator import generate_expert_review
-    from llm.chat_service import get_follow_up_answer
+    from llm.chat_service import answer_question
+    from utils.demo_snapshot import DEMO_CASES, run_demo_case, load_snapshot, resolve_path
+    from utils.logger import setup_logging
 except ImportError as e:
     st.error(f"模块导入失败: {e}. 请确保文件结构正确。")
     st.stop()
 
+setup_logging()
+
 # ==========================================
 # 2. 页面配置 & 密钥自动加载
 # ==========================================
@@ -58,12 +64,108 @@ with st.sidebar:
     os.environ["DASHSCOPE_API_KEY"] = api_key
     os.environ["SNOWBOARD_API_KEYS"] = api_key
 
+# 并发分析的线程数 (视觉模型调用是纯网络等待，开几个线程即可)
+ANALYZE_WORKERS = int(os.getenv("ANALYZE_WORKERS", "4"))
+
 # 初始化状态
 if "current_data" not in st.session_state:
     st.session_state.current_data = None
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
 
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def get_price_curve(brand: str, model: str):
+    return estimate_price_curve(brand, model)
+
+
+@st.cache_data(show_spinner=False)
+def get_demo_snapshot():
+    """演示快照只在进程内读一次；快照文件更新后需重启或清缓存"""
+    return load_snapshot()
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _thumbnail_bytes(path: str, mtime: float, max_side: int):
+    from PIL import Image
+
+    with Image.open(path) as img:
+        img.draft("RGB", (max_side, max_side))
+        img = img.convert("RGB")
+        img.thumbnail((max_side, max_side))
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+def thumbnail(path: str, max_side: int = 480):
+    """
+    返回缩略图 (JPEG bytes)，按 (路径, 修改时间) 缓存，避免每次 rerun 都重新解码几百 KB 的原图
+    图片不存在时返回 None；没装 Pillow 时退回原图路径
+    """
+    full = resolve_path(path)
+    if not os.path.exists(full):
+        return None
+    try:
+        return _thumbnail_bytes(full, os.path.getmtime(full), max_side)
+    except ImportError:
+        return full
+
+
+def _analyze_uploaded_bytes(name: str, image_bytes: bytes, user_hint: str):
+    """工作线程里执行：写临时文件 -> 调用视觉模型 (不碰任何 st.* 组件)"""
+    suffix = os.path.splitext(name)[1]
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        tmp.write(image_bytes)
+        temp_path = tmp.name
+    try:
+        return analyze_snowboard_image(temp_path, user_hint=user_hint)
+    finally:
+        os.remove(temp_path)
+
+
+def analyze_uploads_concurrently(uploaded_files, user_hint: str):
+    """
+    用线程池并发分析多张图片，每完成一张就在进度面板里回显，并实时刷新融合结果
+    :return: 按上传顺序排列的分析结果 (失败的图片被跳过)
+    """
+    items = [(f.name, f.getvalue()) for f in uploaded_files]
+    results = [None] * len(items)
+
+    st.markdown("#### ⏳ 分析进度")
+    progress_bar = st.progress(0.0)
+    rows = [st.empty() for _ in items]
+    for row, (name, _) in zip(rows, items):
+        row.markdown(f"⏳ {name}：排队分析中...")
+    merged_box = st.empty()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(ANALYZE_WORKERS, len(items)))) as pool:
+        futures = {pool.submit(_analyze_uploaded_bytes, name, data, user_hint): idx
+                   for idx, (name, data) in enumerate(items)}
+        # 结果回来的顺序不定；st 组件只在主线程 (脚本线程) 里更新
+        for done, future in enumerate(as_completed(futures), start=1):
+            idx = futures[future]
+            name = items[idx][0]
+            try:
+                res = future.result()
+                results[idx] = res
+                rows[idx].markdown(
+                    f"✅ **{name}**：品牌 `{res.get('brand', 'UNKNOWN')}` | 成色 `{res.get('condition_score', '-')}` | "
+                    f"板底 `{res.get('base_damage', '-')}` | 板刃 `{res.get('edge_damage', '-')}`")
+            except Exception as e:
+                rows[idx].markdown(f"❌ **{name}**：分析失败 ({e})")
+            progress_bar.progress(done / len(items))
+
+            finished = [r for r in results if r is not None]
+            if finished:
+                merged = merge_analysis_results(finished)
+                merged_box.info(
+                    f"🔄 当前融合结果 ({len(finished)}/{len(items)})：品牌 `{merged.get('brand')}` | "
+                    f"成色 `{merged.get('condition_score')}` | 板底 `{merged.get('base_damage')}`")
+
+    return [r for r in results if r is not None]
+
+
 # ==========================================
 # 3. 定义加载动画 HTML
 # ==========================================
@@ -122,23 +224,13 @@ with tab1:
 
             if st.button("🚀 开始分析", type="primary", use_container_width=True):
                 if uploaded_files:
-                    loading_placeholder.markdown(LOADING_HTML, unsafe_allow_html=True)
                     try:
-                        # 1. 视觉分析
-                        analysis_results = []
-                        for uploaded_file in uploaded_files:
-                            suffix = os.path.splitext(uploaded_file.name)[1]
-                            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-                                tmp.write(uploaded_file.read())
-                                temp_path = tmp.name
-                            try:
-                                res = analyze_snowboard_image(temp_path, user_hint=user_hint)
-                                analysis_results.append(res)
-                            finally:
-                                os.remove(temp_path)
+                        # 1. 视觉分析 (多张图并发，逐张回显)
+                        analysis_results = analyze_uploads_concurrently(uploaded_files, user_hint)
 
                         # 2. 逻辑计算
                         if analysis_results:
+                            loading_placeholder.markdown(LOADING_HTML, unsafe_allow_html=True)
                             final_analysis = merge_analysis_results(analysis_results)
                             price_result = estimate_secondhand_price(final_analysis)
                             p_low = price_result.get("price_low", 0)
@@ -162,6 +254,7 @@ with tab1:
                                 "condition_score": final_analysis.get("condition_score"),
                                 "base_damage": final_analysis.get("base_damage"),
                                 "edge_damage": final_analysis.get("edge_damage"),
+                                "is_old_model": final_analysis.get("is_old_model", False),
                                 "calculation_process": price_result.get("calculation_process", [])
                             }
                             loading_placeholder.empty()
@@ -180,32 +273,21 @@ with tab1:
             st.subheader("⚡️ 一键体验")
             st.caption("没有照片？点击下方案例，体验多视图融合分析。")
 
-            # 1. 定义演示配置 (3张图/案例)
-            DEMO_CASES = {
-                "demo_good": {
-                    "label": "✨ 挑战：热门保值神板",
-                    "paths": ["./examples/good_top.jpg", "./examples/good_base.jpg", "./examples/good_edge.jpg"],
-                    "desc": "热门准新款",
-                    "force_brand": "BURTON", "force_model": "BURTON Good Company龙年限定", "hint": "Burton Good Company龙年限定"
-                },
-                "demo_bad": {
-                    "label": "🥊 挑战：识别严重损伤",
-                    "paths": ["./examples/bad_top.jpg", "./examples/bad_base.jpg", "./examples/bad_detail.jpg"],
-                    "desc": "板底严重划痕 (多角度)",
-                    "force_brand": "Burton", "force_model": "custom", "hint": "Burton Custom , heavy scratch"
-                },
-                "demo_old": {
-                    "label": "🔍 鉴定日系经典",
-                    "paths": ["./examples/old_top.jpg", "./examples/old_base.jpg", "./examples/old_logo.jpg"],
-                    "desc": "老牌保值款",
-                    "force_brand": "ogasaka", "force_model": "fcs", "hint": "ogasaka fcs 2526新款"
-                }
-            }
+            # 1. 演示配置与预计算快照 (见 utils/demo_snapshot.py)
+            demo_snapshot = get_demo_snapshot()
+            run_live = st.checkbox("🔴 实时重新分析 (调用大模型，会产生费用)", value=False,
+                                   help="默认直接展示预先计算好的鉴定结果；勾选后对演示图片重新跑一遍完整流程")
 
 
             # 2. 演示运行函数
             def run_demo_analysis(case_key):
                 cfg = DEMO_CASES[case_key]
+
+                # 快照命中：秒出结果，零调用
+                if not run_live and case_key in demo_snapshot:
+                    st.session_state.current_data = dict(demo_snapshot[case_key])
+                    st.rerun()
+
                 image_paths = cfg["paths"]
 
                 # 展示底图
@@ -214,49 +296,17 @@ with tab1:
                     cols = st.columns(len(image_paths))
                     for idx, col in enumerate(cols):
                         with col:
-                            if os.path.exists(image_paths[idx]):
-                                st.image(image_paths[idx], caption=f"视图 {idx + 1}", use_column_width=True)
+                            thumb = thumbnail(image_paths[idx])
+                            if thumb:
+                                st.image(thumb, caption=f"视图 {idx + 1}", use_column_width=True)
                     st.info("⚡️ 演示模式：正在对 3 张视图进行【多模态融合分析】...")
 
                 loading_placeholder.markdown(LOADING_HTML, unsafe_allow_html=True)
 
                 try:
-                    analysis_results = []
-                    # 循环分析每一张图
-                    for img_path in image_paths:
-                        if os.path.exists(img_path):
-                            res = analyze_snowboard_image(img_path, user_hint=cfg["hint"])
-                            # 🔥 强制修正品牌/型号 (保留 AI 的成色判断)
-                            res["brand"] = cfg["force_brand"]
-                            res["possible_model"] = cfg["force_model"]
-                            analysis_results.append(res)
-
-                    if analysis_results:
-                        final_analysis = merge_analysis_results(analysis_results)
-                        price_result = estimate_secondhand_price(final_analysis)
-                        p_low = price_result.get("price_low", 0)
-                        p_high = price_result.get("price_high", 0)
-                        expert_comment = generate_expert_review(
-                            brand=final_analysis.get("brand"),
-                            model=final_analysis.get("possible_model"),
-                            condition_score=final_analysis.get("condition_score"),
-                            price_low=p_low, price_high=p_high,
-                            base_damage=final_analysis.get("base_damage"),
-                            edge_damage=final_analysis.get("edge_damage")
-                        )
-                        st.session_state.current_data = {
-                            "suggest_price": int((p_low + p_high) / 2),
-                            "price_low": p_low,
-                            "price_high": p_high,
-                            "expert_review": expert_comment,
-                            "brand": final_analysis.get("brand"),
-                            "model": final_analysis.get("possible_model"),
-                            "condition_score": final_analysis.get("condition_score"),
-                            "base_damage": final_analysis.get("base_damage"),
-                            "edge_damage": final_analysis.get("edge_damage"),
-                            "calculation_process": price_result.get("calculation_process", []),
-                            "demo_image_paths": image_paths  # 👈 记录图片路径用于回显
-                        }
+                    demo_data = run_demo_case(case_key)
+                    if demo_data:
+                        st.session_state.current_data = demo_data
                         loading_placeholder.empty()
                         st.rerun()
                     else:
@@ -271,11 +321,12 @@ with tab1:
             for key, cfg in DEMO_CASES.items():
                 # 检查第一张图是否存在，作为封面
                 cover_img = cfg["paths"][0]
-                if os.path.exists(cover_img):
+                cover_thumb = thumbnail(cover_img)
+                if cover_thumb:
                     with st.container():
                         c_img, c_btn = st.columns([1, 2])
                         with c_img:
-                            st.image(cover_img, use_column_width=True)
+                            st.image(cover_thumb, use_column_width=True)
                         with c_btn:
                             st.markdown(f"**{cfg['desc']}**")
                             if st.button(cfg['label'], key=key, use_container_width=True):
@@ -306,8 +357,9 @@ with tab1:
                 cols = st.columns(len(paths))
                 for idx, col in enumerate(cols):
                     with col:
-                        if os.path.exists(paths[idx]):
-                            st.image(paths[idx], use_column_width=True, caption=f"视图 {idx + 1}")
+                        thumb = thumbnail(paths[idx])
+                        if thumb:
+                            st.image(thumb, use_column_width=True, caption=f"视图 {idx + 1}")
                 st.info(
                     f"💡 **AI 综合分析结论：** 品牌锁定 `{data.get('brand')}` | 成色评分 `{data.get('condition_score')}` | 损伤检测 `{data.get('base_damage')}`")
 
@@ -322,43 +374,55 @@ with tab1:
         # 2. 手动纠错
         st.markdown("---")
         with st.expander("🛠️ 识别错了？点这里修正品牌/型号", expanded=False):
-            with st.form("fix_form"):
-                col_a, col_b, col_c = st.columns(3)
-                new_brand = col_a.text_input("品牌", value=data.get('brand', ''))
-                new_model = col_b.text_input("型号", value=data.get('model', ''))
-                new_score = col_c.slider("成色", 1.0, 10.0, float(data.get('condition_score', 8.0)))
-
-                if st.form_submit_button("🔄 修正并重新估价"):
-                    with st.spinner("正在重算..."):
-                        try:
-                            new_analysis = {
-                                "brand": new_brand, "possible_model": new_model, "condition_score": new_score,
-                                "can_use": True, "base_damage": data.get("base_damage", "用户修正"),
-                                "edge_damage": data.get("edge_damage", "用户修正"), "is_old_model": False
-                            }
-                            new_price_res = estimate_secondhand_price(new_analysis)
-                            p_low = new_price_res.get("price_low", 0)
-                            p_high = new_price_res.get("price_high", 0)
-                            new_review = generate_expert_review(
+            col_a, col_b, col_c = st.columns(3)
+            new_brand = col_a.text_input("品牌", value=data.get('brand', ''))
+            new_model = col_b.text_input("型号", value=data.get('model', ''))
+            new_score = col_c.slider("成色", 1.0, 10.0, float(data.get('condition_score', 8.0)))
+            new_is_old = st.checkbox("老款", value=bool(data.get('is_old_model', False)))
+
+            # 价格曲线按 (品牌, 型号) 缓存，拖动滑块只是本地查表，不调任何接口
+            curve = get_price_curve(new_brand, new_model)
+            preview = price_from_curve(curve, new_score, new_is_old)
+            st.caption(f"📊 预估：¥{preview['price_low']} - ¥{preview['price_high']}"
+                       f" (均价 ¥{preview['suggest_price']}，{preview['suggestion']})")
+
+            col_apply, col_review = st.columns(2)
+            apply_clicked = col_apply.button("🔄 修正并重新估价", use_container_width=True)
+            review_clicked = col_review.button("🗣️ 修正并重写点评 (调用大模型)", use_container_width=True)
+            if apply_clicked or review_clicked:
+                try:
+                    new_price_res = estimate_secondhand_price({
+                        "brand": new_brand, "possible_model": new_model, "condition_score": new_score,
+                        "can_use": True, "base_damage": data.get("base_damage", "用户修正"),
+                        "edge_damage": data.get("edge_damage", "用户修正"), "is_old_model": new_is_old
+                    })
+                    p_low = new_price_res.get("price_low", 0)
+                    p_high = new_price_res.get("price_high", 0)
+                    # 保持 demo_image_paths 不丢失
+                    updated_data = {
+                        "brand": new_brand, "model": new_model, "condition_score": new_score,
+                        "is_old_model": new_is_old,
+                        "price_low": p_low, "price_high": p_high,
+                        "suggest_price": int((p_low + p_high) / 2),
+                        "calculation_process": new_price_res.get("calculation_process", [])
+                    }
+                    if review_clicked:
+                        with st.spinner("正在重写点评..."):
+                            updated_data["expert_review"] = generate_expert_review(
                                 brand=new_brand, model=new_model, condition_score=new_score,
                                 price_low=p_low, price_high=p_high,
                                 base_damage=data.get("base_damage"), edge_damage=data.get("edge_damage")
                             )
-                            # 保持 demo_image_paths 不丢失
-                            updated_data = {
-                                "brand": new_brand, "model": new_model, "condition_score": new_score,
-                                "price_low": p_low, "price_high": p_high,
-                                "suggest_price": int((p_low + p_high) / 2),
-                                "expert_review": new_review,
-                                "calculation_process": new_price_res.get("calculation_process", [])
-                            }
-                            st.session_state.current_data.update(updated_data)
-                            st.session_state.chat_history = []
-                            st.toast("数据已修正！", icon="✅")
-                            time.sleep(1)
-                            st.rerun()
-                        except Exception as e:
-                            st.error(f"修正失败: {e}")
+                    else:
+                        # 旧点评说的是修正前的品牌和价格，不能继续挂在新价格旁边
+                        updated_data["expert_review"] = "点评基于修正前的识别结果，已失效；点「修正并重写点评」可重新生成。"
+                    st.session_state.current_data.update(updated_data)
+                    st.session_state.chat_history = []
+                    st.toast("数据已修正！", icon="✅")
+                    time.sleep(1)
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"修正失败: {e}")
 
         # 3. 聊天区
         st.divider()
@@ -373,8 +437,11 @@ with tab1:
                 st.write(prompt)
             with st.chat_message("assistant"):
                 with st.spinner("思考中..."):
-                    ans = get_follow_up_answer(prompt, data)
+                    reply = answer_question(prompt, data)
+                    ans = reply["answer"]
                     st.write(ans)
+                    if reply["source"] == "local":
+                        st.caption("⚡ 直接取自鉴定报告，未调用大模型")
                     st.session_state.chat_history.append({"role": "assistant", "content": ans})
 
 with tab2:
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+文件名：benchmarks/bench_hot_path.py
+功能：热路径微基准 (定价 / 多图融合 / VL 返回解析 / PricingData 构造)
+说明：
+- 输入为固定随机种子生成的合成数据：品牌分布长尾倾斜、型号字符串带脏数据、每个挂单 1-5 张图
+- 全程离线，不调用 DashScope
+- 报告 ops/sec 与 tracemalloc 峰值内存，可保存基线并在退化超过阈值时以非零状态码退出
+用法：
+    python benchmarks/bench_hot_path.py                          # 只跑并打印
+    python benchmarks/bench_hot_path.py --save benchmarks/baseline.json
+    python benchmarks/bench_hot_path.py --compare benchmarks/baseline.json --threshold 0.15
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Any
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+from pricing.pricing_engine import estimate_secondhand_price, ORIGINAL_PRICE_REF, BRAND_NICKNAMES, PREMIUM_MODELS
+from utils.analysis_merge import merge_analysis_results
+
+SEED = 20240229
+N_SAMPLES = 2000  # 每个基准预生成的输入条数 (循环使用)
+
+# ==========================================
+# 1. 合成数据
+# ==========================================
+DAMAGE_WORDS = ["无", "轻微", "严重", "浮锈", "腐蚀", "断裂", "板底有两条浅划痕", "UNKNOWN", ""]
+
+
+def _zipf_brands(rng: random.Random, n: int) -> List[str]:
+    """大牌占绝大多数，长尾品牌偶尔出现；夹杂昵称、大小写和空白"""
+    brands = [b for b in ORIGINAL_PRICE_REF if b != "UNKNOWN"]
+    weights = [1.0 / (rank + 1) ** 1.2 for rank in range(len(brands))]
+    picked = rng.choices(brands, weights=weights, k=n)
+    dirty = []
+    nicknames = list(BRAND_NICKNAMES)
+    for b in picked:
+        r = rng.random()
+        if r < 0.10:
+            b = rng.choice(nicknames)
+        elif r < 0.25:
+            b = f"  {b.lower()} "
+        elif r < 0.30:
+            b = "UNKNOWN"
+        dirty.append(b)
+    return dirty
+
+
+def _dirty_model(rng: random.Random) -> Any:
+    r = rng.random()
+    if r < 0.05:
+        return None
+    if r < 0.15:
+        return "未知型号"
+    base = rng.choice(list(PREMIUM_MODELS) + ["FLAGSHIP", "PROCESS", "OUTERSPACE LIVING", "SPRING BREAK"])
+    decorations = [
+        lambda s: s,
+        lambda s: f" {s.lower()} 2024/25 ",
+        lambda s: s.replace(" ", "-"),
+        lambda s: f"{s} (疑似) 🏂",
+        lambda s: f"{s} 156W camber",
+    ]
+    return rng.choice(decorations)(base)
+
+
+def _analysis(rng: random.Random, brand: str) -> Dict[str, Any]:
+    score = rng.choice([rng.randint(1, 10), round(rng.uniform(3, 10), 1), str(rng.randint(4, 9))])
+    return {
+        "reasoning": "板头左侧有明显的边缘崩裂，板底有两条浅划痕",
+        "brand": brand,
+        "possible_model": _dirty_model(rng),
+        "condition_score": score,
+        "base_damage": rng.choice(DAMAGE_WORDS),
+        "edge_damage": rng.choice(DAMAGE_WORDS),
+        "can_use": rng.random() > 0.03,
+        "is_old_model": rng.random() < 0.2,
+    }
+
+
+def make_listings(n: int = N_SAMPLES, seed: int = SEED) -> List[List[Dict[str, Any]]]:
+    """每个挂单 1-5 张图，同一挂单内偶尔有一张识别成 UNKNOWN"""
+    rng = random.Random(seed)
+    listings = []
+    for brand in _zipf_brands(rng, n):
+        views = []
+        for _ in range(rng.choice([1, 2, 3, 3, 3, 4, 5])):
+            views.append(_analysis(rng, "UNKNOWN" if rng.random() < 0.15 else brand))
+        listings.append(views)
+    return listings
+
+
+def make_vl_texts(listings: List[List[Dict[str, Any]]], seed: int = SEED) -> List[str]:
+    """模拟 VL 模型原始返回：有的带 ```json 围栏，有的是裸 JSON"""
+    rng = random.Random(seed + 1)
+    texts = []
+    for views in listings:
+        body = json.dumps(views[0], ensure_ascii=False, indent=2)
+        texts.append(f"```json\n{body}\n```" if rng.random() < 0.7 else body)
+    return texts
+
+
+# ==========================================
+# 2. 计时工具
+# ==========================================
+def run_bench(name: str, fn: Callable[[Any], Any], inputs: List[Any],
+              min_time: float = 0.5, repeats: int = 5) -> Dict[str, Any]:
+    """重复多轮取最快一轮的吞吐；再单独跑一轮 tracemalloc 统计内存"""
+    # 预热 + 估算一轮需要多少次调用
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_time / repeats:
+        fn(inputs[calls % len(inputs)])
+        calls += 1
+    calls = max(calls, len(inputs) // 4)
+
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        for i in range(calls):
+            fn(inputs[i % len(inputs)])
+        best = min(best, time.perf_counter() - t0)
+
+    alloc_calls = min(calls, 1000)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base_current, _ = tracemalloc.get_traced_memory()
+    for i in range(alloc_calls):
+        fn(inputs[i % len(inputs)])
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "name": name,
+        "ops_per_sec": calls / best,
+        "us_per_op": best / calls * 1e6,
+        "peak_kib": (peak - base_current) / 1024,
+        "retained_bytes_per_op": max(0, current - base_current) / alloc_calls,
+    }
+
+
+# ==========================================
+# 3. 基准定义
+# ==========================================
+def collect_benchmarks() -> Dict[str, tuple]:
+    listings = make_listings()
+    merged = [merge_analysis_results(views) for views in listings]
+    # 单图定价只取数值型评分 (字符串评分在融合阶段会被过滤，定价引擎本身不接受)
+    singles = [v for views in listings for v in views if not isinstance(v["condition_score"], str)]
+    benches = {
+        "estimate_secondhand_price[single]": (estimate_secondhand_price, singles),
+        "estimate_secondhand_price[merged]": (estimate_secondhand_price, merged),
+        "merge_analysis_results": (merge_analysis_results, listings),
+    }
+
+    from utils.json_utils import parse_model_json
+    texts = make_vl_texts(listings)
+    benches["parse_model_json"] = (parse_model_json, texts)
+
+    try:
+        from llm.qwen_vl import clean_json_text
+        benches["clean_json_text+json.loads"] = (lambda t: json.loads(clean_json_text(t)), texts)
+    except ImportError as e:
+        print(f"⚠️ 跳过 VL 返回解析基准 (缺少依赖: {e})")
+
+    try:
+        from api.app import PricingData
+        payloads = []
+        for views, m in zip(listings, merged):
+            price = estimate_secondhand_price(m)
+            payloads.append({
+                "suggest_price": int((price["price_low"] + price["price_high"]) / 2),
+                "price_low": price["price_low"],
+                "price_high": price["price_high"],
+                "expert_review": "板子成色一般，板底划痕修一下大概 100 块。",
+                "calculation_process": price.get("calculation_process", []),
+                "pricing_reason": price.get("pricing_reason"),
+                "brand": m.get("brand"),
+                "model": m.get("possible_model"),
+                "condition_score": m.get("condition_score"),
+                "base_damage": m.get("base_damage"),
+            })
+        benches["PricingData(**payload)"] = (lambda p: PricingData(**p), payloads)
+    except ImportError as e:
+        print(f"⚠️ 跳过 PricingData 构造基准 (缺少依赖: {e})")
+
+    return benches
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    regressions = []
+    for r in results:
+        base = baseline.get("results", {}).get(r["name"])
+        if not base:
+            continue
+        change = r["ops_per_sec"] / base["ops_per_sec"] - 1
+        r["change"] = change
+        if change < -threshold:
+            regressions.append(f"{r['name']}: {base['ops_per_sec']:.0f} → {r['ops_per_sec']:.0f} ops/s ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="定价/融合/解析 热路径微基准")
+    parser.add_argument("--save", help="把结果保存为基线 JSON")
+    parser.add_argument("--compare", help="与已有基线 JSON 对比")
+    parser.add_argument("--threshold", type=float, default=0.15, help="ops/sec 下降超过该比例视为退化")
+    parser.add_argument("--min-time", type=float, default=0.5, help="每个基准的大致计时时长 (秒)")
+    parser.add_argument("--filter", default="", help="只跑名字包含该子串的基准")
+    args = parser.parse_args()
+
+    results = []
+    # 定价引擎在老款板上会打印日志，基准期间丢弃标准输出，避免 I/O 干扰计时
+    with open(os.devnull, "w") as devnull:
+        for name, (fn, inputs) in collect_benchmarks().items():
+            if args.filter and args.filter not in name:
+                continue
+            with contextlib.redirect_stdout(devnull):
+                r = run_bench(name, fn, inputs, min_time=args.min_time)
+            results.append(r)
+            print(f"{name:<40} {r['ops_per_sec']:>12,.0f} ops/s  {r['us_per_op']:>8.2f} µs/op  "
+                  f"peak {r['peak_kib']:>8.1f} KiB")
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for r in results:
+            if "change" in r:
+                print(f"   {r['name']:<37} 相对基线 {r['change']:+.1%}")
+
+    if args.save:
+        payload = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "results": {r["name"]: r for r in results},
+        }
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+        print(f"💾 基线已保存到 {args.save}")
+
+    if regressions:
+        print(f"❌ 以下基准退化超过 {args.threshold:.0%}:")
+        for line in regressions:
+            print(f"   {line}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+文件名：benchmarks/import_budget.py
+功能：API 服务冷启动预算检查 (超预算或重型 SDK 被提前导入时以非零状态码退出，可直接挂到 CI)
+用法：
+    python benchmarks/import_budget.py                 # 默认预算 IMPORT_BUDGET_MS=1500
+    python benchmarks/import_budget.py --budget-ms 800 --runs 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 这些模块只能在首次调用或后台预热时导入，出现在冷启动里就算回归
+FORBIDDEN_AT_IMPORT = ["dashscope", "langchain_community", "langchain_core", "langchain"]
+
+# 子进程里执行：导入 app，报告耗时与已加载的重型模块
+PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import api.app
+elapsed = (time.perf_counter() - t0) * 1000
+heavy = sorted({m.split('.')[0] for m in sys.modules} & set(%r))
+print(json.dumps({"elapsed_ms": elapsed, "heavy": heavy}))
+"""
+
+
+def measure_once(module_probe: str) -> dict:
+    env = dict(os.environ, SNOWBOARD_WARMUP="0")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", module_probe],
+        cwd=PROJECT_ROOT, env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"导入 api.app 失败:\n{proc.stderr[-2000:]}")
+
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["importtime"] = proc.stderr
+    return result
+
+
+def top_imports(importtime_log: str, n: int = 10):
+    """解析 -X importtime 输出，返回累计耗时最高的 n 个模块"""
+    # 行格式: "import time:   self [us] | cumulative | module"
+    rows = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        rows.append((int(parts[1].strip()), parts[2].strip()))
+    rows.sort(reverse=True)
+    return rows[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API 冷启动导入耗时预算检查")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "1500")))
+    parser.add_argument("--runs", type=int, default=3, help="取多次中的最小值，排除磁盘缓存抖动")
+    args = parser.parse_args()
+
+    probe = PROBE % (FORBIDDEN_AT_IMPORT,)
+    results = [measure_once(probe) for _ in range(args.runs)]
+    best = min(results, key=lambda r: r["elapsed_ms"])
+
+    print(f"⏱️ import api.app: 最快 {best['elapsed_ms']:.0f} ms (预算 {args.budget_ms:.0f} ms, {args.runs} 次)")
+    print("累计耗时最高的模块：")
+    for cumulative_us, name in top_imports(best["importtime"]):
+        print(f"   {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failed = False
+    if best["heavy"]:
+        print(f"❌ 冷启动阶段导入了重型 SDK: {', '.join(best['heavy'])}")
+        failed = True
+    if best["elapsed_ms"] > args.budget_ms:
+        print(f"❌ 冷启动超出预算 {best['elapsed_ms'] - args.budget_ms:.0f} ms")
+        failed = True
+
+    if failed:
+        sys.exit(1)
+    print("✅ 冷启动在预算内")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+文件名：benchmarks/load_test.py
+功能：端到端压测驱动 (/analyze-multiple、/chat)，报告吞吐与 p50/p95/p99 延迟
+准备：先用本地替身启动服务，避免真实计费，并把限流放宽：
+    SNOWBOARD_FAKE_LLM=1 RATE_LIMIT=1000000 SNOWBOARD_API_KEYS=loadtest \\
+        uvicorn api.app:app --port 8000 --workers 4
+用法：
+    python benchmarks/load_test.py --concurrency 1,4,16 --images 1,3,5 --requests 50
+    python benchmarks/load_test.py --endpoint chat --concurrency 8,32 --json result.json
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any
+
+import requests
+from requests.adapters import HTTPAdapter
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLE_CONTEXT = {
+    "brand": "BURTON", "model": "CUSTOM", "condition_score": 8.0,
+    "price_low": 1400, "price_high": 1700, "suggest_price": 1550,
+    "base_damage": "轻微", "expert_review": "成色不错，板底两条发丝痕，这价可以收。",
+}
+SAMPLE_QUESTIONS = ["能便宜点吗", "为什么这么贵？", "适合新手吗", "这板子是哪年的"]
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """最近秩法分位数 (输入需已排序)"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def load_images(pattern: str) -> List[tuple]:
+    paths = sorted(glob.glob(pattern))
+    if not paths:
+        sys.exit(f"❌ 没有找到图片: {pattern}")
+    images = []
+    for p in paths:
+        with open(p, "rb") as f:
+            images.append((os.path.basename(p), f.read()))
+    return images
+
+
+def make_session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def run_level(base_url: str, api_key: str, endpoint: str, concurrency: int, n_images: int,
+              n_requests: int, images: List[tuple], timeout: float) -> Dict[str, Any]:
+    session = make_session(concurrency)
+    headers = {"x-api-key": api_key}
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def one(i: int):
+        start = time.perf_counter()
+        try:
+            if endpoint == "analyze":
+                picked = [images[(i + k) % len(images)] for k in range(n_images)]
+                files = [("images", (name, data, "image/jpeg")) for name, data in picked]
+                resp = session.post(f"{base_url}/analyze-multiple", files=files, headers=headers, timeout=timeout)
+            else:
+                payload = {"question": SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)], "context": SAMPLE_CONTEXT}
+                resp = session.post(f"{base_url}/chat", json=payload, headers=headers, timeout=timeout)
+            ok = resp.status_code == 200 and resp.json().get("success")
+            outcome = "ok" if ok else f"http_{resp.status_code}" if resp.status_code != 200 else "app_error"
+        except requests.RequestException as e:
+            outcome = type(e).__name__
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            statuses[outcome] = statuses.get(outcome, 0) + 1
+            if outcome == "ok":
+                latencies.append(elapsed)
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(n_requests)))
+    wall = time.perf_counter() - wall_start
+
+    latencies.sort()
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "images": n_images if endpoint == "analyze" else 0,
+        "requests": n_requests,
+        "ok": statuses.get("ok", 0),
+        "errors": {k: v for k, v in statuses.items() if k != "ok"},
+        "throughput_rps": n_requests / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "wall_s": wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="雪板估价 API 端到端压测")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--api-key", default=os.getenv("LOADTEST_API_KEY", "loadtest"))
+    parser.add_argument("--endpoint", choices=["analyze", "chat", "both"], default="analyze")
+    parser.add_argument("--concurrency", default="1,4,16", help="逗号分隔的并发档位")
+    parser.add_argument("--images", default="1,3,5", help="逗号分隔的每请求图片数 (仅 analyze)")
+    parser.add_argument("--requests", type=int, default=50, help="每个档位的请求数")
+    parser.add_argument("--image-glob", default=os.path.join(PROJECT_ROOT, "examples", "*.jpg"))
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    levels = [int(c) for c in args.concurrency.split(",") if c]
+    image_counts = [int(n) for n in args.images.split(",") if n]
+    endpoints = ["analyze", "chat"] if args.endpoint == "both" else [args.endpoint]
+    images = load_images(args.image_glob)
+
+    results = []
+    print(f"{'endpoint':<8} {'conc':>4} {'imgs':>4} {'ok':>5} {'err':>4} {'req/s':>8} "
+          f"{'p50':>8} {'p95':>8} {'p99':>8}")
+    for endpoint in endpoints:
+        for n_images in (image_counts if endpoint == "analyze" else [0]):
+            for concurrency in levels:
+                r = run_level(args.url, args.api_key, endpoint, concurrency, n_images,
+                              args.requests, images, args.timeout)
+                results.append(r)
+                print(f"{endpoint:<8} {concurrency:>4} {r['images']:>4} {r['ok']:>5} "
+                      f"{sum(r['errors'].values()):>4} {r['throughput_rps']:>8.2f} "
+                      f"{r['p50_ms']:>7.0f}ms {r['p95_ms']:>7.0f}ms {r['p99_ms']:>7.0f}ms")
+                if r["errors"]:
+                    print(f"         错误分布: {r['errors']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+文件名：llm/answer_cache.py
+功能：追问答案的相似度缓存 (离线字符 n-gram，不依赖远程 Embedding 服务)
+说明：
+- 用户问来问去就那几句：“能便宜点吗”“还能再便宜吗”，而且常常是对几乎同一份鉴定结果在问
+- 缓存键 = 鉴定上下文指纹 (品牌/型号/成色/价格区间/损伤) + 归一化后的问题；
+  同一上下文下，新问题与已缓存问题的字符二元组相似度 >= 阈值即视为同一个问题，直接返回答案
+- 问题里带的数字/金额 (报价、分数，含“两千”“1.5w”这类写法) 必须完全一致，“2000 卖吗”和“三千卖吗”不能共用答案
+- 条目有 TTL，总条数按 LRU 淘汰；CHAT_CACHE=off 可关闭
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from llm.chat_fastpath import normalize_question, char_bigrams, dice_similarity, extract_amounts
+
+CHAT_CACHE = os.getenv("CHAT_CACHE", "on").strip().lower() not in ("off", "0", "false")
+CHAT_CACHE_THRESHOLD = float(os.getenv("CHAT_CACHE_THRESHOLD", "0.8"))
+CHAT_CACHE_TTL = int(os.getenv("CHAT_CACHE_TTL", "3600"))
+CHAT_CACHE_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "2000"))
+
+# 影响回答内容的上下文字段；点评文案每次生成都不一样，不参与指纹
+CONTEXT_FIELDS = ("brand", "model", "condition_score", "price_low", "price_high", "base_damage", "edge_damage")
+
+# 语气词、客套话不影响问题本身；单字语气词只在句首/句尾去掉，避免误伤词语内部 (优点、缺点...)
+LEADING_FILLERS = ("请问", "老炮儿", "老炮", "大佬", "那个", "这个")
+TRAILING_PARTICLES = ("吗", "呢", "吧", "啊", "呀", "哈", "嘛", "哦", "了")
+INNER_FILLERS = ("请问", "一下", "一点儿", "一点")
+# “还能再便宜吗” 里的 还/再 只是语气，仅在紧跟 能/可/会/要/便/少 时去掉
+_ADVERB_FILLER_RE = re.compile(r"[还再](?=[能可会要便少])")
+
+
+def context_fingerprint(appraisal_context: Dict[str, Any]) -> str:
+    canonical = {}
+    for field in CONTEXT_FIELDS:
+        value = appraisal_context.get(field)
+        if isinstance(value, str):
+            value = value.strip().upper()
+        elif isinstance(value, float) and value.is_integer():
+            value = int(value)  # 8.0 和 8 是同一个成色
+        canonical[field] = value
+    raw = json.dumps(canonical, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def canonical_question(question: str) -> Tuple[str, Tuple[str, ...]]:
+    """:return: (去掉语气词后的问题, 问题里出现的数字/金额 (含中文数字、k/w))"""
+    # 金额要从原始问题里取：归一化会去掉小数点，“1.5w” 会变成 “15w”
+    numbers = tuple(f"{amount:g}" for amount in extract_amounts(question))
+    text = normalize_question(question)
+    for word in INNER_FILLERS:
+        text = text.replace(word, "")
+    text = _ADVERB_FILLER_RE.sub("", text)
+
+    changed = True
+    while changed and text:
+        changed = False
+        for word in LEADING_FILLERS:
+            if text.startswith(word):
+                text, changed = text[len(word):], True
+        for word in TRAILING_PARTICLES:
+            if text.endswith(word):
+                text, changed = text[:-len(word)], True
+    return text, numbers
+
+
+class AnswerCache:
+    def __init__(self, threshold: float = CHAT_CACHE_THRESHOLD, ttl: int = CHAT_CACHE_TTL,
+                 max_entries: int = CHAT_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # (上下文指纹, 归一化问题) -> 条目，按最近使用排序
+        self._entries: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._by_context: Dict[str, set] = {}  # 上下文指纹 -> 该上下文下的条目键
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop(self, key: Tuple[str, str]):
+        self._entries.pop(key, None)
+        keys = self._by_context.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_context[key[0]]
+
+    def get(self, question: str, appraisal_context: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """:return: {"answer", "similarity", "question"}；未命中返回 None"""
+        ctx_key = context_fingerprint(appraisal_context)
+        text, numbers = canonical_question(question)
+        if not text:
+            return None
+        grams = char_bigrams(text)
+        now = time.time()
+
+        with self._lock:
+            best_key, best_sim = None, 0.0
+            for key in list(self._by_context.get(ctx_key, ())):
+                entry = self._entries[key]
+                if now - entry["created_at"] > self.ttl:
+                    self._drop(key)
+                    continue
+                if entry["numbers"] != numbers:
+                    continue
+                sim = 1.0 if key[1] == text else dice_similarity(grams, entry["grams"])
+                if sim > best_sim:
+                    best_key, best_sim = key, sim
+            if best_key is None or best_sim < self.threshold:
+                return None
+            self._entries.move_to_end(best_key)
+            entry = self._entries[best_key]
+            return {"answer": entry["answer"], "similarity": round(best_sim, 3), "question": entry["question"]}
+
+    def put(self, question: str, appraisal_context: Dict[str, Any], answer: str):
+        ctx_key = context_fingerprint(appraisal_context)
+        text, numbers = canonical_question(question)
+        if not text or not answer:
+            return
+        key = (ctx_key, text)
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = {"question": question, "numbers": numbers, "grams": char_bigrams(text),
+                                  "answer": answer, "created_at": time.time()}
+            self._by_context.setdefault(ctx_key, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_context.clear()
+
+
+answer_cache = AnswerCache()
+
+
+def lookup_answer(question: str, appraisal_context: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if not CHAT_CACHE or not appraisal_context:
+        return None
+    return answer_cache.get(question, appraisal_context)
+
+
+def store_answer(question: str, appraisal_context: Dict[str, Any], answer: str):
+    if CHAT_CACHE and appraisal_context:
+        answer_cache.put(question, appraisal_context, answer)
+
+
+if __name__ == "__main__":
+    # 自检：python -m llm.answer_cache
+    assert canonical_question("1.5w卖吗")[1] == ("15000",)
+    assert canonical_question("1.5w卖吗") != canonical_question("15w卖吗")
+    assert canonical_question("两千卖吗")[1] == canonical_question("2000卖吗")[1] == ("2000",)
+    assert canonical_question("还能再便宜点吗") == canonical_question("能便宜点吗")
+    print("answer_cache 自检通过")
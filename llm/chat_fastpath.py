@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+文件名：llm/chat_fastpath.py
+功能：追问的本地快速通道 (关键词 + 字符 n-gram 意图识别，直接从鉴定结果里取答案)
+说明：
+- “建议价多少”“为啥这么便宜”“这牌子算几线”这类问题，答案就在 calculation_process / pricing_reason /
+  品牌梯队表里，没必要每次花一次 qwen-plus 调用、等好几秒
+- classify_question() 给每个意图打分：命中关键词得基础分，再加上与示例问法的字符二元组相似度；
+  分数不够、两个意图分不开、或者带有开放式/议价的信号 (保养、推荐、报了个具体价格...) 时一律交给大模型
+- 上下文缺字段时同样放弃本地回答，宁可多花一次调用也不瞎编
+- CHAT_FASTPATH=off 可关闭
+"""
+import os
+import re
+from typing import Any, Dict, List, Optional, Set
+
+from pricing.pricing_engine import BRAND_NICKNAMES, BRAND_TIERS, TIER_FACTORS
+
+CHAT_FASTPATH = os.getenv("CHAT_FASTPATH", "on").strip().lower() not in ("off", "0", "false")
+FASTPATH_MIN_SCORE = float(os.getenv("CHAT_FASTPATH_MIN_SCORE", "0.6"))
+FASTPATH_MIN_MARGIN = 0.15  # 第一名要比第二名至少高这么多，否则视为意图不明
+MAX_QUESTION_CHARS = 40  # 长问题多半是开放式的
+
+KEYWORD_WEIGHT = 0.6
+NGRAM_WEIGHT = 0.4
+
+# 意图 -> 关键词 / 示例问法；allow_why 表示“为什么”类问题也属于该意图
+INTENTS = {
+    "price": {
+        "keywords": ["建议价", "均价", "卖多少", "多少钱", "值多少", "什么价", "估价多少", "价格多少", "区间",
+                     "最低", "最高", "报价", "能卖", "price", "worth"],
+        "examples": ["建议价是多少", "这板子能卖多少钱", "估价区间是多少", "最低能卖多少", "值多少钱"],
+    },
+    "why_price": {
+        "keywords": ["这么低", "这么便宜", "这么贵", "太低", "太便宜", "太贵", "怎么算", "怎么来的", "依据",
+                     "计算过程", "算法", "why"],
+        "examples": ["为什么这么便宜", "价格怎么算出来的", "为啥估这么低", "估价依据是什么", "怎么这么贵"],
+        "allow_why": True,
+    },
+    "tier": {
+        "keywords": ["梯队", "档次", "几线", "保值", "等级", "什么档", "tier"],
+        "examples": ["这个牌子是几线品牌", "品牌保值吗", "属于什么档次", "保值率多少"],
+    },
+    "condition": {
+        "keywords": ["成色", "几成新", "几分", "评分", "打分", "新旧"],
+        "examples": ["成色几分", "几成新", "成色评分多少", "给了多少分"],
+    },
+    "damage": {
+        "keywords": ["损伤", "划痕", "板底", "板刃", "生锈", "锈", "伤", "磕"],
+        "examples": ["板底有什么损伤", "板刃生锈了吗", "有没有划痕", "伤在哪"],
+    },
+    "identity": {
+        "keywords": ["什么牌子", "哪个牌子", "什么品牌", "哪个品牌", "型号", "哪款", "什么板"],
+        "examples": ["这是什么牌子", "型号是什么", "识别出来是哪款", "什么品牌的板"],
+    },
+}
+
+# 出现这些词说明是开放式问题 (建议/比较/假设)，本地模板答不好
+OPEN_ENDED_MARKERS = ["保养", "修", "打蜡", "推荐", "适合", "值不值", "值得", "划算", "对比", "比较", "还是",
+                      "如果", "假如", "哪年", "新手", "怎么办", "能不能", "会不会", "影响", "严不严重", "要不要"]
+WHY_MARKERS = ["为什么", "为啥", "怎么会", "why"]
+_PUNCT_RE = re.compile(r"[\s\W_]+", re.UNICODE)
+ASKING_PRICE_MIN = 100  # 问题里出现 >= 100 的金额 (“2000 卖不卖”“两千五出吗”)，需要大模型来“捍卫估价”
+
+# 金额：阿拉伯数字 (可带 k/w/千/万) 或中文数字 (两千、一千五、三百块)
+_ARABIC_AMOUNT_RE = re.compile(r"(\d+(?:\.\d+)?)(k|w|千|万)?")
+_THOUSANDS_SEP_RE = re.compile(r"(?<=\d)[,，](?=\d{3})")  # 1,500 -> 1500
+_CN_AMOUNT_RE = re.compile(r"[零一二两三四五六七八九十百千万]+")
+_CN_DIGITS = {"零": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_CN_UNITS = {"十": 10, "百": 100, "千": 1000}
+_AMOUNT_SUFFIX = {"k": 1000, "千": 1000, "w": 10000, "万": 10000}
+
+TIER_LABELS = {
+    "TIER_1": "一线理财板",
+    "TIER_2": "日系/高端",
+    "TIER_3": "国际大牌",
+    "TIER_4": "二线品牌",
+    "TIER_5": "国产/入门",
+}
+
+
+# ==========================================
+# 1. 意图识别
+# ==========================================
+def _cn_to_number(text: str) -> int:
+    """中文数字 -> 整数；支持口语省略写法：一千五 = 1500，两万五 = 25000"""
+    total, section, digit = 0, 0, 0
+    last_unit, prev_is_unit, after_unit = 1, False, False
+    for ch in text:
+        if ch in _CN_DIGITS:
+            # after_unit：这个数字是否紧跟在单位后面 (一千五 是，一千零五 不是)
+            digit, after_unit, prev_is_unit = _CN_DIGITS[ch], prev_is_unit, False
+        elif ch in _CN_UNITS:
+            last_unit = _CN_UNITS[ch]
+            section += (digit or 1) * last_unit
+            digit, prev_is_unit = 0, True
+        else:  # 万
+            total += (section + digit) * 10000
+            section, digit, last_unit, prev_is_unit = 0, 0, 10000, True
+    if digit:
+        # 紧跟在单位后面的尾数按下一级单位算 (一千五 的 五 是 500)
+        section += digit * (last_unit // 10 if after_unit and last_unit >= 10 else 1)
+    return total + section
+
+
+def extract_amounts(text: str) -> List[float]:
+    """
+    问题里出现的数字/金额 (已换算成数值)，如 “两千块” -> [2000]，“1.5w” -> [15000]
+    需传入原始问题：normalize_question 会去掉小数点
+    """
+    text = _THOUSANDS_SEP_RE.sub("", str(text or "").lower())
+    amounts = []
+    for number, suffix in _ARABIC_AMOUNT_RE.findall(text):
+        amounts.append(float(number) * _AMOUNT_SUFFIX.get(suffix, 1))
+    for match in _CN_AMOUNT_RE.finditer(_ARABIC_AMOUNT_RE.sub(" ", text)):
+        word = match.group()
+        # 单独的 “一” (一下、一点、一般) 不是金额；带单位或是多位数字才算
+        if len(word) == 1 and word in _CN_DIGITS:
+            continue
+        amounts.append(float(_cn_to_number(word)))
+    return amounts
+
+
+def normalize_question(text: str) -> str:
+    return _PUNCT_RE.sub("", str(text or "").lower())
+
+
+def char_bigrams(text: str) -> Set[str]:
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def dice_similarity(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+# 示例问法的 n-gram 预先算好
+_EXAMPLE_GRAMS = {name: [char_bigrams(normalize_question(ex)) for ex in spec["examples"]] for name, spec in INTENTS.items()}
+
+
+def classify_question(question: str) -> Optional[Dict[str, Any]]:
+    """
+    :return: {"intent", "score", "scores"}；问题不适合本地回答时返回 None
+    """
+    text = normalize_question(question)
+    if not text or len(text) > MAX_QUESTION_CHARS:
+        return None
+    if any(amount >= ASKING_PRICE_MIN for amount in extract_amounts(question)):
+        return None
+    if any(marker in text for marker in OPEN_ENDED_MARKERS):
+        return None
+
+    grams = char_bigrams(text)
+    scores = {}
+    for name, spec in INTENTS.items():
+        keyword_hit = any(k in text for k in spec["keywords"])
+        similarity = max(dice_similarity(grams, ex) for ex in _EXAMPLE_GRAMS[name])
+        scores[name] = round(KEYWORD_WEIGHT * keyword_hit + NGRAM_WEIGHT * similarity, 3)
+
+    ranked: List = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+    intent, score = ranked[0]
+    if score < FASTPATH_MIN_SCORE or score - ranked[1][1] < FASTPATH_MIN_MARGIN:
+        return None
+    # “为什么板刃会生锈”这种要解释原因的，只有定价依据能本地回答
+    if not INTENTS[intent].get("allow_why") and any(marker in text for marker in WHY_MARKERS):
+        return None
+    return {"intent": intent, "score": score, "scores": scores}
+
+
+# ==========================================
+# 2. 从鉴定结果里取答案
+# ==========================================
+def _brand_tier(brand: str) -> Optional[str]:
+    key = str(brand or "").strip().upper()
+    key = BRAND_NICKNAMES.get(key, key)
+    return BRAND_TIERS.get(key) if key and key != "UNKNOWN" else None
+
+
+def _answer_price(ctx: Dict[str, Any]) -> Optional[str]:
+    if not ctx.get("price_high"):
+        return None
+    suggest = ctx.get("suggest_price") or int((ctx.get("price_low", 0) + ctx["price_high"]) / 2)
+    return f"建议挂 ¥{suggest}，合理区间 ¥{ctx.get('price_low', 0)} - ¥{ctx['price_high']}。低于下限是在送钱，高于上限就等着没人问吧。"
+
+
+def _answer_why_price(ctx: Dict[str, Any]) -> Optional[str]:
+    steps = ctx.get("calculation_process") or []
+    reason = ctx.get("pricing_reason")
+    if not steps and not reason:
+        return None
+    lines = [str(reason)] if reason else []
+    if steps:
+        lines.append("账是这么算的：")
+        lines.extend(str(s) for s in steps)
+    return "\n".join(lines)
+
+
+def _answer_tier(ctx: Dict[str, Any]) -> Optional[str]:
+    tier = _brand_tier(ctx.get("brand"))
+    if not tier:
+        return None
+    factor = TIER_FACTORS.get(tier)
+    return (f"{str(ctx['brand']).upper()} 属于 {tier} ({TIER_LABELS.get(tier, tier)})，"
+            f"品牌保值系数 {factor}，二手大概按原价的这个比例再乘成色折旧来算。")
+
+
+def _answer_condition(ctx: Dict[str, Any]) -> Optional[str]:
+    score = ctx.get("condition_score")
+    if score is None:
+        return None
+    parts = [f"成色给的是 {score}/10"]
+    if ctx.get("base_damage"):
+        parts.append(f"板底：{ctx['base_damage']}")
+    if ctx.get("edge_damage"):
+        parts.append(f"板刃：{ctx['edge_damage']}")
+    return "，".join(parts) + "。"
+
+
+def _answer_damage(ctx: Dict[str, Any]) -> Optional[str]:
+    if not ctx.get("base_damage") and not ctx.get("edge_damage"):
+        return None
+    parts = []
+    if ctx.get("base_damage"):
+        parts.append(f"板底：{ctx['base_damage']}")
+    if ctx.get("edge_damage"):
+        parts.append(f"板刃：{ctx['edge_damage']}")
+    return "看图能看到的就这些 —— " + "；".join(parts) + "。"
+
+
+def _answer_identity(ctx: Dict[str, Any]) -> Optional[str]:
+    brand = ctx.get("brand")
+    if not brand or str(brand).upper() == "UNKNOWN":
+        return None
+    model = ctx.get("model")
+    return f"认出来是 {brand}" + (f"，型号大概是 {model}" if model else "，具体型号看不出来") + "。"
+
+
+ANSWERERS = {
+    "price": _answer_price,
+    "why_price": _answer_why_price,
+    "tier": _answer_tier,
+    "condition": _answer_condition,
+    "damage": _answer_damage,
+    "identity": _answer_identity,
+}
+
+
+def try_local_answer(question: str, appraisal_context: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    :return: {"answer", "intent", "score"}；识别不了或上下文缺数据时返回 None (交给大模型)
+    """
+    if not CHAT_FASTPATH or not appraisal_context:
+        return None
+    classified = classify_question(question)
+    if not classified:
+        return None
+    answer = ANSWERERS[classified["intent"]](appraisal_context)
+    if not answer:
+        return None
+    return {"answer": answer, "intent": classified["intent"], "score": classified["score"]}
+
+
+if __name__ == "__main__":
+    # 自检：python -m llm.chat_fastpath
+    assert extract_amounts("1.5w卖吗") == [15000]
+    assert extract_amounts("2.5k出不出") == [2500]
+    assert extract_amounts("1,500 卖吗") == [1500]
+    assert extract_amounts("一千五") == [1500] and extract_amounts("两万五") == [25000]
+    assert classify_question("1.5w卖吗") is None
+    assert classify_question("建议价是多少")["intent"] == "price"
+    # 问的是损伤的后果，不是损伤本身，交给大模型
+    assert classify_question("板底伤得重不重，会影响滑行吗") is None
+    assert classify_question("板底有什么损伤")["intent"] == "damage"
+    print("chat_fastpath 自检通过")
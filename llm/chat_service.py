@@ -5,13 +5,26 @@
 功能：基于鉴定结果的问答服务 (LangChain 实现)
 """
 import os
+import time
 from dotenv import load_dotenv
-from langchain_community.chat_models import ChatTongyi
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+
+from utils.usage_tracker import record_llm_call, usage_from_message
+from llm.fake_backend import fake_llm_enabled, make_fake_chat_model, record_response
+from llm.chat_fastpath import try_local_answer
+from llm.answer_cache import lookup_answer, store_answer
+from utils.metrics import CHAT_ANSWERS, CACHE_HITS, CACHE_MISSES
 
 load_dotenv()
 
+# 修改 Prompt 内容时同步改版本号 (用量统计按版本分组)
+CHAT_PROMPT_VERSION = "chat_v1"
+
+
+def warm_up():
+    """后台预热：提前导入 LangChain / ChatTongyi (首个 /chat 请求不用再等导入)"""
+    from langchain_community.chat_models import ChatTongyi  # noqa: F401
+    from langchain_core.prompts import ChatPromptTemplate  # noqa: F401
+
 
 def get_follow_up_answer(user_question: str, appraisal_context: dict):
     """
@@ -19,18 +32,29 @@ def get_follow_up_answer(user_question: str, appraisal_context: dict):
     :param user_question: 用户的具体问题 (例如：这就想卖2000？)
     :param appraisal_context: 之前鉴定生成的完整 JSON 数据 (作为 AI 的短期记忆)
     """
+    return _ask_llm(user_question, appraisal_context)[0]
+
+
+def _ask_llm(user_question: str, appraisal_context: dict):
+    """:return: (回答文本, 是否真的由大模型成功回答)；失败时回答是给用户看的提示语"""
 
     # 1. 准备 API Key
     api_key = os.getenv("DASHSCOPE_API_KEY") or os.getenv("SNOWBOARD_API_KEYS")
     if not api_key:
-        return "API Key 缺失，无法回复。"
+        return "API Key 缺失，无法回复。", False
+
+    # 2. 初始化模型 (LangChain 按需导入，避免拖慢服务冷启动)
+    from langchain_community.chat_models import ChatTongyi
+    from langchain_core.prompts import ChatPromptTemplate
 
-    # 2. 初始化模型
-    chat_model = ChatTongyi(
-        model="qwen-plus",  # 用 Plus 模型保证对话逻辑更强
-        dashscope_api_key=api_key,
-        temperature=0.7
-    )
+    if fake_llm_enabled():
+        chat_model = make_fake_chat_model("chat")  # 压测/离线模式：本地替身
+    else:
+        chat_model = ChatTongyi(
+            model="qwen-plus",  # 用 Plus 模型保证对话逻辑更强
+            dashscope_api_key=api_key,
+            temperature=0.7
+        )
 
     # 3. 将复杂的 JSON 上下文转化为自然语言摘要
     # 这一步是为了让 AI 更容易理解数据
@@ -67,13 +91,45 @@ def get_follow_up_answer(user_question: str, appraisal_context: dict):
         """)
     ])
 
-    # 5. 构建并执行链
-    chain = prompt | chat_model | StrOutputParser()
+    # 5. 构建并执行链 (保留 AIMessage，以便读取 token 用量)
+    chain = prompt | chat_model
 
+    call_start = time.time()
     try:
-        return chain.invoke({
+        message = chain.invoke({
             "context_str": context_str,
             "question": user_question
         })
+        record_llm_call(model="qwen-plus", kind="chat", usage=usage_from_message(message),
+                        latency_ms=(time.time() - call_start) * 1000, prompt_version=CHAT_PROMPT_VERSION)
+        record_response("chat", "qwen-plus", message.content)
+        return message.content, True
     except Exception as e:
-        return f"（老炮儿这会儿有点忙，没听清你说啥... 错误: {e}）"
\ No newline at end of file
+        record_llm_call(model="qwen-plus", kind="chat", prompt_version=CHAT_PROMPT_VERSION,
+                        latency_ms=(time.time() - call_start) * 1000, success=False)
+        return f"（老炮儿这会儿有点忙，没听清你说啥... 错误: {e}）", False
+
+
+def answer_question(user_question: str, appraisal_context: dict) -> dict:
+    """
+    追问入口：事实类问题 (价格/定价依据/品牌梯队/成色/损伤) 先走本地快速通道，
+    其次查相似问题的答案缓存，都没有再调大模型
+    :return: {"answer", "source": "local"/"cache"/"llm", "intent"}
+    """
+    local = try_local_answer(user_question, appraisal_context)
+    if local:
+        CHAT_ANSWERS.inc(source="local", intent=local["intent"])
+        return {"answer": local["answer"], "source": "local", "intent": local["intent"]}
+
+    cached = lookup_answer(user_question, appraisal_context)
+    if cached:
+        CACHE_HITS.inc(cache="chat_answer")
+        CHAT_ANSWERS.inc(source="cache", intent="open")
+        return {"answer": cached["answer"], "source": "cache", "intent": None}
+    CACHE_MISSES.inc(cache="chat_answer")
+
+    CHAT_ANSWERS.inc(source="llm", intent="open")
+    answer, ok = _ask_llm(user_question, appraisal_context)
+    if ok:
+        store_answer(user_question, appraisal_context, answer)  # 出错提示不进缓存
+    return {"answer": answer, "source": "llm", "intent": None}
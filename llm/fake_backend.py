@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+文件名：llm/fake_backend.py
+功能：DashScope / 通义千问的本地替身 (压测、离线联调用，不产生任何费用)
+说明：
+- SNOWBOARD_FAKE_LLM=1 时，qwen_vl 使用 FakeMultiModalConversation，点评/问答使用假的 ChatTongyi
+- 延迟分布：FAKE_VL_LATENCY / FAKE_CHAT_LATENCY，格式 "lognormal:中位数ms:sigma" | "normal:均值ms:标准差" | "fixed:ms"
+- 故障注入：FAKE_LLM_ERROR_RATE (返回非 200)、FAKE_LLM_MALFORMED_RATE (返回不合法 JSON)
+- 录制回放：FAKE_LLM_RECORD=xxx.jsonl 时真实调用的文本会被追加录制；
+  FAKE_LLM_ANSWERS=xxx.jsonl 时替身从录制文件中随机回放，而不是用内置的罐头答案
+"""
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List
+
+FAKE_LLM_ENABLED = os.getenv("SNOWBOARD_FAKE_LLM", "0") == "1"
+FAKE_VL_LATENCY = os.getenv("FAKE_VL_LATENCY", "lognormal:2500:0.35")
+FAKE_CHAT_LATENCY = os.getenv("FAKE_CHAT_LATENCY", "lognormal:1500:0.3")
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0.02"))
+FAKE_LLM_MALFORMED_RATE = float(os.getenv("FAKE_LLM_MALFORMED_RATE", "0.05"))
+FAKE_LLM_ANSWERS = os.getenv("FAKE_LLM_ANSWERS")
+FAKE_LLM_RECORD = os.getenv("FAKE_LLM_RECORD")
+
+_rng = random.Random(int(os.getenv("FAKE_LLM_SEED", "0")) or None)
+_rng_lock = threading.Lock()
+_record_lock = threading.Lock()
+
+# ==========================================
+# 1. 罐头答案
+# ==========================================
+CANNED_VL_ANSWERS = [
+    {"reasoning": "板面几乎无痕，板底仅有发丝痕", "brand": "BURTON", "possible_model": "CUSTOM",
+     "condition_score": "9", "base_damage": "轻微", "edge_damage": "无", "can_use": True, "is_old_model": False},
+    {"reasoning": "板头有崩边，板底两条浅划痕，刃有浮锈", "brand": "CAPITA", "possible_model": "DOA",
+     "condition_score": 7, "base_damage": "轻微", "edge_damage": "浮锈", "can_use": True, "is_old_model": False},
+    {"reasoning": "板底露芯，刃部腐蚀", "brand": "SALOMON", "possible_model": "HUCK KNIFE",
+     "condition_score": "4", "base_damage": "严重", "edge_damage": "腐蚀", "can_use": True, "is_old_model": True},
+    {"reasoning": "日系刻滑板，成色良好", "brand": "OGASAKA", "possible_model": "FC",
+     "condition_score": 8, "base_damage": "无", "edge_damage": "无", "can_use": True, "is_old_model": False},
+    {"reasoning": "LOGO 看不清", "brand": "UNKNOWN", "possible_model": "UNKNOWN",
+     "condition_score": 6, "base_damage": "轻微", "edge_damage": "浮锈", "can_use": True, "is_old_model": False},
+]
+
+# 真实环境里见过的各种“坏” JSON：漏逗号、尾逗号、前后夹带解释文字、被截断
+CANNED_MALFORMED_VL = [
+    '{\n  "brand": "BURTON",\n  "possible_model": "CUSTOM",\n  "condition_score": "8",\n'
+    '  "can_use": true\n  "is_old_model": false,\n}',
+    '好的，以下是鉴定结果：\n```json\n{"brand": "GRAY", "possible_model": "DESPERADO", '
+    '"condition_score": 9, "can_use": true}\n```\n如有疑问请继续提问。',
+    '{"brand": "NITRO", "possible_model": "TEAM", "condition_score": 7, "base_damage": "轻',
+    "{'brand': 'K2', 'possible_model': 'BROADCAST', 'condition_score': 6, 'can_use': True}",
+]
+
+CANNED_CHAT_ANSWERS = [
+    "这板子成色摆在那，板底那几道划痕修一下也就一百来块，这价真不算贵。",
+    "看图看不出来生产年份，别难为我。",
+    "想再便宜？品牌梯队在那放着，保值率就这么高，爱要不要。",
+    "新手拿来练平花够用了，想刻滑的话这硬度不太够。",
+]
+
+
+def _load_recorded(kind: str) -> List[str]:
+    if not FAKE_LLM_ANSWERS or not os.path.exists(FAKE_LLM_ANSWERS):
+        return []
+    answers = []
+    with open(FAKE_LLM_ANSWERS, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if item.get("kind") == kind and item.get("text"):
+                answers.append(item["text"])
+    return answers
+
+
+_RECORDED = {kind: _load_recorded(kind) for kind in ("vl", "review", "chat")}
+
+
+def record_response(kind: str, model: str, text: str):
+    """录制真实模型返回 (仅在设置了 FAKE_LLM_RECORD 时生效)"""
+    if not FAKE_LLM_RECORD or FAKE_LLM_ENABLED or not text:
+        return
+    line = json.dumps({"kind": kind, "model": model, "text": text, "ts": time.time()}, ensure_ascii=False)
+    with _record_lock:
+        with open(FAKE_LLM_RECORD, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+# ==========================================
+# 2. 延迟与随机
+# ==========================================
+def sample_latency_ms(spec: str) -> float:
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(":") if v]
+    with _rng_lock:
+        if kind == "fixed":
+            return values[0]
+        if kind == "normal":
+            return max(0.0, _rng.gauss(values[0], values[1]))
+        # 默认 lognormal: 中位数 + sigma，长尾更贴近真实 API
+        median, sigma = (values + [0.3])[:2] if values else (1000.0, 0.3)
+        return _rng.lognormvariate(0.0, sigma) * median
+
+
+def _chance(rate: float) -> bool:
+    with _rng_lock:
+        return _rng.random() < rate
+
+
+def _choice(items: List[Any]) -> Any:
+    with _rng_lock:
+        return _rng.choice(items)
+
+
+def _fake_tokens(text: str) -> int:
+    return max(1, len(text) // 2)
+
+
+# ==========================================
+# 3. 假的 MultiModalConversation
+# ==========================================
+class FakeResponse(dict):
+    """模仿 DashScope 响应：既能 response.output 也能 "output" in response"""
+
+    def __getattr__(self, item):
+        try:
+            return self[item]
+        except KeyError:
+            raise AttributeError(item)
+
+
+class FakeMultiModalConversation:
+    @staticmethod
+    def call(model: str, messages: List[Dict[str, Any]], **kwargs) -> FakeResponse:
+        time.sleep(sample_latency_ms(FAKE_VL_LATENCY) / 1000.0)
+
+        if _chance(FAKE_LLM_ERROR_RATE):
+            return FakeResponse(status_code=_choice([429, 500, 503]), code="Throttling.FakeError",
+                                message="fake backend injected error", output=None, usage=None)
+
+        if _RECORDED["vl"]:
+            text = _choice(_RECORDED["vl"])
+        elif _chance(FAKE_LLM_MALFORMED_RATE):
+            text = _choice(CANNED_MALFORMED_VL)
+        else:
+            text = "```json\n" + json.dumps(_choice(CANNED_VL_ANSWERS), ensure_ascii=False, indent=2) + "\n```"
+
+        prompt_text = "".join(c.get("text", "") for m in messages for c in m.get("content", []))
+        output = FakeResponse(choices=[
+            FakeResponse(message=FakeResponse(role="assistant", content=[{"text": text}]), finish_reason="stop")
+        ])
+        usage = FakeResponse(input_tokens=_fake_tokens(prompt_text) + 1200, output_tokens=_fake_tokens(text),
+                             image_tokens=1200)
+        return FakeResponse(status_code=200, code="", message="", output=output, usage=usage,
+                            request_id=f"fake-{time.time_ns()}")
+
+
+# ==========================================
+# 4. 假的 ChatTongyi (LangChain Runnable)
+# ==========================================
+def make_fake_chat_model(kind: str = "chat"):
+    """返回一个可以接在 prompt | 之后的 Runnable，输出带 token_usage 的 AIMessage"""
+    from langchain_core.messages import AIMessage
+    from langchain_core.runnables import RunnableLambda
+
+    def _invoke(prompt_value) -> AIMessage:
+        time.sleep(sample_latency_ms(FAKE_CHAT_LATENCY) / 1000.0)
+        if _chance(FAKE_LLM_ERROR_RATE):
+            raise RuntimeError("fake backend injected error")
+        text = _choice(_RECORDED[kind] or CANNED_CHAT_ANSWERS)
+        prompt_text = prompt_value.to_string() if hasattr(prompt_value, "to_string") else str(prompt_value)
+        return AIMessage(content=text, response_metadata={
+            "token_usage": {"input_tokens": _fake_tokens(prompt_text), "output_tokens": _fake_tokens(text)}
+        })
+
+    return RunnableLambda(_invoke)
+
+
+def fake_llm_enabled() -> bool:
+    return FAKE_LLM_ENABLED
+
@@ -2,34 +2,73 @@
 """
 文件名：llm/qwen_vl.py
 功能：调用阿里云千问 VL 模型分析图片（含重试机制与型号识别）
-状态：改进版 (支持用户线索注入)
+状态：改进版 (支持用户线索注入 + 快/强两级模型级联)
 """
 import os
-import json
 import time
-import dashscope
-from dashscope import MultiModalConversation
+import threading
+from typing import Callable
 from dotenv import load_dotenv
 
+from utils.usage_tracker import record_llm_call, normalize_usage
+from llm.fake_backend import fake_llm_enabled, FakeMultiModalConversation, record_response
+from utils.metrics import (stage_timer, VL_RETRIES, FALLBACK_RESULTS, JSON_PARSE_OUTCOMES, SCHEMA_ISSUES,
+                           VL_CASCADE_CALLS, VL_ESCALATIONS)
+from utils.json_utils import parse_model_json, coerce_to_schema, OUTCOME_REPAIRED
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
 # ===============================
 # 1. 初始化配置
 # ===============================
 # 加载环境变量
 load_dotenv()
 
-# 获取并设置 API Key
-api_key = os.getenv("DASHSCOPE_API_KEY")
-if not api_key:
-    # 尝试读取 SNOWBOARD_API_KEYS (兼容处理)
-    api_key = os.getenv("SNOWBOARD_API_KEYS")
+# 模型级联：先用便宜的快模型，品牌认不出 / JSON 不合法 / 多视图结论冲突时再升级到强模型 (网络错误不升级)
+VL_MODEL = os.getenv("VL_MODEL", "qwen-vl-max")
+VL_FAST_MODEL = os.getenv("VL_FAST_MODEL", "qwen-vl-plus")
+VL_CASCADE = os.getenv("VL_CASCADE", "on").strip().lower() in ("1", "on", "true", "yes")
+VL_SCORE_SPREAD = float(os.getenv("VL_SCORE_SPREAD", "2"))  # 多视图成色分差超过这个值视为冲突
+UNKNOWN_BRANDS = {"UNKNOWN", "NULL", "NONE", "未知", ""}
+
+# dashscope SDK 导入较慢，延迟到第一次调用 (或后台预热) 时才加载，保证服务冷启动够快
+_sdk_lock = threading.Lock()
+_multimodal_conversation = None
+
+
+def get_multimodal_conversation():
+    """首次调用时导入 dashscope 并设置 API Key，之后直接返回缓存的 MultiModalConversation"""
+    global _multimodal_conversation
+    if _multimodal_conversation is not None:
+        return _multimodal_conversation
+
+    with _sdk_lock:
+        if _multimodal_conversation is None and fake_llm_enabled():
+            # 压测/离线模式：使用本地替身，不导入 SDK、不产生费用
+            _multimodal_conversation = FakeMultiModalConversation
+        elif _multimodal_conversation is None:
+            import dashscope
+            from dashscope import MultiModalConversation
 
-if not api_key:
-    # 这里为了防崩，如果没读到环境变量，可以打印警告而不是直接抛异常，或者保持原样
-    # raise ValueError("错误：未找到环境变量 DASHSCOPE_API_KEY。请检查 .env 文件。")
-    print("⚠️ 警告：未找到 DASHSCOPE_API_KEY，后续调用可能会失败。")
+            # 获取并设置 API Key
+            api_key = os.getenv("DASHSCOPE_API_KEY")
+            if not api_key:
+                # 尝试读取 SNOWBOARD_API_KEYS (兼容处理)
+                api_key = os.getenv("SNOWBOARD_API_KEYS")
 
-dashscope.api_key = api_key
-print("【DEBUG】DashScope SDK 初始化成功")
+            if not api_key:
+                # 这里为了防崩，如果没读到环境变量，可以打印警告而不是直接抛异常
+                logger.warning("未找到 DASHSCOPE_API_KEY，后续调用可能会失败")
+
+            dashscope.api_key = api_key
+            _multimodal_conversation = MultiModalConversation
+    return _multimodal_conversation
+
+
+def warm_up():
+    """后台预热：提前加载 dashscope SDK"""
+    get_multimodal_conversation()
 
 
 # ===============================
@@ -50,7 +89,9 @@ def clean_json_text(text: str) -> str:
 # ===============================
 # 3. 定义 Prompt (提示词)
 # ===============================
-# 修改 llm/qwen_vl.py 中的 DEFAULT_PROMPT
+# 修改 Prompt 内容时同步改版本号，用量统计按版本分组，便于对比 token 与效果
+VL_PROMPT_VERSION = "vl_default_v2"
+CONDITION_PROMPT_VERSION = "vl_condition_v1"
 
 DEFAULT_PROMPT = """
 你是一名极其严苛的二手滑雪板鉴定专家。你的任务是根据图片客观描述损伤，并依据严格标准进行评分。
@@ -83,28 +124,136 @@ NOBADAY, VECTOR, REV, TERROR.
   "reasoning": "一句话描述你看到的损伤证据（例如：板头左侧有明显的边缘崩裂，板底有两条浅划痕）",
   "brand": "品牌英文大写 (例如 BURTON)",
   "possible_model": "型号猜测",
-  "condition_score": "1-10的整数",
+  "condition_score": 1-10的整数,
   "base_damage": "板底具体损伤 (无/轻微/严重)",
   "edge_damage": "板刃具体损伤 (无/浮锈/腐蚀/断裂)",
-  "can_use": true
-  "is_old_model": true 或 false (判断依据：板面设计风格是否陈旧，或者明显的旧款LOGO。如果无法判断，返回 false),
+  "can_use": true 或 false,
+  "is_old_model": true 或 false (判断依据：板面设计风格是否陈旧，或者明显的旧款LOGO。如果无法判断，返回 false)
 }
 """
 
+# 品牌已由本地 LOGO 匹配确认时使用：不再列品牌表，只让模型评估成色、猜型号 (Prompt 短一半)
+CONDITION_PROMPT = """
+你是一名极其严苛的二手滑雪板鉴定专家。这块板的品牌已确认为 {brand}，无需再辨认品牌。
+你的任务是根据图片客观描述损伤，并依据严格标准进行评分。请忽略水印文字（如“闲鱼”、“小红书”等）。
+
+【第一步：强制视觉推理】
+1. **板面 (Top sheet)**：是否有边缘崩裂(Chipping)？固定器安装区是否有压痕？
+2. **板底 (Base)**：是否有露芯深划痕(Core Shot)？还是仅仅是发丝痕(Hairline)？
+3. **板刃 (Edge)**：是否有断裂？是否有锈迹（浮锈还是腐蚀）？
+
+【第二步：严格评分标准 (Rubric)】
+- **9-10分**：充新。仅有极其轻微的使用痕迹，无肉眼可见划痕。
+- **7-8分**：良好。板面有少量轻微划痕，板刃无锈或仅有浮锈，板底无深伤。
+- **5-6分**：伊拉克成色。板面边缘有崩裂，板底有明显划痕但未漏芯，板刃有锈。
+- **1-4分**：报废。板刃断裂、板底漏芯、板层开裂。
+
+【第三步：输出格式】
+请输出且仅输出以下 JSON 格式：
+{{
+  "reasoning": "一句话描述你看到的损伤证据",
+  "possible_model": "{brand} 旗下的型号猜测",
+  "condition_score": 1-10的整数,
+  "base_damage": "板底具体损伤 (无/轻微/严重)",
+  "edge_damage": "板刃具体损伤 (无/浮锈/腐蚀/断裂)",
+  "can_use": true 或 false,
+  "is_old_model": true 或 false (板面设计风格是否陈旧，无法判断时返回 false)
+}}
+"""
 
 
 # ===============================
 # 4. 核心函数：分析图片
 # ===============================
-def analyze_snowboard_image(image_path: str, user_hint: str = None) -> dict:
+def escalation_reason(result: dict, known_brand: str = None):
+    """快模型的结果是否需要交给强模型重看；返回原因，不需要时返回 None"""
+    if result.get("error") == "NETWORK_ERROR":
+        # 网络故障换个模型也解决不了，只会让故障期间的费用翻倍；同模型的重试已在 _analyze_with_model 里做过
+        return None
+    if result.get("error"):
+        return result["error"].lower()  # json_parse_error / empty_response
+    if not known_brand and str(result.get("brand", "")).strip().upper() in UNKNOWN_BRANDS:
+        return "unknown_brand"
+    if "condition_score" not in result:
+        return "missing_score"
+    return None
+
+
+def views_disagree(results: list) -> bool:
+    """多视图之间品牌不一致，或成色分差超过阈值"""
+    brands = {str(r.get("brand", "")).strip().upper() for r in results} - UNKNOWN_BRANDS
+    scores = [r["condition_score"] for r in results if isinstance(r.get("condition_score"), (int, float))]
+    return len(brands) > 1 or (len(scores) > 1 and max(scores) - min(scores) > VL_SCORE_SPREAD)
+
+
+def escalate_disagreeing_views(results: list, rerun) -> list:
+    """
+    同一块板的多张图互相矛盾时，把快模型给出的那几张交给强模型重看
+    :param results: 各视图的分析结果 (顺序与图片一致)
+    :param rerun: rerun(i) -> 用 VL_MODEL 重新分析第 i 张图的结果，失败时返回 None
+    :return: 新的结果列表；强模型失败的位置保留原结果
+    """
+    if not VL_CASCADE or len(results) < 2 or not views_disagree(results):
+        return results
+    upgraded = []
+    for i, result in enumerate(results):
+        if result.get("_vl_model") != VL_FAST_MODEL:
+            upgraded.append(result)
+            continue
+        VL_ESCALATIONS.inc(reason="view_disagreement")
+        VL_CASCADE_CALLS.inc(tier="strong")
+        strong = rerun(i)
+        if not strong or strong.get("error"):
+            upgraded.append(result)
+            continue
+        strong["_escalated"] = "view_disagreement"
+        upgraded.append(strong)
+    return upgraded
+
+
+def analyze_snowboard_image(image_path: str, user_hint: str = None, known_brand: str = None,
+                            model: str = None, before_call: Callable[[], None] = None) -> dict:
     """
     调用千问 VL 模型分析雪板图片
     :param image_path: 图片路径
     :param user_hint: 用户提供的线索 (可选)
+    :param known_brand: 已在本地确认的品牌 (可选)，传入后模型只做成色评估
+    :param model: 指定模型 (可选)；不指定时按级联策略：先快模型，结果不可靠再升级到 VL_MODEL
+    :param before_call: 每次真正请求模型前调用 (可选)，批量任务用它做限速；级联升级、重试都各算一次
+    :return: 分析结果，"_vl_model" 记录最终采用的是哪个模型
     """
+    if model or not VL_CASCADE:
+        return _analyze_with_model(image_path, user_hint, known_brand, model or VL_MODEL, before_call)
+
+    result = _analyze_with_model(image_path, user_hint, known_brand, VL_FAST_MODEL, before_call)
+    VL_CASCADE_CALLS.inc(tier="fast")
+    reason = escalation_reason(result, known_brand)
+    if reason is None:
+        return result
+
+    VL_ESCALATIONS.inc(reason=reason)
+    VL_CASCADE_CALLS.inc(tier="strong")
+    logger.info("快模型结果不可靠，升级到强模型", extra={"reason": reason, "sample_rate": 0.1})
+    strong = _analyze_with_model(image_path, user_hint, known_brand, VL_MODEL, before_call)
+    # 强模型也失败了 (比如网络问题)，而快模型至少有结果时，保留快模型的
+    if strong.get("error") and not result.get("error"):
+        return result
+    strong["_escalated"] = reason
+    return strong
+
+
+def _analyze_with_model(image_path: str, user_hint: str, known_brand: str, model: str,
+                        before_call: Callable[[], None] = None) -> dict:
+    """用指定模型分析一张图片 (含重试、用量登记与 JSON 容错解析)"""
 
     # 🔥 动态构建 Prompt：如果用户给了线索，拼接到 Prompt 里
-    final_prompt = DEFAULT_PROMPT
+    final_prompt = CONDITION_PROMPT.format(brand=known_brand) if known_brand else DEFAULT_PROMPT
+    prompt_version = CONDITION_PROMPT_VERSION if known_brand else VL_PROMPT_VERSION
+    call_attrs = {
+        "prompt_version": prompt_version,
+        "hint_used": bool(user_hint and user_hint.strip()),
+        "image_bytes": os.path.getsize(image_path) if os.path.exists(image_path) else 0,
+    }
     if user_hint and user_hint.strip():
         final_prompt += f"""
         \n【用户额外提示】
@@ -121,52 +270,75 @@ def analyze_snowboard_image(image_path: str, user_hint: str = None) -> dict:
 
     # --- 开始重试循环 ---
     for attempt in range(max_retries):
+        # 先赋值：before_call (限速) 抛异常时 except 分支也要用到
+        call_start = time.time()
+        response = None
         try:
-            print(f"🚀 正在调用阿里云视觉模型 (第 {attempt + 1} 次尝试)...")
+            if before_call is not None:
+                before_call()
+                call_start = time.time()  # 限速等待不计入模型耗时
+            logger.debug("调用视觉模型", extra={"attempt": attempt + 1, "sample_rate": 0.1})
 
             # 兼容 Windows 路径
             local_file_path = f"file://{image_path}" if not image_path.startswith("file://") else image_path
 
-            response = MultiModalConversation.call(
-                model="qwen-vl-max",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"image": local_file_path},
-                            {"text": final_prompt}  # 使用包含线索的 Prompt
-                        ]
-                    }
-                ],
-                # 🔥【核心修改】加上这两行参数，给视觉模型“降温”
-                temperature = 0.01,  # 接近 0 表示极度理性，每次输出几乎一致
-                top_p = 0.1,  # 限制它的发散思维，只选概率最高的词
+            if attempt > 0:
+                VL_RETRIES.inc()
+            with stage_timer("vl_attempt"):
+                response = get_multimodal_conversation().call(
+                    model=model,
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": [
+                                {"image": local_file_path},
+                                {"text": final_prompt}  # 使用包含线索的 Prompt
+                            ]
+                        }
+                    ],
+                    # 🔥【核心修改】加上这两行参数，给视觉模型“降温”
+                    temperature = 0.01,  # 接近 0 表示极度理性，每次输出几乎一致
+                    top_p = 0.1,  # 限制它的发散思维，只选概率最高的词
+                )
+
+            # 登记本次调用的 token 用量 (用于按 Key 计量)
+            record_llm_call(
+                model=model, kind="vl",
+                usage=normalize_usage(getattr(response, "usage", None)),
+                latency_ms=(time.time() - call_start) * 1000,
+                success=response.status_code == 200,
+                **call_attrs,
             )
 
             # 检查 HTTP 状态码
             if response.status_code == 200:
-                print("✅ 模型调用成功！")
+                logger.info("视觉模型调用成功", extra={
+                    "attempt": attempt + 1, "latency_ms": round((time.time() - call_start) * 1000),
+                    "sample_rate": 0.1,
+                })
                 break  # 成功了就跳出循环
             else:
                 error_msg = f"API错误码: {response.code} - {response.message}"
-                print(f"⚠️ {error_msg}")
                 raise RuntimeError(error_msg)
 
         except Exception as e:
-            print(f"❌ 第 {attempt + 1} 次请求异常: {str(e)}")
+            if response is None:
+                record_llm_call(model=model, kind="vl",
+                                latency_ms=(time.time() - call_start) * 1000, success=False, **call_attrs)
+            logger.warning("视觉模型请求异常", extra={"attempt": attempt + 1, "error": str(e)})
             last_error = e
             if attempt < max_retries - 1:
-                print(f"⏳ 等待 {retry_delay} 秒后重试...")
                 time.sleep(retry_delay)
             else:
-                print("💀 重试次数耗尽。")
+                logger.error("视觉模型重试次数耗尽", extra={"attempts": max_retries})
 
     # --- 循环结束后的处理 ---
 
     # 如果最后一次 response 依然是空的或者失败
     if response is None or response.status_code != 200:
         # 为了不让程序崩掉，返回一个兜底的错误 JSON
-        print(f"【严重错误】无法获取模型结果: {last_error}")
+        logger.error("无法获取视觉模型结果，返回兜底数据", extra={"error": str(last_error)})
+        FALLBACK_RESULTS.inc(reason="NETWORK_ERROR")
         return {
             "brand": "UNKNOWN",
             "possible_model": "UNKNOWN",
@@ -178,6 +350,7 @@ def analyze_snowboard_image(image_path: str, user_hint: str = None) -> dict:
 
     # 检查 output 字段
     if "output" not in response or not response.output.choices:
+        FALLBACK_RESULTS.inc(reason="EMPTY_RESPONSE")
         return {
             "brand": "UNKNOWN",
             "error": "EMPTY_RESPONSE"
@@ -191,19 +364,30 @@ def analyze_snowboard_image(image_path: str, user_hint: str = None) -> dict:
         if "text" in item:
             raw_text += item["text"]
 
-    # 清洗并解析 JSON
-    clean_text = clean_json_text(raw_text)
+    record_response("vl", model, raw_text)
 
-    try:
-        data = json.loads(clean_text)
+    # 容错解析 JSON：提取 -> 修复 -> 类型纠正，尽量不浪费已经付过费的返回
+    with stage_timer("json_parse"):
+        data, outcome = parse_model_json(raw_text)
+    JSON_PARSE_OUTCOMES.inc(kind="vl", outcome=outcome)
+    if data is not None:
+        if outcome == OUTCOME_REPAIRED:
+            logger.info("视觉模型返回经修复后解析成功", extra={"outcome": outcome, "sample_rate": 0.1})
+        if known_brand:
+            data["brand"] = known_brand
+        data, issues = coerce_to_schema(data)
+        for issue in issues:
+            SCHEMA_ISSUES.inc(kind="vl", issue=issue)
+        data["_vl_model"] = model
         return data
-    except Exception as e:
-        print(f"【JSON解析失败】原始文本: {raw_text}")
-        # 返回兜底数据
-        return {
-            "brand": "UNKNOWN",
-            "possible_model": "UNKNOWN",
-            "condition_score": 5,
-            "can_use": True,
-            "error": "JSON_PARSE_ERROR"
-        }
\ No newline at end of file
+
+    logger.warning("视觉模型返回 JSON 解析失败", extra={"raw_text": raw_text[:500]})
+    FALLBACK_RESULTS.inc(reason="JSON_PARSE_ERROR")
+    # 返回兜底数据
+    return {
+        "brand": "UNKNOWN",
+        "possible_model": "UNKNOWN",
+        "condition_score": 5,
+        "can_use": True,
+        "error": "JSON_PARSE_ERROR"
+    }
\ No newline at end of file
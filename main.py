@@ -1,12 +1,38 @@
-from llm.qwen_vl import analyze_snowboard_image
+# -*- coding: utf-8 -*-
+"""
+文件名：main.py
+功能：命令行鉴定 (单张图片 / 批量库存目录 / CSV 清单)
+用法：
+    python main.py board.jpg                                    # 单张，打印分析与定价
+    python main.py --folder ./inventory --output result.jsonl   # 子目录 = 一个商品，顶层图片各算一个商品
+    python main.py --manifest listings.csv --output result.csv --workers 4 --rate 30 --no-review
+说明：
+- CSV 清单列：listing_id, image_paths (多张图用 ; 分隔，相对路径相对清单所在目录), hint (可选)
+- 进度写入检查点文件 (默认 <output>.ckpt)，中断后用同样的命令重跑会跳过已完成的商品
+- 结果逐条追加写入输出文件；先写结果再记检查点，极端情况下崩溃可能导致最后一条重复
+- --rate 限制每分钟视觉模型调用次数 (令牌桶，复用 api/rate_limit.py)
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Dict, Iterator, List, Optional
+
+from llm.qwen_vl import analyze_snowboard_image, escalate_disagreeing_views, VL_MODEL
 from pricing.pricing_engine import estimate_secondhand_price
+from utils.logger import setup_logging
 
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+CSV_FIELDS = ["listing_id", "brand", "model", "condition_score", "price_low", "price_high", "suggest_price",
+              "base_damage", "edge_damage", "images", "errors", "expert_review"]
 
-def main():
-    image_path = r"C:\DownLoads\snowboard\1.jpg"
 
+def single_image(image_path: str, hint: str = None):
     # 1. 图像分析（模型）
-    analysis_result = analyze_snowboard_image(image_path)
+    analysis_result = analyze_snowboard_image(image_path, user_hint=hint)
 
     # # 2. 定价分析（规则）
     price_result = estimate_secondhand_price(analysis_result)
@@ -22,5 +48,241 @@ def main():
         print(f"{k}: {v}")
 
 
+# ==========================================
+# 1. 读取待鉴定商品
+# ==========================================
+def iter_folder(folder: str) -> Iterator[Dict[str, Any]]:
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if os.path.isdir(path):
+            images = [os.path.join(path, f) for f in sorted(os.listdir(path)) if f.lower().endswith(IMAGE_EXTS)]
+            if images:
+                yield {"listing_id": name, "images": images, "hint": None}
+        elif name.lower().endswith(IMAGE_EXTS):
+            yield {"listing_id": os.path.splitext(name)[0], "images": [path], "hint": None}
+
+
+def iter_manifest(manifest: str) -> Iterator[Dict[str, Any]]:
+    base_dir = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, "r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            listing_id = (row.get("listing_id") or "").strip()
+            paths = [p.strip() for p in (row.get("image_paths") or "").split(";") if p.strip()]
+            if not listing_id or not paths:
+                continue
+            yield {
+                "listing_id": listing_id,
+                "images": [p if os.path.isabs(p) else os.path.join(base_dir, p) for p in paths],
+                "hint": (row.get("hint") or "").strip() or None,
+            }
+
+
+# ==========================================
+# 2. 单个商品的鉴定流程
+# ==========================================
+class CallThrottle:
+    """全局视觉模型调用限速：令牌桶没令牌就睡到能拿为止"""
+
+    def __init__(self, per_minute: int):
+        from api.rate_limit import MemoryTokenBucket
+
+        self.bucket = MemoryTokenBucket(capacity=max(1, per_minute), window=60) if per_minute > 0 else None
+
+    def acquire(self):
+        if self.bucket is None:
+            return
+        while True:
+            decision = self.bucket.hit("cli")
+            if decision.allowed:
+                return
+            time.sleep(max(decision.retry_after, 0.05))
+
+
+def appraise_listing(listing: Dict[str, Any], throttle: CallThrottle, with_review: bool) -> Dict[str, Any]:
+    from utils.analysis_merge import merge_analysis_results
+
+    analyses = []
+    for path in listing["images"]:
+        if not os.path.exists(path):
+            analyses.append({"brand": "UNKNOWN", "error": f"FILE_NOT_FOUND: {path}"})
+            continue
+        # 级联模式下一张图可能调用快、强两个模型 (还有重试)，每次调用都要过限速
+        analyses.append(analyze_snowboard_image(os.path.abspath(path), user_hint=listing["hint"],
+                                                before_call=throttle.acquire))
+
+    errors = [str(a.get("error", "")) for a in analyses]
+    if all(e.startswith("FILE_NOT_FOUND") for e in errors):
+        raise FileNotFoundError("该商品的图片全部不存在")
+    # 网络错误/解析失败时拿到的是 UNKNOWN + 5 分的兜底数据，不能参与定价
+    found = [(path, a) for path, a in zip(listing["images"], analyses) if not a.get("error")]
+    if not found:
+        # 抛出去算失败、不记检查点，下次重跑会再试
+        raise RuntimeError(f"视觉模型未返回有效结果: {';'.join(dict.fromkeys(errors))}")
+
+    def rerun(i):
+        return analyze_snowboard_image(os.path.abspath(found[i][0]), user_hint=listing["hint"], model=VL_MODEL,
+                                       before_call=throttle.acquire)
+
+    # 多视图结论冲突时，快模型给出的结果交给强模型重看
+    valid = escalate_disagreeing_views([a for _, a in found], rerun)
+
+    final_analysis = merge_analysis_results(valid)
+    price_result = estimate_secondhand_price(final_analysis)
+    p_low = price_result.get("price_low", 0)
+    p_high = price_result.get("price_high", 0)
+
+    expert_review = None
+    if with_review:
+        from pricing.review_generator import generate_expert_review
+
+        throttle.acquire()
+        expert_review = generate_expert_review(
+            brand=final_analysis.get("brand"),
+            model=final_analysis.get("possible_model"),
+            condition_score=final_analysis.get("condition_score"),
+            price_low=p_low, price_high=p_high,
+            base_damage=final_analysis.get("base_damage"),
+            edge_damage=final_analysis.get("edge_damage")
+        )
+
+    return {
+        "listing_id": listing["listing_id"],
+        "brand": final_analysis.get("brand"),
+        "model": final_analysis.get("possible_model"),
+        "condition_score": final_analysis.get("condition_score"),
+        "price_low": p_low,
+        "price_high": p_high,
+        "suggest_price": int((p_low + p_high) / 2),
+        "base_damage": final_analysis.get("base_damage"),
+        "edge_damage": final_analysis.get("edge_damage"),
+        "images": listing["images"],
+        "errors": [a["error"] for a in analyses if a.get("error")],
+        "expert_review": expert_review,
+        "calculation_process": price_result.get("calculation_process", []),
+        "analyses": analyses,
+    }
+
+
+# ==========================================
+# 3. 输出与检查点
+# ==========================================
+class ResultWriter:
+    """按扩展名选择 JSONL 或 CSV，逐条追加并立即刷盘"""
+
+    def __init__(self, path: str):
+        self.is_csv = path.lower().endswith(".csv")
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._f = open(path, "a", encoding="utf-8", newline="")
+        self._csv = None
+        if self.is_csv:
+            self._csv = csv.DictWriter(self._f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+            if is_new:
+                self._csv.writeheader()
+
+    def write(self, record: Dict[str, Any]):
+        if self._csv:
+            row = dict(record, images=";".join(record["images"]), errors=";".join(record["errors"]))
+            self._csv.writerow(row)
+        else:
+            self._f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+
+class Checkpoint:
+    """已完成的 listing_id，一行一个，追加写入"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.done = {line.strip() for line in f if line.strip()}
+        self._f = open(path, "a", encoding="utf-8")
+
+    def mark(self, listing_id: str):
+        self.done.add(listing_id)
+        self._f.write(listing_id + "\n")
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self):
+        self._f.close()
+
+
+def run_batch(listings: Iterator[Dict[str, Any]], output: str, checkpoint_path: str,
+              workers: int, rate: int, with_review: bool) -> Dict[str, int]:
+    checkpoint = Checkpoint(checkpoint_path)
+    writer = ResultWriter(output)
+    throttle = CallThrottle(rate)
+    stats = {"done": 0, "skipped": 0, "failed": 0}
+    started = time.time()
+
+    def collect(finished):
+        for future in finished:
+            listing = pending.pop(future)
+            try:
+                record = future.result()
+            except Exception as e:
+                # 失败的不记检查点，下次重跑会再试
+                stats["failed"] += 1
+                print(f"❌ {listing['listing_id']}: {e}", file=sys.stderr)
+                continue
+            writer.write(record)
+            checkpoint.mark(record["listing_id"])
+            stats["done"] += 1
+            print(f"✅ [{stats['done']}] {record['listing_id']}: {record['brand']} "
+                  f"成色 {record['condition_score']} ¥{record['price_low']}-{record['price_high']}")
+
+    pending: Dict[Any, Dict[str, Any]] = {}
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for listing in listings:
+                if listing["listing_id"] in checkpoint.done:
+                    stats["skipped"] += 1
+                    continue
+                # 在途任务数有上限，超大清单也不会一次性全部排进队列
+                while len(pending) >= workers * 2:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(finished)
+                pending[pool.submit(appraise_listing, listing, throttle, with_review)] = listing
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+    finally:
+        writer.close()
+        checkpoint.close()
+
+    print(f"\n🏁 完成 {stats['done']}，跳过(已完成) {stats['skipped']}，失败 {stats['failed']}，"
+          f"耗时 {time.time() - started:.0f}s")
+    return stats
+
+
+def main():
+    setup_logging()
+    parser = argparse.ArgumentParser(description="二手雪板 AI 鉴定 (单张 / 批量)")
+    parser.add_argument("image", nargs="?", help="单张图片路径")
+    parser.add_argument("--hint", help="单张模式下的线索提示")
+    parser.add_argument("--folder", help="批量：库存目录")
+    parser.add_argument("--manifest", help="批量：CSV 清单 (listing_id, image_paths, hint)")
+    parser.add_argument("--output", default="appraisals.jsonl", help="输出文件，.jsonl 或 .csv")
+    parser.add_argument("--checkpoint", help="检查点文件 (默认 <output>.ckpt)")
+    parser.add_argument("--workers", type=int, default=4, help="并发处理的商品数")
+    parser.add_argument("--rate", type=int, default=30, help="每分钟最多调用模型次数，0 表示不限")
+    parser.add_argument("--no-review", action="store_true", help="跳过专家点评 (省一次大模型调用)")
+    args = parser.parse_args()
+
+    if args.folder or args.manifest:
+        listings = iter_folder(args.folder) if args.folder else iter_manifest(args.manifest)
+        run_batch(listings, args.output, args.checkpoint or args.output + ".ckpt",
+                  workers=max(1, args.workers), rate=args.rate, with_review=not args.no_review)
+    elif args.image:
+        single_image(args.image, hint=args.hint)
+    else:
+        parser.print_help()
+
+
 if __name__ == "__main__":
     main()
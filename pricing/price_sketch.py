@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+文件名：pricing/price_sketch.py
+功能：历史鉴定价格的流式分位数草图 (KLL Sketch)
+核心逻辑：
+按 (品牌, 梯队, 成色分档) 维护可合并的 KLL 草图，每保存一条鉴定记录就更新一次，
+定价时以 O(1) 的字典查找取出预先算好的经验分位数，与规则估价做加权融合。
+多进程写同一个草图时以库为准：在写事务里读出、合并、写回；各进程的内存副本由后台线程定期从库里刷新，
+查询路径上不做任何加载。
+兜底数据 (视觉模型失败的 UNKNOWN/5 分) 与融合过草图的估价 (price_source=blend) 不参与统计，
+否则 blend 模式的输出会回灌草图、自我强化。
+"""
+
+import json
+import math
+import random
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from pricing.pricing_engine import BRAND_NICKNAMES, BRAND_TIERS
+from utils.db_manager import load_price_sketches, save_price_sketch, update_price_sketch, iter_price_observations
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# ==========================================
+# 1. 配置
+# ==========================================
+SKETCH_K = 128  # KLL 顶层压缩器容量，越大越准，存储约 O(k · log n)
+SKETCH_C = 2.0 / 3.0  # 每往下一层容量衰减系数
+QUANTILE_LOW = 0.10  # 经验区间下沿
+QUANTILE_HIGH = 0.90  # 经验区间上沿
+MIN_SAMPLES = 20  # 样本太少时不参与融合
+PRIOR_WEIGHT = 50  # 融合权重 = n / (n + PRIOR_WEIGHT)
+MAX_EMPIRICAL_WEIGHT = 0.5  # 经验分位最多占一半，规则估价仍是主导
+SKETCH_RELOAD_SECONDS = 60  # 后台线程定期从库里重新加载，拿到其它进程写入的观测
+
+
+# ==========================================
+# 2. KLL 草图
+# ==========================================
+class KLLSketch:
+    """
+    KLL 流式分位数草图 (Karnin-Lang-Liberty)
+    - update: 摊还 O(1)
+    - merge: 两个草图逐层拼接后压缩，结果等价于对两份数据流合并建草图
+    - 存储: 每层一个小缓冲区，总量 O(k · log(n/k))
+    """
+
+    def __init__(self, k: int = SKETCH_K):
+        self.k = k
+        self.n = 0
+        self.compactors: List[List[float]] = [[]]
+        self._rng = random.Random()
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.compactors) - level - 1
+        return max(2, int(math.ceil(self.k * (SKETCH_C ** depth))))
+
+    def _size(self) -> int:
+        return sum(len(c) for c in self.compactors)
+
+    def _max_size(self) -> int:
+        return sum(self._capacity(h) for h in range(len(self.compactors)))
+
+    def _compress(self):
+        while self._size() >= self._max_size():
+            for h in range(len(self.compactors)):
+                if len(self.compactors[h]) < self._capacity(h):
+                    continue
+                if h + 1 >= len(self.compactors):
+                    self.compactors.append([])
+                buf = sorted(self.compactors[h])
+                # 奇数个时留一个在本层，保证权重守恒
+                keep = [buf.pop()] if len(buf) % 2 else []
+                offset = self._rng.randint(0, 1)
+                self.compactors[h + 1].extend(buf[offset::2])
+                self.compactors[h] = keep
+                break
+
+    def update(self, value: float):
+        self.compactors[0].append(value)
+        self.n += 1
+        if self._size() >= self._max_size():
+            self._compress()
+
+    def merge(self, other: "KLLSketch"):
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for h, items in enumerate(other.compactors):
+            self.compactors[h].extend(items)
+        self.n += other.n
+        self._compress()
+
+    def quantiles(self, qs: List[float]) -> List[Optional[float]]:
+        """一次排序同时取多个分位点"""
+        weighted = sorted(
+            (v, 1 << h) for h, items in enumerate(self.compactors) for v in items
+        )
+        total = sum(w for _, w in weighted)
+        if not total:
+            return [None for _ in qs]
+
+        results = []
+        for q in qs:
+            target = q * total
+            acc = 0
+            value = weighted[-1][0]
+            for v, w in weighted:
+                acc += w
+                if acc >= target:
+                    value = v
+                    break
+            results.append(value)
+        return results
+
+    def to_json(self) -> str:
+        """紧凑序列化：价格本身是整数，直接存整数节省空间"""
+        levels = [[int(v) if float(v).is_integer() else v for v in c] for c in self.compactors]
+        return json.dumps({"k": self.k, "n": self.n, "c": levels}, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, payload: str) -> "KLLSketch":
+        raw = json.loads(payload)
+        sketch = cls(k=raw.get("k", SKETCH_K))
+        sketch.n = raw.get("n", 0)
+        sketch.compactors = raw.get("c") or [[]]
+        return sketch
+
+
+# ==========================================
+# 3. 分桶与内存缓存
+# ==========================================
+# key -> (草图, (q_low, q_high))，分位数在更新时预计算，查询时只做一次字典查找
+_SKETCHES: Dict[str, Tuple[KLLSketch, Tuple[Optional[float], Optional[float]]]] = {}
+_LOCK = threading.Lock()
+_LOADED = False
+_RELOADER: Optional[threading.Thread] = None
+
+
+def resolve_brand_tier(raw_brand: str) -> Tuple[str, str]:
+    """与定价引擎保持一致的品牌/梯队归一"""
+    brand = str(raw_brand or "UNKNOWN").strip().upper()
+    brand = BRAND_NICKNAMES.get(brand, brand)
+    return brand, BRAND_TIERS.get(brand, "TIER_5")
+
+
+def score_bucket(condition_score: Any) -> int:
+    """成色按整数分档 (1-10)"""
+    try:
+        s = float(condition_score)
+    except (TypeError, ValueError):
+        s = 5.0
+    return min(10, max(1, int(s)))
+
+
+def sketch_key(raw_brand: str, condition_score: Any) -> str:
+    brand, tier = resolve_brand_tier(raw_brand)
+    return f"{brand}|{tier}|{score_bucket(condition_score)}"
+
+
+def _load_all() -> Dict[str, Tuple[KLLSketch, Tuple[Optional[float], Optional[float]]]]:
+    """在锁外把整张草图表读出来并预计算分位数"""
+    fresh = {}
+    for key, payload in load_price_sketches():
+        try:
+            sketch = KLLSketch.from_json(payload)
+        except Exception:
+            continue
+        fresh[key] = (sketch, tuple(sketch.quantiles([QUANTILE_LOW, QUANTILE_HIGH])))
+    return fresh
+
+
+def _reload_loop():
+    while True:
+        time.sleep(SKETCH_RELOAD_SECONDS)
+        try:
+            fresh = _load_all()
+        except Exception as e:
+            logger.warning("价格草图刷新失败", extra={"error": str(e)})
+            continue
+        with _LOCK:
+            _SKETCHES.update(fresh)
+
+
+def _ensure_loaded():
+    """首次查询时同步加载一次，之后交给后台线程刷新；查询路径只做一次判断"""
+    global _LOADED, _RELOADER
+    if _LOADED:
+        return
+    fresh = _load_all()
+    with _LOCK:
+        if _LOADED:
+            return
+        for key, entry in fresh.items():
+            _SKETCHES.setdefault(key, entry)  # 加载期间 observe_appraisal 写入的条目比读到的新，保留
+        _LOADED = True
+        if _RELOADER is None:
+            _RELOADER = threading.Thread(target=_reload_loop, name="price-sketch-reload", daemon=True)
+            _RELOADER.start()
+
+
+def observe_appraisal(brand: str, condition_score: Any, price: Any):
+    """
+    记录一条鉴定结果 (随 save_record 调用)
+    以库里的草图为准：在写事务里读出最新草图、并入这条观测再写回，其它进程写入的观测不会被覆盖
+    """
+    try:
+        value = float(price)
+    except (TypeError, ValueError):
+        return
+    if value <= 0:
+        return
+
+    key = sketch_key(brand, condition_score)
+    merged = []
+
+    def merge_into(payload: Optional[str]):
+        try:
+            sketch = KLLSketch.from_json(payload) if payload else KLLSketch()
+        except ValueError:
+            sketch = KLLSketch()  # 损坏的草图从头开始 (可用 rebuild_from_records 全量回灌)
+        delta = KLLSketch()
+        delta.update(value)
+        sketch.merge(delta)
+        merged.append(sketch)
+        return sketch.n, sketch.to_json()
+
+    update_price_sketch(key, merge_into)
+    sketch = merged[-1]
+    with _LOCK:
+        _SKETCHES[key] = (sketch, tuple(sketch.quantiles([QUANTILE_LOW, QUANTILE_HIGH])))
+
+
+def lookup_empirical_range(brand: str, condition_score: Any) -> Optional[Dict[str, Any]]:
+    """
+    O(1) 查询经验分位数
+    :return: {"key", "count", "q_low", "q_high"}；样本不足时返回 None
+    """
+    _ensure_loaded()
+    entry = _SKETCHES.get(sketch_key(brand, condition_score))
+    if not entry:
+        return None
+    sketch, (q_low, q_high) = entry
+    if sketch.n < MIN_SAMPLES or q_low is None or q_high is None:
+        return None
+    return {
+        "key": sketch_key(brand, condition_score),
+        "count": sketch.n,
+        "q_low": q_low,
+        "q_high": q_high,
+    }
+
+
+def blend_weight(count: int) -> float:
+    return min(MAX_EMPIRICAL_WEIGHT, count / (count + PRIOR_WEIGHT))
+
+
+def rebuild_from_records() -> int:
+    """
+    从 records 表全量回灌草图 (首次启用或草图表损坏时使用)
+    :return: 参与回灌的记录数
+    """
+    fresh: Dict[str, KLLSketch] = {}
+    total = 0
+    for brand, score, price in iter_price_observations():
+        if str(brand or "UNKNOWN").strip().upper() == "UNKNOWN":
+            continue
+        try:
+            value = float(price)
+        except (TypeError, ValueError):
+            continue
+        if value <= 0:
+            continue
+        fresh.setdefault(sketch_key(brand, score), KLLSketch()).update(value)
+        total += 1
+
+    global _LOADED
+    with _LOCK:
+        _SKETCHES.clear()
+        for key, sketch in fresh.items():
+            _SKETCHES[key] = (sketch, tuple(sketch.quantiles([QUANTILE_LOW, QUANTILE_HIGH])))
+            save_price_sketch(key, sketch.n, sketch.to_json())
+        _LOADED = True
+    return total
+
+
+if __name__ == "__main__":
+    print(f"已回灌 {rebuild_from_records()} 条历史记录")
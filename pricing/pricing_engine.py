@@ -10,6 +10,10 @@ import json
 import os
 from typing import Dict, Any, List
 
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
 # ==========================================
 # 1. 明星型号溢价 (依然需要，针对具体热门款)
 # ==========================================
@@ -54,6 +58,9 @@ BRAND_TIERS = {
     "NOBADAY": "TIER_5", "VECTOR": "TIER_5", "DECATHLON": "TIER_5", "UNKNOWN": "TIER_5"
 }
 
+# 定价模式: "rule" 纯规则 (默认) / "blend" 融合历史鉴定的经验分位数 (见 pricing/price_sketch.py)
+PRICING_MODE = os.getenv("PRICING_MODE", "rule").strip().lower()
+
 
 # ==========================================
 # 3. 数据加载
@@ -112,17 +119,19 @@ def get_physical_condition_rate(score: float) -> float:
 # ==========================================
 # 5. 主计算函数
 # ==========================================
-def estimate_secondhand_price(analysis_result: Dict[str, Any]) -> Dict[str, Any]:
-    # 1. 基础信息
-    raw_brand = str(analysis_result.get("brand", "UNKNOWN")).strip().upper()
-    raw_model = str(analysis_result.get("possible_model", "")).strip().upper()
-    condition_score = analysis_result.get("condition_score", 5)
-    can_use = analysis_result.get("can_use", True)
+# 成色在这些分数处会发生价格跳变 (物理折旧档位、8.5 分提权、建议文案、经验分位按整数分档)
+CURVE_BREAKPOINTS = (1, 2, 3, 4, 5, 6, 7, 8, 8.5, 9, 9.8, 10)
 
-    if not can_use:
-        return {"currency": "CNY", "price_low": 0, "price_high": 50, "suggestion": "不建议交易",
-                "calculation_process": ["报废板"]}
 
+def _to_score(condition_score: Any) -> float:
+    try:
+        return float(condition_score)
+    except (TypeError, ValueError):
+        return 5.0
+
+
+def _price_components(raw_brand: str, raw_model: str) -> Dict[str, Any]:
+    """与成色无关的部分：品牌映射、参考原价、保值梯队、型号溢价"""
     # 2. 品牌映射
     brand = raw_brand
     if raw_brand in BRAND_NICKNAMES:
@@ -135,9 +144,6 @@ def estimate_secondhand_price(analysis_result: Dict[str, Any]) -> Dict[str, Any]
     tier_name = BRAND_TIERS.get(brand, "TIER_5")  # 默认当入门板处理
     brand_factor = TIER_FACTORS.get(tier_name, 0.35)
 
-    # 5. 计算物理折旧率
-    phys_rate = get_physical_condition_rate(condition_score)
-
     # 6. 计算型号溢价 (Premium)
     model_premium = 0
     hit_model = None
@@ -147,6 +153,15 @@ def estimate_secondhand_price(analysis_result: Dict[str, Any]) -> Dict[str, Any]
             hit_model = keyword
             break
 
+    return {"brand": brand, "original_price": original_price, "tier_name": tier_name,
+            "brand_factor": brand_factor, "model_premium": model_premium, "hit_model": hit_model}
+
+
+def _price_at(parts: Dict[str, Any], condition_score: Any, is_old: bool, mode: str = None) -> Dict[str, Any]:
+    """给定成色与新老款，算出估价区间 (核心公式只在这里实现一份)"""
+    # 5. 计算物理折旧率
+    phys_rate = get_physical_condition_rate(condition_score)
+
     # ==========================================
     # 🔥 核心公式：原价 × (物理折旧 × 品牌系数) + 热门款溢价
     # ==========================================
@@ -157,45 +172,144 @@ def estimate_secondhand_price(analysis_result: Dict[str, Any]) -> Dict[str, Any]
     # 针对成色差的情况，品牌系数影响变大
 
     # 修正逻辑：
-    final_rate = phys_rate * brand_factor
+    final_rate = phys_rate * parts["brand_factor"]
 
     # 动态调整：如果是 T3 以上的品牌，且成色好，保值率不能太低
-    if tier_name in ["TIER_1", "TIER_2", "TIER_3"] and condition_score >= 8.5:
+    if parts["tier_name"] in ["TIER_1", "TIER_2", "TIER_3"] and _to_score(condition_score) >= 8.5:
         final_rate = final_rate * 1.3  # 提权
 
     # 计算基础估价
-    base_estimation = original_price * final_rate
-    is_old = analysis_result.get("is_old_model", False)
+    base_estimation = parts["original_price"] * final_rate
     if is_old:
-        print("Detected Old Model: Applying 40% discount")
         base_estimation = base_estimation * 0.6  # 老款直接打6折
     # 加上溢价
-    final_price = base_estimation + model_premium
+    final_price = base_estimation + parts["model_premium"]
     final_price = int(final_price)
 
     # 7. 价格区间
     price_low = int(final_price * 0.9)
     price_high = int(final_price * 1.1)
+
+    # 7.1 (可选) 融合历史鉴定的经验分位数
+    empirical = None
+    if (mode or PRICING_MODE) == "blend":
+        from pricing.price_sketch import lookup_empirical_range, blend_weight
+        empirical = lookup_empirical_range(parts["brand"], condition_score)
+        if empirical:
+            w = blend_weight(empirical["count"])
+            price_low = int(price_low * (1 - w) + empirical["q_low"] * w)
+            price_high = int(price_high * (1 - w) + empirical["q_high"] * w)
+            if price_high < price_low:
+                price_low, price_high = price_high, price_low
+
     price_low = round(price_low, -2)
     price_high = round(price_high, -2)
     if price_low < 100: price_low = 100
 
+    return {"phys_rate": phys_rate, "final_rate": final_rate, "final_price": final_price,
+            "price_low": price_low, "price_high": price_high, "empirical": empirical}
+
+
+def estimate_secondhand_price(analysis_result: Dict[str, Any], mode: str = None) -> Dict[str, Any]:
+    """
+    :param analysis_result: 视觉分析 (或融合后) 的结果
+    :param mode: 定价模式，None 时取环境变量 PRICING_MODE
+    """
+    # 1. 基础信息
+    raw_brand = str(analysis_result.get("brand", "UNKNOWN")).strip().upper()
+    raw_model = str(analysis_result.get("possible_model", "")).strip().upper()
+    condition_score = analysis_result.get("condition_score", 5)
+    can_use = analysis_result.get("can_use", True)
+
+    if not can_use:
+        return {"currency": "CNY", "price_low": 0, "price_high": 50, "suggestion": "不建议交易",
+                "calculation_process": ["报废板"]}
+
+    parts = _price_components(raw_brand, raw_model)
+    brand, original_price, tier_name = parts["brand"], parts["original_price"], parts["tier_name"]
+    model_premium, hit_model = parts["model_premium"], parts["hit_model"]
+
+    is_old = analysis_result.get("is_old_model", False)
+    if is_old:
+        logger.debug("识别为老款，估价打 6 折", extra={"brand": brand, "sample_rate": 0.1})
+    priced = _price_at(parts, condition_score, is_old, mode)
+    final_rate, final_price, empirical = priced["final_rate"], priced["final_price"], priced["empirical"]
+
     # 8. 记录过程
     steps = []
     steps.append(f"① 参考原价 ({brand}): ¥{original_price}")
-    steps.append(f"② 品牌梯队: {tier_name} (保值系数 {brand_factor})")
-    steps.append(f"③ 物理成色 ({condition_score}分): 残值率 {phys_rate}")
+    steps.append(f"② 品牌梯队: {tier_name} (保值系数 {parts['brand_factor']})")
+    steps.append(f"③ 物理成色 ({condition_score}分): 残值率 {priced['phys_rate']}")
     steps.append(f"   ➜ 综合折算率: {final_rate:.2f}")
     if hit_model:
         steps.append(f"④ 热门款溢价 ({hit_model}): +¥{model_premium}")
     steps.append(f"⑤ 最终估价: ¥{original_price} × {final_rate:.2f} + {model_premium} = ¥{final_price}")
+    if empirical:
+        from pricing.price_sketch import blend_weight
+        steps.append(
+            f"⑥ 历史成交分位 ({empirical['count']}条): ¥{int(empirical['q_low'])} - ¥{int(empirical['q_high'])}"
+            f" (融合权重 {blend_weight(empirical['count']):.2f})"
+        )
 
     return {
         "currency": "CNY",
-        "price_low": price_low,
-        "price_high": price_high,
+        "price_low": priced["price_low"],
+        "price_high": priced["price_high"],
         "confidence": 0.85,
-        "suggestion": "价格合理" if condition_score >= 6 else "建议议价",
+        "suggestion": "价格合理" if _to_score(condition_score) >= 6 else "建议议价",
         "calculation_process": steps,
-        "pricing_reason": f"基于{brand}原价¥{original_price}及{tier_name}级市场保值率计算。"
-    }
\ No newline at end of file
+        "pricing_reason": f"基于{brand}原价¥{original_price}及{tier_name}级市场保值率计算。",
+        # blend：结果融合了价格草图，不能再回灌进草图 (否则估价会自我强化、逐渐脱离市场)
+        "price_source": "blend" if empirical else "rule",
+    }
+
+
+def estimate_price_curve(brand: str, model: str = "", mode: str = None) -> Dict[str, Any]:
+    """
+    一次算出某品牌/型号在全部成色 (1-10 分) 与新老款下的价格曲线，前端调滑块时本地查表即可，无需往返
+    价格是成色的分段常数函数，只在 CURVE_BREAKPOINTS 处跳变，所以按分段返回：
+    :return: {"brand", "original_price", "tier", "model_premium",
+              "curves": {"new": [段...], "old": [段...]}}
+             每段 {"min_score", "max_score", "price_low", "price_high", "suggest_price", "suggestion"}，
+             区间左闭右开，最后一段包含 10 分
+    """
+    parts = _price_components(str(brand or "UNKNOWN").strip().upper(), str(model or "").strip().upper())
+
+    curves = {}
+    for label, is_old in (("new", False), ("old", True)):
+        segments = []
+        for i, start in enumerate(CURVE_BREAKPOINTS[:-1]):
+            priced = _price_at(parts, start, is_old, mode)
+            segment = {
+                "min_score": start,
+                "max_score": CURVE_BREAKPOINTS[i + 1],
+                "price_low": priced["price_low"],
+                "price_high": priced["price_high"],
+                "suggest_price": int((priced["price_low"] + priced["price_high"]) / 2),
+                "suggestion": "价格合理" if start >= 6 else "建议议价",
+            }
+            prev = segments[-1] if segments else None
+            # 相邻两段价格与建议都一样就合并
+            if prev and all(prev[k] == segment[k] for k in ("price_low", "price_high", "suggestion")):
+                prev["max_score"] = segment["max_score"]
+            else:
+                segments.append(segment)
+        curves[label] = segments
+
+    return {
+        "brand": parts["brand"],
+        "original_price": parts["original_price"],
+        "tier": parts["tier_name"],
+        "model_premium": parts["model_premium"],
+        "curves": curves,
+    }
+
+
+def price_from_curve(curve: Dict[str, Any], condition_score: Any, is_old: bool = False) -> Dict[str, Any]:
+    """在 estimate_price_curve 的结果里查某个成色对应的分段"""
+    score = min(10.0, max(1.0, _to_score(condition_score)))
+    segments = curve["curves"]["old" if is_old else "new"]
+    for segment in segments:
+        if segment["min_score"] <= score < segment["max_score"]:
+            return segment
+    return segments[-1]
@@ -6,20 +6,29 @@
 """
 
 import os
+import time
 from dotenv import load_dotenv
 
-# 1. 导入 LangChain 的核心组件
-from langchain_community.chat_models import ChatTongyi  # 通义千问的模型包装器
-from langchain_core.prompts import ChatPromptTemplate  # 聊天提示词模板
-from langchain_core.output_parsers import StrOutputParser  # 字符串输出解析器 (把对象转成纯文本)
+# LangChain 组件导入较慢，放到函数内部按需加载 (见 generate_expert_review)
+
+from utils.usage_tracker import record_llm_call, usage_from_message
+from llm.fake_backend import fake_llm_enabled, make_fake_chat_model, record_response
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 # 加载环境变量
 load_dotenv()
 
+# 修改 Prompt 内容时同步改版本号 (用量统计按版本分组)
+REVIEW_PROMPT_VERSION = "review_v1"
+
 
-def generate_expert_review(brand, model, condition_score, price_low, price_high, base_damage, edge_damage):
+def generate_expert_review(brand, model, condition_score, price_low, price_high, base_damage, edge_damage,
+                           on_token=None):
     """
     生成专家点评的主函数 (LangChain 版)
+    :param on_token: 可选的流式回调，每收到一段文字调用一次；回调返回 False 时停止生成 (比如客户端已断开)
     """
 
     # --- A. 准备 API Key ---
@@ -61,13 +70,20 @@ def generate_expert_review(brand, model, condition_score, price_low, price_high,
     # 🔥 D. LangChain 核心实现 (核心变化点)
     # ===========================================
 
+    # 0. 按需导入 LangChain 的核心组件
+    from langchain_community.chat_models import ChatTongyi  # 通义千问的模型包装器
+    from langchain_core.prompts import ChatPromptTemplate  # 聊天提示词模板
+
     # 1. 初始化模型 (ChatTongyi)
     # temperature=0.7 让点评稍微有点文采，不那么死板
-    chat_model = ChatTongyi(
-        model="qwen-plus",
-        dashscope_api_key=api_key,
-        temperature=0.7
-    )
+    if fake_llm_enabled():
+        chat_model = make_fake_chat_model("review")  # 压测/离线模式：本地替身
+    else:
+        chat_model = ChatTongyi(
+            model="qwen-plus",
+            dashscope_api_key=api_key,
+            temperature=0.7
+        )
 
     # 2. 定义 Prompt 模板 (System + User)
     # 以前是 f-string 拼接，现在是结构化的 Template
@@ -96,13 +112,14 @@ def generate_expert_review(brand, model, condition_score, price_low, price_high,
     ])
 
     # 3. 创建处理链 (LCEL: LangChain Expression Language)
-    # 逻辑：Prompt模板 -> 模型 -> 文本解析器
-    chain = prompt_template | chat_model | StrOutputParser()
+    # 逻辑：Prompt模板 -> 模型 (保留 AIMessage，以便读取 token 用量)
+    chain = prompt_template | chat_model
 
     # 4. 执行链
+    call_start = time.time()
     try:
         # invoke 会自动把字典里的变量填入模板，然后发给 AI
-        result = chain.invoke({
+        inputs = {
             "brand": b,
             "model": m,
             "style_hint": style_hint,
@@ -112,9 +129,25 @@ def generate_expert_review(brand, model, condition_score, price_low, price_high,
             "price_low": price_low,
             "price_high": price_high,
             "model_instruction": model_instruction
-        })
-        return result
+        }
+        if on_token is None:
+            message = chain.invoke(inputs)
+        else:
+            # 流式：边生成边回调，分片拼起来得到完整消息 (token 用量在最后一片里)
+            message = None
+            for chunk in chain.stream(inputs):
+                message = chunk if message is None else message + chunk
+                if chunk.content and on_token(chunk.content) is False:
+                    break
+            if message is None:
+                raise RuntimeError("点评流式输出为空")
+        record_llm_call(model="qwen-plus", kind="review", usage=usage_from_message(message),
+                        latency_ms=(time.time() - call_start) * 1000, prompt_version=REVIEW_PROMPT_VERSION)
+        record_response("review", "qwen-plus", message.content)
+        return message.content
 
     except Exception as e:
-        print(f"LangChain 调用异常: {str(e)}")
+        record_llm_call(model="qwen-plus", kind="review", prompt_version=REVIEW_PROMPT_VERSION,
+                        latency_ms=(time.time() - call_start) * 1000, success=False)
+        logger.warning("点评生成调用异常", extra={"error": str(e)})
         return "（专家正在滑雪，LangChain 连接断开...）"
\ No newline at end of file
@@ -17,6 +17,7 @@ def merge_analysis_results(
     base_damages = []
     edge_damages = []
     can_use_list = []
+    old_model_votes = []
 
     # 定义哪些词会被视为“没识别出来”
     IGNORE_KEYWORDS = {"UNKNOWN", "NULL", "NONE", "未知", ""}
@@ -44,6 +45,10 @@ def merge_analysis_results(
         if item.get("can_use") is not None:
             can_use_list.append(item["can_use"])
 
+        # --- 5. 新老款 ---
+        if isinstance(item.get("is_old_model"), bool):
+            old_model_votes.append(item["is_old_model"])
+
     # ===============================
     # 融合决策
     # ===============================
@@ -70,12 +75,16 @@ def merge_analysis_results(
     # 或者改为宽松模式： final_can_use = any(can_use_list)
     final_can_use = all(can_use_list) if can_use_list else True
 
+    # 5. 老款：过半视图认为是老款才算 (老款估价直接打 6 折，单张图看走眼不该拉低整体)
+    final_is_old = sum(old_model_votes) * 2 > len(old_model_votes)
+
     return {
         "brand": final_brand,
         "condition_score": final_score,
         "base_damage": final_base_damage,
         "edge_damage": final_edge_damage,
         "can_use": final_can_use,
+        "is_old_model": final_is_old,
         # 加上这个字段方便调试
         "overall_condition": f"基于{len(analysis_list)}张图片分析，综合评分 {final_score}"
     }
\ No newline at end of file
@@ -1,13 +1,25 @@
 # -*- coding: utf-8 -*
 # utils/db_manager.py
 import sqlite3
+import hashlib
 import json
 import os
-from datetime import datetime
+import sys
+import zlib
+from datetime import datetime, timedelta
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 # 数据库文件路径 (会自动在项目根目录创建 snowboard_data.db)
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "snowboard_data.db")
 
+# 点评全文和计算过程的每一行都按内容哈希存进 text_blobs，records 里只存引用
+BLOB_HASH_LEN = 16
+COMPACT_AFTER_DAYS = int(os.getenv("RECORDS_COMPACT_AFTER_DAYS", "30"))  # 超过这么多天的记录算冷数据
+COMPRESS_MIN_BYTES = 64  # 太短的文本压缩了反而更大
+
 
 def init_db():
     """初始化数据库：如果表不存在，就创建它"""
@@ -29,14 +41,134 @@ def init_db():
         calculation_json TEXT
     )
     ''')
+
+    # 创建 price_sketches 表 (历史价格分位数草图，每个 品牌|梯队|成色档 一行)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS price_sketches (
+        sketch_key TEXT PRIMARY KEY,
+        sample_count INTEGER,
+        payload TEXT,
+        updated_at TEXT
+    )
+    ''')
+
+    # 创建 api_usage 表 (按 Key、按天累计的计量数据)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS api_usage (
+        key_id TEXT,
+        day TEXT,
+        requests INTEGER DEFAULT 0,
+        images INTEGER DEFAULT 0,
+        llm_calls INTEGER DEFAULT 0,
+        input_tokens INTEGER DEFAULT 0,
+        output_tokens INTEGER DEFAULT 0,
+        PRIMARY KEY (key_id, day)
+    )
+    ''')
+
+    # 创建 image_hashes 表 (历史图片的感知哈希 + 当时的视觉分析结果，用于近重复复用)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS image_hashes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT,
+        dhash TEXT,
+        hint TEXT,
+        analysis_json TEXT
+    )
+    ''')
+
+    # 创建 llm_usage 表 (模型调用按 天/接口/Key/模型/Prompt 版本 累计)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS llm_usage (
+        day TEXT,
+        endpoint TEXT,
+        key_id TEXT,
+        model TEXT,
+        kind TEXT,
+        prompt_version TEXT,
+        calls INTEGER DEFAULT 0,
+        failures INTEGER DEFAULT 0,
+        hinted_calls INTEGER DEFAULT 0,
+        input_tokens INTEGER DEFAULT 0,
+        output_tokens INTEGER DEFAULT 0,
+        image_tokens INTEGER DEFAULT 0,
+        image_bytes INTEGER DEFAULT 0,
+        latency_ms REAL DEFAULT 0,
+        cost REAL DEFAULT 0,
+        PRIMARY KEY (day, endpoint, key_id, model, kind, prompt_version)
+    )
+    ''')
+
+    # 创建 text_blobs 表 (按内容去重的文本：点评全文、计算过程的每一行；encoding 为 raw / zlib)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS text_blobs (
+        hash TEXT PRIMARY KEY,
+        encoding TEXT,
+        body BLOB
+    )
+    ''')
+
+    # 老库迁移：给 records 补上后来新增的列
+    _ensure_column(cursor, "records", "usage_json", "TEXT")
+    # 紧凑存储：review_ref 指向点评，calc_refs 是计算过程各行引用的 JSON 列表 (老数据仍在原列里，读取时兼容)
+    _ensure_column(cursor, "records", "review_ref", "TEXT")
+    _ensure_column(cursor, "records", "calc_refs", "TEXT")
+    # 估价来源：rule 纯规则 / blend 融合了价格草图 (blend 的价格不回灌草图)
+    _ensure_column(cursor, "records", "price_source", "TEXT")
+    # 记录归属的调用方：/records 与导出只返回调用方自己的记录 (老数据为 NULL，不属于任何 Key)
+    _ensure_column(cursor, "records", "key_id", "TEXT")
+    # 近重复索引按调用方隔离：A 租户的分析结果不能复用给 B
+    _ensure_column(cursor, "image_hashes", "key_id", "TEXT")
+
+    # 历史记录按品牌 / 时间筛选时走索引，翻页用 id 做游标
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_records_brand_id ON records (brand, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_records_timestamp ON records (timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_records_key_id ON records (key_id, id)')
     conn.commit()
     conn.close()
 
 
+def _ensure_column(cursor, table: str, column: str, col_type: str):
+    columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {col_type}")
+
+
+def _blob_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:BLOB_HASH_LEN]
+
+
+def _intern_texts(conn, texts):
+    """把文本写入 text_blobs (已存在的跳过)，返回对应的引用列表"""
+    refs = [_blob_hash(t) for t in texts]
+    conn.executemany('INSERT OR IGNORE INTO text_blobs (hash, encoding, body) VALUES (?, ?, ?)',
+                     [(ref, "raw", t.encode("utf-8")) for ref, t in zip(refs, texts)])
+    return refs
+
+
+def _decode_blob(encoding: str, body: bytes) -> str:
+    if encoding == "zlib":
+        body = zlib.decompress(body)
+    return bytes(body).decode("utf-8")
+
+
+def _load_blobs(conn, refs) -> dict:
+    """批量读取引用 -> 文本"""
+    refs = list(set(refs))
+    texts = {}
+    for i in range(0, len(refs), 500):  # SQLite 单条语句的参数个数有上限
+        chunk = refs[i:i + 500]
+        sql = f'SELECT hash, encoding, body FROM text_blobs WHERE hash IN ({",".join("?" * len(chunk))})'
+        for ref, encoding, body in conn.execute(sql, chunk):
+            texts[ref] = _decode_blob(encoding, body)
+    return texts
+
+
 def save_record(data: dict):
     """
     保存一条鉴定记录
     data 参数应包含: brand, model, score, price_low, price_high, review, calc_process
+    :return: 记录是否写入成功 (价格草图更新失败不影响返回值)
     """
     try:
         # 确保数据库存在
@@ -45,13 +177,17 @@ def save_record(data: dict):
         conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
 
+        # 点评与计算过程去重后只存引用 (同品牌同梯队的计算过程几乎逐行相同)
+        review_ref = _intern_texts(conn, [data.get("expert_review") or ""])[0]
+        calc_refs = _intern_texts(conn, [str(line) for line in data.get("calculation_process", [])])
+
         # 插入数据
         cursor.execute('''
         INSERT INTO records (
             timestamp, brand, model, condition_score, 
             price_low, price_high, suggest_price, 
-            expert_review, calculation_json
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            review_ref, calc_refs, usage_json, price_source, key_id
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             data.get("brand", "UNKNOWN"),
@@ -60,38 +196,447 @@ def save_record(data: dict):
             data.get("price_low", 0),
             data.get("price_high", 0),
             data.get("suggest_price", 0),
-            data.get("expert_review", ""),
-            json.dumps(data.get("calculation_process", []))  # 列表转 JSON 字符串存
+            review_ref,
+            json.dumps(calc_refs),
+            json.dumps(data["usage"], ensure_ascii=False) if data.get("usage") else None,  # 本次鉴定的模型用量
+            data.get("price_source"),
+            data.get("key_id")
         ))
 
         conn.commit()
         conn.close()
-        print("✅ 数据已保存到 SQLite")
+        logger.debug("鉴定记录已保存", extra={"brand": data.get("brand"), "sample_rate": 0.1})
+    except Exception as e:
+        logger.error("鉴定记录保存失败", extra={"error": str(e)})
+        return False
+
+    # 兜底数据 (视觉模型失败时的 UNKNOWN/5 分) 不进价格草图，免得污染经验分位；
+    # 融合过草图的估价也不回灌，否则草图会被自己的输出喂养
+    if data.get("error") or str(data.get("brand") or "UNKNOWN").strip().upper() == "UNKNOWN":
+        return True
+    if data.get("price_source") == "blend":
+        return True
+
+    # 同步更新历史价格草图 (失败不影响主流程)
+    try:
+        from pricing.price_sketch import observe_appraisal
+        observe_appraisal(data.get("brand", "UNKNOWN"), data.get("condition_score", 0), data.get("suggest_price", 0))
     except Exception as e:
-        print(f"❌ 数据库保存失败: {e}")
+        logger.warning("价格草图更新失败", extra={"error": str(e)})
+    return True
 
 
 def get_recent_records(limit=10):
     """读取最近的记录"""
     init_db()
     conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute('SELECT * FROM records ORDER BY id DESC LIMIT ?', (limit,))
-    rows = cursor.fetchall()
+    conn.row_factory = sqlite3.Row
+    rows = _fetch_record_page(conn, limit=limit)
+    conn.close()
 
     # 转成字典列表返回
     results = []
     for row in rows:
         results.append({
-            "id": row[0],
-            "timestamp": row[1],
-            "brand": row[2],
-            "model": row[3],
-            "score": row[4],
-            "price": f"¥{row[5]} - ¥{row[6]}",
-            "review": row[8]
+            "id": row["id"],
+            "timestamp": row["timestamp"],
+            "brand": row["brand"],
+            "model": row["model"],
+            "score": row["condition_score"],
+            "price": f"¥{row['price_low']} - ¥{row['price_high']}",
+            "review": row["expert_review"]
         })
+    return results
+
+
+RECORD_FIELDS = ("id", "timestamp", "brand", "model", "condition_score", "price_low", "price_high",
+                 "suggest_price", "expert_review", "calculation_process")
+
+
+def _record_filters(brand: str = None, since: str = None, until: str = None,
+                    min_score: float = None, max_score: float = None, key_id: str = None):
+    """
+    筛选条件 -> (WHERE 子句片段列表, 参数)
+    since / until 可以是 YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS；只给日期时 until 包含当天
+    key_id: 只看某个调用方的记录 (对外接口必传)
+    """
+    clauses, params = [], []
+    if key_id is not None:
+        clauses.append("key_id = ?")
+        params.append(key_id)
+    if brand:
+        clauses.append("brand = ?")
+        params.append(brand.strip().upper())
+    if since:
+        clauses.append("timestamp >= ?")
+        params.append(since)
+    if until:
+        clauses.append("timestamp <= ?")
+        params.append(until + " 23:59:59" if len(until) == 10 else until)
+    if min_score is not None:
+        clauses.append("condition_score >= ?")
+        params.append(min_score)
+    if max_score is not None:
+        clauses.append("condition_score <= ?")
+        params.append(max_score)
+    return clauses, params
+
+
+def _resolve_records(conn, rows) -> list:
+    """把 review_ref / calc_refs 还原成文本；老格式 (直接存全文) 的行原样读取"""
+    refs = []
+    for row in rows:
+        if row["review_ref"]:
+            refs.append(row["review_ref"])
+        if row["calc_refs"]:
+            refs.extend(json.loads(row["calc_refs"]))
+    texts = _load_blobs(conn, refs) if refs else {}
+
+    records = []
+    for row in rows:
+        record = {k: row[k] for k in RECORD_FIELDS if k not in ("expert_review", "calculation_process")}
+        if row["review_ref"]:
+            record["expert_review"] = texts.get(row["review_ref"], "")
+        else:
+            record["expert_review"] = row["expert_review"]
+        if row["calc_refs"]:
+            record["calculation_process"] = [texts.get(ref, "") for ref in json.loads(row["calc_refs"])]
+        else:
+            try:
+                record["calculation_process"] = json.loads(row["calculation_json"] or "[]")
+            except ValueError:
+                record["calculation_process"] = []
+        records.append(record)
+    return records
+
+
+def _fetch_record_page(conn, after_id: int = None, before_id: int = None, limit: int = 100, **filters):
+    clauses, params = _record_filters(**filters)
+    if after_id is not None:
+        clauses.append("id > ?")
+        params.append(after_id)
+    if before_id is not None:
+        clauses.append("id < ?")
+        params.append(before_id)
+    sql = ('SELECT id, timestamp, brand, model, condition_score, price_low, price_high, suggest_price, '
+           'expert_review, calculation_json, review_ref, calc_refs FROM records')
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(clauses)
+    sql += f' ORDER BY id {"ASC" if after_id is not None else "DESC"} LIMIT ?'
+    return _resolve_records(conn, conn.execute(sql, params + [limit]).fetchall())
 
+
+def query_records(cursor: int = None, limit: int = 50, **filters):
+    """
+    按 id 游标翻页 (从新到旧)，不用 OFFSET，翻到多深都只扫一页的数据
+    :param cursor: 上一页返回的 next_cursor；为空时从最新一条开始
+    :param filters: brand / since / until / min_score / max_score / key_id
+    :return: (记录列表, next_cursor；没有下一页时为 None)
+    """
+    init_db()
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    try:
+        # 多取一条，用来判断还有没有下一页
+        rows = _fetch_record_page(conn, before_id=cursor, limit=limit + 1, **filters)
+    finally:
+        conn.close()
+    next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def iter_records(batch_size: int = 1000, **filters):
+    """
+    按 id 从旧到新逐条遍历符合条件的记录，用于批量导出
+    每批单独开一次短查询：内存只占一批，也不会长时间持有读锁挡住新记录写入
+    """
+    init_db()
+    last_id = 0
+    while True:
+        conn = sqlite3.connect(DB_PATH)
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = _fetch_record_page(conn, after_id=last_id, limit=batch_size, **filters)
+        finally:
+            conn.close()
+        if not rows:
+            return
+        for row in rows:
+            yield row
+        last_id = rows[-1]["id"]
+
+
+def load_price_sketches():
+    """读取全部价格草图 -> [(sketch_key, payload)]"""
+    init_db()
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('SELECT sketch_key, payload FROM price_sketches')
+    rows = cursor.fetchall()
     conn.close()
-    return results
\ No newline at end of file
+    return rows
+
+
+def save_price_sketch(sketch_key: str, sample_count: int, payload: str):
+    """写入 (或覆盖) 一个价格草图"""
+    init_db()
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('''
+    INSERT OR REPLACE INTO price_sketches (sketch_key, sample_count, payload, updated_at)
+    VALUES (?, ?, ?, ?)
+    ''', (sketch_key, sample_count, payload, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    conn.commit()
+    conn.close()
+
+
+def update_price_sketch(sketch_key: str, update_fn):
+    """
+    在一个写事务里 读取 -> 更新 -> 写回 某个价格草图，多个进程 (多个 worker、Streamlit 与 API) 同时写也不会互相覆盖
+    update_fn(库里现有的 payload 或 None) -> (sample_count, 新 payload)
+    """
+    init_db()
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)  # 手动管理事务
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('SELECT payload FROM price_sketches WHERE sketch_key = ?', (sketch_key,)).fetchone()
+        sample_count, payload = update_fn(row[0] if row else None)
+        conn.execute('''
+        INSERT OR REPLACE INTO price_sketches (sketch_key, sample_count, payload, updated_at)
+        VALUES (?, ?, ?, ?)
+        ''', (sketch_key, sample_count, payload, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        conn.execute('COMMIT')
+    except Exception:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+
+def iter_price_observations():
+    """逐行遍历可回灌草图的历史记录 (brand, condition_score, suggest_price)，不一次性载入内存；跳过融合估价"""
+    init_db()
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        cursor = conn.execute(
+            "SELECT brand, condition_score, suggest_price FROM records "
+            "WHERE price_source IS NULL OR price_source != 'blend' ORDER BY id"
+        )
+        for row in cursor:
+            yield row
+    finally:
+        conn.close()
+
+
+def add_api_usage(batch):
+    """
+    批量累加计量数据
+    batch: [(key_id, day, {requests, images, llm_calls, input_tokens, output_tokens})]
+    """
+    init_db()
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.executemany('''
+    INSERT INTO api_usage (key_id, day, requests, images, llm_calls, input_tokens, output_tokens)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(key_id, day) DO UPDATE SET
+        requests = requests + excluded.requests,
+        images = images + excluded.images,
+        llm_calls = llm_calls + excluded.llm_calls,
+        input_tokens = input_tokens + excluded.input_tokens,
+        output_tokens = output_tokens + excluded.output_tokens
+    ''', [
+        (key_id, day, c.get("requests", 0), c.get("images", 0), c.get("llm_calls", 0),
+         c.get("input_tokens", 0), c.get("output_tokens", 0))
+        for key_id, day, c in batch
+    ])
+    conn.commit()
+    conn.close()
+
+
+def get_api_usage(key_id: str, since_day: str = None):
+    """读取某个 Key 的按天计量"""
+    init_db()
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    sql = 'SELECT day, requests, images, llm_calls, input_tokens, output_tokens FROM api_usage WHERE key_id = ?'
+    params = [key_id]
+    if since_day:
+        sql += ' AND day >= ?'
+        params.append(since_day)
+    rows = [dict(r) for r in conn.execute(sql + ' ORDER BY day', params)]
+    conn.close()
+    return rows
+
+
+def add_llm_usage(batch):
+    """
+    批量累加模型调用用量
+    batch: [((day, endpoint, key_id, model, kind, prompt_version), {calls, failures, ...})]
+    """
+    init_db()
+    conn = sqlite3.connect(DB_PATH)
+    conn.executemany('''
+    INSERT INTO llm_usage (day, endpoint, key_id, model, kind, prompt_version, calls, failures, hinted_calls,
+                           input_tokens, output_tokens, image_tokens, image_bytes, latency_ms, cost)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(day, endpoint, key_id, model, kind, prompt_version) DO UPDATE SET
+        calls = calls + excluded.calls,
+        failures = failures + excluded.failures,
+        hinted_calls = hinted_calls + excluded.hinted_calls,
+        input_tokens = input_tokens + excluded.input_tokens,
+        output_tokens = output_tokens + excluded.output_tokens,
+        image_tokens = image_tokens + excluded.image_tokens,
+        image_bytes = image_bytes + excluded.image_bytes,
+        latency_ms = latency_ms + excluded.latency_ms,
+        cost = cost + excluded.cost
+    ''', [
+        key + (c["calls"], c["failures"], c["hinted_calls"], c["input_tokens"], c["output_tokens"],
+               c["image_tokens"], c["image_bytes"], c["latency_ms"], c["cost"])
+        for key, c in batch
+    ])
+    conn.commit()
+    conn.close()
+
+
+LLM_USAGE_DIMENSIONS = ("day", "endpoint", "model", "kind", "prompt_version")
+
+
+def query_llm_usage(key_id: str, since_day: str = None, group_by=("endpoint", "prompt_version")):
+    """
+    按维度汇总某个 Key 的模型用量，并算出平均每次调用的 token 与耗时
+    group_by 只能取 LLM_USAGE_DIMENSIONS 里的列
+    """
+    dims = [d for d in group_by if d in LLM_USAGE_DIMENSIONS] or ["endpoint"]
+    init_db()
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    sql = f'''
+    SELECT {", ".join(dims)},
+           SUM(calls) AS calls, SUM(failures) AS failures, SUM(hinted_calls) AS hinted_calls,
+           SUM(input_tokens) AS input_tokens, SUM(output_tokens) AS output_tokens,
+           SUM(image_tokens) AS image_tokens, SUM(image_bytes) AS image_bytes,
+           SUM(latency_ms) AS latency_ms, SUM(cost) AS cost
+    FROM llm_usage WHERE key_id = ?'''
+    params = [key_id]
+    if since_day:
+        sql += ' AND day >= ?'
+        params.append(since_day)
+    sql += f' GROUP BY {", ".join(dims)} ORDER BY {", ".join(dims)}'
+
+    rows = []
+    for r in conn.execute(sql, params):
+        row = dict(r)
+        calls = row["calls"] or 1
+        row["avg_input_tokens"] = round(row["input_tokens"] / calls, 1)
+        row["avg_output_tokens"] = round(row["output_tokens"] / calls, 1)
+        row["avg_latency_ms"] = round(row["latency_ms"] / calls, 1)
+        row["cost"] = round(row["cost"], 4)
+        rows.append(row)
+    conn.close()
+    return rows
+
+
+def load_image_hashes(after_id: int = 0):
+    """读取 id > after_id 的图片哈希 -> [(id, dhash, analysis_json, key_id)]；增量刷新时只读新增的行"""
+    init_db()
+    conn = sqlite3.connect(DB_PATH)
+    rows = conn.execute(
+        'SELECT id, dhash, analysis_json, key_id FROM image_hashes WHERE id > ? ORDER BY id', (after_id,)
+    ).fetchall()
+    conn.close()
+    return rows
+
+
+def save_image_hash(dhash_hex: str, analysis_json: str, hint: str = None, key_id: str = None) -> int:
+    """保存一张图片的哈希与分析结果，返回新行 id"""
+    init_db()
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('''
+    INSERT INTO image_hashes (timestamp, dhash, hint, analysis_json, key_id) VALUES (?, ?, ?, ?, ?)
+    ''', (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), dhash_hex, hint, analysis_json, key_id))
+    conn.commit()
+    record_id = cursor.lastrowid
+    conn.close()
+    return record_id
+
+
+def compact_records(older_than_days: int = COMPACT_AFTER_DAYS, vacuum: bool = False) -> dict:
+    """
+    存储整理：
+    1. 老格式的行 (全文存在 expert_review / calculation_json 里) 转成引用
+    2. 只被冷记录 (超过 older_than_days 天) 引用的长文本用 zlib 压缩
+    3. 删除没有任何记录引用的文本
+    三步在同一个 BEGIN IMMEDIATE 事务里完成：整理期间的 save_record 会等待，
+    否则刚写入的文本可能在“扫描引用”和“删除孤儿”之间被当成孤儿删掉
+    :return: 各步骤处理的行数
+    """
+    init_db()
+    stats = {"migrated": 0, "compressed": 0, "orphans": 0}
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)  # 手动管理事务
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        legacy = conn.execute('''
+        SELECT id, expert_review, calculation_json FROM records
+        WHERE review_ref IS NULL OR calc_refs IS NULL
+        ''').fetchall()
+        for row in legacy:
+            try:
+                lines = json.loads(row["calculation_json"] or "[]")
+            except ValueError:
+                lines = []
+            review_ref = _intern_texts(conn, [row["expert_review"] or ""])[0]
+            calc_refs = _intern_texts(conn, [str(line) for line in lines])
+            conn.execute('''
+            UPDATE records SET review_ref = ?, calc_refs = ?, expert_review = NULL, calculation_json = NULL
+            WHERE id = ?
+            ''', (review_ref, json.dumps(calc_refs), row["id"]))
+        stats["migrated"] = len(legacy)
+
+        # 仍被近期记录引用的文本保持明文，读起来不用解压
+        cutoff = (datetime.now() - timedelta(days=older_than_days)).strftime("%Y-%m-%d %H:%M:%S")
+        hot_refs, live_refs = set(), set()
+        for row in conn.execute('SELECT timestamp, review_ref, calc_refs FROM records'):
+            refs = [row["review_ref"]] + json.loads(row["calc_refs"] or "[]")
+            live_refs.update(refs)
+            if (row["timestamp"] or "") >= cutoff:
+                hot_refs.update(refs)
+
+        for ref, body in conn.execute("SELECT hash, body FROM text_blobs WHERE encoding = 'raw'").fetchall():
+            if ref in hot_refs or len(body) < COMPRESS_MIN_BYTES:
+                continue
+            packed = zlib.compress(bytes(body), 9)
+            if len(packed) < len(body):
+                conn.execute("UPDATE text_blobs SET encoding = 'zlib', body = ? WHERE hash = ?", (packed, ref))
+                stats["compressed"] += 1
+
+        orphans = [(ref,) for (ref,) in conn.execute('SELECT hash FROM text_blobs') if ref not in live_refs]
+        conn.executemany('DELETE FROM text_blobs WHERE hash = ?', orphans)
+        stats["orphans"] = len(orphans)
+        conn.execute('COMMIT')
+
+        if vacuum:
+            conn.execute('VACUUM')
+    except Exception:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    logger.info("记录存储整理完成", extra=stats)
+    return stats
+
+
+if __name__ == "__main__":
+    # 用法：python -m utils.db_manager compact [--days 30] [--vacuum]
+    import argparse
+
+    parser = argparse.ArgumentParser(description="鉴定记录数据库维护")
+    parser.add_argument("command", choices=["compact"])
+    parser.add_argument("--days", type=int, default=COMPACT_AFTER_DAYS, help="超过多少天的记录视为冷数据")
+    parser.add_argument("--vacuum", action="store_true", help="整理后执行 VACUUM 回收磁盘空间")
+    args = parser.parse_args()
+    print(compact_records(older_than_days=args.days, vacuum=args.vacuum), file=sys.stderr)
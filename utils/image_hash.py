@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+文件名：utils/image_hash.py
+功能：感知哈希 (dHash) + BK 树近重复索引
+说明：
+- 卖家反复上架同一块板，照片常被重新压缩、缩放或轻微裁剪，按字节哈希命不中；
+  dHash 对这些变换基本稳定，汉明距离在阈值内即视为同一张图
+- 命中后可直接复用之前的视觉分析结果 (PHASH_MODE=reuse)，或只做标记 (flag，默认)，或关闭 (off)
+- 索引按调用方 (key_id) 隔离，只会命中同一个租户自己传过的图；带了线索的请求不复用 (线索可能改变结论)
+- 其它 worker 写入的新图每 PHASH_REFRESH_SECONDS 秒增量拉取一次
+- Pillow 为可选依赖，未安装时哈希返回 None，整个流程自动跳过
+"""
+import io
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.db_manager import load_image_hashes, save_image_hash
+from utils.logger import get_logger
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = get_logger(__name__)
+
+PHASH_MODE = os.getenv("PHASH_MODE", "flag").strip().lower()
+PHASH_REFRESH_SECONDS = float(os.getenv("PHASH_REFRESH_SECONDS", "30"))
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "6"))  # 64 位哈希里最多允许几位不同
+HASH_SIZE = 8
+
+
+# ==========================================
+# 1. dHash
+# ==========================================
+def dhash(image_bytes: bytes, hash_size: int = HASH_SIZE) -> Optional[int]:
+    """差值哈希：缩到 (hash_size+1) x hash_size 灰度图，比较相邻像素明暗"""
+    if Image is None or not image_bytes:
+        return None
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        # JPEG 可以在解码阶段直接降采样，大图也只需几毫秒
+        img.draft("L", (hash_size * 8, hash_size * 8))
+        img = img.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    except Exception as e:
+        logger.warning("感知哈希计算失败", extra={"error": str(e)})
+        return None
+
+    pixels = list(img.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+# ==========================================
+# 2. BK 树
+# ==========================================
+class BKTree:
+    """
+    以汉明距离为度量的 BK 树：利用三角不等式剪枝，
+    查询半径 r 时只需访问距离落在 [d-r, d+r] 的子树
+    """
+
+    def __init__(self):
+        self._root: Optional[list] = None  # [hash, [item_id...], {distance: child}]
+        self.size = 0
+
+    def add(self, value: int, item_id: Any):
+        self.size += 1
+        if self._root is None:
+            self._root = [value, [item_id], {}]
+            return
+        node = self._root
+        while True:
+            d = hamming(value, node[0])
+            if d == 0:
+                node[1].append(item_id)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, [item_id], {}]
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """返回 [(距离, item_id)]，按距离升序"""
+        if self._root is None:
+            return []
+        found = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= max_distance:
+                found.extend((d, item_id) for item_id in node[1])
+            for child_d, child in node[2].items():
+                if d - max_distance <= child_d <= d + max_distance:
+                    stack.append(child)
+        found.sort(key=lambda x: x[0])
+        return found
+
+
+# ==========================================
+# 3. 历史鉴定图片索引
+# ==========================================
+class NearDuplicateIndex:
+    def __init__(self, refresh_seconds: float = PHASH_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._trees: Dict[str, BKTree] = {}  # key_id -> 该租户的 BK 树
+        self._analyses: Dict[int, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._refreshed_at: Optional[float] = None
+
+    def _insert(self, record_id: int, value: int, analysis: Dict[str, Any], key_id: Optional[str]):
+        if record_id in self._analyses:
+            return
+        self._analyses[record_id] = analysis
+        self._trees.setdefault(key_id or "", BKTree()).add(value, record_id)
+        self._last_id = max(self._last_id, record_id)
+
+    def _refresh(self):
+        """增量拉取其它 worker 新写入的图片 (只读 id 更大的行)"""
+        now = time.monotonic()
+        if self._refreshed_at is not None and now - self._refreshed_at < self.refresh_seconds:
+            return
+        with self._lock:
+            if self._refreshed_at is not None and now - self._refreshed_at < self.refresh_seconds:
+                return
+            for record_id, hash_hex, analysis_json, key_id in load_image_hashes(self._last_id):
+                try:
+                    self._insert(record_id, int(hash_hex, 16), json.loads(analysis_json), key_id)
+                except (ValueError, TypeError):
+                    continue
+            self._refreshed_at = now
+
+    def lookup(self, value: Optional[int], key_id: str = None,
+               max_distance: int = PHASH_MAX_DISTANCE) -> Optional[Dict[str, Any]]:
+        """在该调用方自己的历史图片里找最近的一张；返回 {"record_id", "distance", "analysis"}"""
+        if value is None:
+            return None
+        self._refresh()
+        with self._lock:
+            tree = self._trees.get(key_id or "")
+            matches = tree.search(value, max_distance) if tree else []
+            if not matches:
+                return None
+            distance, record_id = matches[0]
+            return {"record_id": record_id, "distance": distance, "analysis": dict(self._analyses[record_id])}
+
+    def add(self, value: Optional[int], analysis: Dict[str, Any], hint: str = None, key_id: str = None):
+        if value is None:
+            return
+        self._refresh()
+        clean = {k: v for k, v in analysis.items() if not k.startswith("_")}
+        record_id = save_image_hash(f"{value:016x}", json.dumps(clean, ensure_ascii=False), hint, key_id)
+        with self._lock:
+            self._insert(record_id, value, clean, key_id)
+
+
+image_index = NearDuplicateIndex()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+文件名：utils/image_quality.py
+功能：调用视觉模型之前的本地图片质量检查 (清晰度 / 曝光 / 分辨率)
+说明：
+- 模糊、太小的照片送去 qwen-vl-max 基本只能换回 UNKNOWN 或离谱的成色分，白花钱
+- 曝光问题只提示不拒绝：雪地、白底拍板子本来就很亮，这类正常照片不能被挡在模型前面
+- 全部在 CPU 上用 Pillow 完成，先降采样到 ANALYSIS_SIDE 再算，单张图几毫秒
+- QUALITY_GATE=enforce  不合格直接拒绝，不调模型 (默认)
+  QUALITY_GATE=warn     只给提示，照常分析
+  QUALITY_GATE=off      关闭检查
+- Pillow 未安装时返回 verdict="unchecked"，不影响主流程
+"""
+import io
+import os
+from typing import Any, Dict, List
+
+from utils.logger import get_logger
+
+try:
+    from PIL import Image, ImageFilter, ImageStat
+except ImportError:
+    Image = None
+
+logger = get_logger(__name__)
+
+QUALITY_GATE = os.getenv("QUALITY_GATE", "enforce").strip().lower()
+MIN_SHORT_SIDE = int(os.getenv("QUALITY_MIN_SIDE", "480"))  # 短边像素
+BLUR_REJECT = float(os.getenv("QUALITY_BLUR_REJECT", "20"))  # 拉普拉斯方差低于此值判定为糊
+BLUR_WARN = float(os.getenv("QUALITY_BLUR_WARN", "60"))
+DARK_MEAN = float(os.getenv("QUALITY_DARK_MEAN", "45"))  # 平均亮度 (0-255)
+BRIGHT_MEAN = float(os.getenv("QUALITY_BRIGHT_MEAN", "220"))
+CLIP_RATIO = float(os.getenv("QUALITY_CLIP_RATIO", "0.5"))  # 死黑 / 死白像素占比上限
+ANALYSIS_SIDE = 512  # 统一缩到这个长边再算，阈值才与原图尺寸无关
+
+LAPLACIAN = (0, 1, 0, 1, -4, 1, 0, 1, 0)
+
+# 问题代码 -> (严重程度, 给用户的提示)；只有看不清细节的 (太小/太糊/解不开) 才拒绝
+ISSUES = {
+    "too_small": ("reject", "分辨率太低，请靠近拍摄或上传原图"),
+    "blurry": ("reject", "照片太模糊，请对焦后重拍"),
+    "slightly_blurry": ("warn", "照片略糊，细节可能看不清"),
+    "too_dark": ("warn", "光线偏暗，暗部细节可能看不清"),
+    "too_bright": ("warn", "曝光偏亮，亮部细节可能看不清"),
+    "low_contrast": ("warn", "明暗反差大，部分区域细节丢失"),
+    "unreadable": ("reject", "无法解码该图片，请换一张"),
+}
+
+
+def _verdict(issues: List[str], metrics: Dict[str, Any]) -> Dict[str, Any]:
+    levels = [ISSUES[i][0] for i in issues]
+    verdict = "reject" if "reject" in levels else "warn" if levels else "ok"
+    return {
+        "verdict": verdict,
+        "issues": issues,
+        "tips": [ISSUES[i][1] for i in issues],
+        "metrics": metrics,
+    }
+
+
+def check_image_quality(image_bytes: bytes) -> Dict[str, Any]:
+    """
+    :return: {"verdict": ok|warn|reject|unchecked, "issues": [...], "tips": [...], "metrics": {...}}
+    """
+    if Image is None:
+        return {"verdict": "unchecked", "issues": [], "tips": [], "metrics": {}}
+
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        width, height = img.size
+        # JPEG 解码阶段直接降采样，避免把 12MP 原图完整解出来
+        img.draft("L", (ANALYSIS_SIDE, ANALYSIS_SIDE))
+        gray = img.convert("L")
+    except Exception as e:
+        logger.warning("图片质量检查无法解码", extra={"error": str(e)})
+        return _verdict(["unreadable"], {})
+
+    gray.thumbnail((ANALYSIS_SIDE, ANALYSIS_SIDE))
+
+    # 拉普拉斯响应的方差：边缘越锐利方差越大；offset=128 让负响应不被截成 0
+    edges = gray.filter(ImageFilter.Kernel((3, 3), LAPLACIAN, scale=1, offset=128))
+    sharpness = ImageStat.Stat(edges).var[0]
+
+    hist = gray.histogram()
+    total = float(sum(hist)) or 1.0
+    brightness = sum(i * n for i, n in enumerate(hist)) / total
+    dark_ratio = sum(hist[:16]) / total
+    bright_ratio = sum(hist[240:]) / total
+
+    metrics = {
+        "width": width,
+        "height": height,
+        "sharpness": round(sharpness, 1),
+        "brightness": round(brightness, 1),
+        "dark_ratio": round(dark_ratio, 3),
+        "bright_ratio": round(bright_ratio, 3),
+    }
+
+    issues = []
+    if min(width, height) < MIN_SHORT_SIDE:
+        issues.append("too_small")
+    if sharpness < BLUR_REJECT:
+        issues.append("blurry")
+    elif sharpness < BLUR_WARN:
+        issues.append("slightly_blurry")
+    if brightness < DARK_MEAN or dark_ratio > CLIP_RATIO:
+        issues.append("too_dark")
+    elif brightness > BRIGHT_MEAN or bright_ratio > CLIP_RATIO:
+        issues.append("too_bright")
+    elif dark_ratio + bright_ratio > CLIP_RATIO * 0.6:
+        issues.append("low_contrast")
+
+    return _verdict(issues, metrics)
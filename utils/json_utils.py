@@ -1 +1,321 @@
 # -*- coding: utf-8 -*
+"""
+文件名：utils/json_utils.py
+功能：大模型输出的 JSON 容错解析 (提取 -> 修复 -> 类型纠正 -> 校验)
+说明：
+- 模型常在 JSON 前后加客套话、包 ```json 围栏、漏逗号、多尾逗号、用单引号或 Python 的 True/False，
+  甚至输出到一半被截断；直接 json.loads 失败就只能返回 5 分兜底，等于白付一次调用费
+- parse_model_json() 逐级尝试：原样解析 -> 提取最外层对象 -> 词法级修复，并返回走到了哪一级，便于统计
+- JsonObjectScanner 支持分块喂入 (流式输出)，最外层对象一闭合就能拿到
+"""
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# 解析结果等级
+OUTCOME_CLEAN = "clean"  # 原样可解析
+OUTCOME_EXTRACTED = "extracted"  # 去掉围栏/前后文字后可解析
+OUTCOME_REPAIRED = "repaired"  # 修复语法后可解析
+OUTCOME_FAILED = "failed"
+
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+_BARE_LITERALS = {"true": "true", "false": "false", "null": "null",
+                  "True": "true", "False": "false", "None": "null"}
+
+
+# ==========================================
+# 1. 提取最外层 JSON 对象
+# ==========================================
+class JsonObjectScanner:
+    """
+    单遍扫描：跟踪字符串/转义/括号深度，找到第一个完整的最外层 {...}
+    可以分块 feed()，适用于流式返回
+    """
+
+    def __init__(self):
+        self._buf: List[str] = []
+        self._depth = 0
+        self._quote = None  # 当前所在字符串的引号字符
+        self._escape = False
+        self.started = False
+        self.complete = False
+
+    def feed(self, chunk: str) -> Optional[str]:
+        """喂入一段文本；最外层对象闭合时返回完整对象文本，否则返回 None"""
+        for ch in chunk:
+            if self.complete:
+                break
+            if not self.started:
+                if ch != "{":
+                    continue
+                self.started = True
+            self._buf.append(ch)
+
+            if self._quote:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == self._quote:
+                    self._quote = None
+            elif ch in "\"'":
+                self._quote = ch
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.complete = True
+        return "".join(self._buf) if self.complete else None
+
+    def partial(self) -> str:
+        """目前为止收集到的 (可能未闭合的) 对象文本"""
+        return "".join(self._buf)
+
+
+def extract_json_object(text: str) -> Optional[str]:
+    """返回文本里第一个最外层 JSON 对象；被截断时返回未闭合的部分，交给 repair_json 补全"""
+    if not text:
+        return None
+    scanner = JsonObjectScanner()
+    found = scanner.feed(text)
+    if found is not None:
+        return found
+    return scanner.partial() or None
+
+
+# ==========================================
+# 2. 词法级修复
+# ==========================================
+def _tokenize(text: str) -> List[Tuple[str, str]]:
+    """切成 (类型, 文本)：str / punct / word；未闭合的字符串会被补上引号"""
+    tokens = []
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if ch.isspace():
+            i += 1
+        elif ch in "\"'“”":
+            close = {"“": "”", "”": "”"}.get(ch, ch)
+            j, chars = i + 1, []
+            while j < n and text[j] != close:
+                if text[j] == "\\" and j + 1 < n:
+                    chars.append(text[j:j + 2])
+                    j += 2
+                    continue
+                chars.append(text[j])
+                j += 1
+            body = "".join(chars)
+            if ch != '"':
+                # 单引号/中文引号字符串：统一转成合法的双引号字符串
+                body = body.replace("\\'", "'").replace('"', '\\"')
+            tokens.append(("str", '"' + body.replace("\n", "\\n") + '"'))
+            i = j + 1
+        elif ch in "{}[]:,":
+            tokens.append(("punct", ch))
+            i += 1
+        elif ch == "/" and text.startswith("//", i):
+            # 行注释
+            while i < n and text[i] != "\n":
+                i += 1
+        else:
+            j = i
+            while j < n and not text[j].isspace() and text[j] not in "{}[]:,\"'“”":
+                j += 1
+            tokens.append(("word", text[i:j]))
+            i = j
+    return tokens
+
+
+def _word_to_json(word: str) -> str:
+    if word in _BARE_LITERALS:
+        return _BARE_LITERALS[word]
+    if _NUMBER_RE.fullmatch(word):
+        return word
+    return json.dumps(word, ensure_ascii=False)  # 其它裸词当字符串
+
+
+def _trim_dangling(out: List[str], stack: List[str]):
+    """去掉容器收尾前悬空的逗号、冒号和没有值的 key"""
+    while out:
+        if out[-1] == ",":
+            out.pop()
+        elif out[-1] == ":":
+            out.pop()  # 冒号
+            out.pop()  # 它前面的 key
+        elif stack and stack[-1] == "}" and out[-1].startswith('"') and len(out) >= 2 and out[-2] in "{,":
+            out.pop()  # 对象里只有 key 没有冒号
+        else:
+            return
+
+
+def repair_json(text: str) -> str:
+    """
+    修复常见缺陷：单引号、Python 字面量、漏逗号、多余尾逗号、注释、截断 (补引号/补括号)
+    只做词法层面的修补，不猜测语义
+    """
+    out: List[str] = []
+    stack: List[str] = []
+
+    def value_ended() -> bool:
+        if not out or out[-1] in "{[,:":
+            return False
+        # 对象里 "key" 后面应该跟冒号，不算值结束
+        return not (stack and stack[-1] == "}" and out[-1].startswith('"') and len(out) >= 2 and out[-2] in "{,")
+
+    for kind, tok in _tokenize(text):
+        if kind == "punct" and tok in "}]":
+            if not stack:
+                continue
+            _trim_dangling(out, stack)
+            out.append(stack.pop())
+        elif kind == "punct" and tok == ",":
+            if value_ended():
+                out.append(",")  # 重复逗号或开头的逗号直接丢弃
+        elif kind == "punct" and tok == ":":
+            if out and out[-1] != ":":
+                out.append(":")
+        else:
+            # 值或 key 的开始：前面紧跟着一个已结束的值，说明漏了逗号
+            if stack and value_ended():
+                out.append(",")
+            if kind == "punct":  # { 或 [
+                stack.append("}" if tok == "{" else "]")
+                out.append(tok)
+            else:
+                out.append(tok if kind == "str" else _word_to_json(tok))
+
+    # 截断：逐层补齐括号
+    while stack:
+        _trim_dangling(out, stack)
+        out.append(stack.pop())
+    return "".join(out)
+
+
+# ==========================================
+# 3. 逐级解析
+# ==========================================
+def parse_model_json(raw_text: str) -> Tuple[Optional[Dict[str, Any]], str]:
+    """
+    :return: (解析出的 dict 或 None, 解析等级 clean/extracted/repaired/failed)
+    """
+    if not raw_text or not raw_text.strip():
+        return None, OUTCOME_FAILED
+    try:
+        data = json.loads(raw_text)
+        if isinstance(data, dict):
+            return data, OUTCOME_CLEAN
+    except ValueError:
+        pass
+
+    candidate = extract_json_object(raw_text)
+    if not candidate:
+        return None, OUTCOME_FAILED
+    try:
+        data = json.loads(candidate)
+        if isinstance(data, dict):
+            return data, OUTCOME_EXTRACTED
+    except ValueError:
+        pass
+
+    try:
+        data = json.loads(repair_json(candidate))
+        if isinstance(data, dict):
+            return data, OUTCOME_REPAIRED
+    except ValueError:
+        pass
+    return None, OUTCOME_FAILED
+
+
+# ==========================================
+# 4. 类型纠正与校验
+# ==========================================
+_TRUE_WORDS = {"true", "yes", "y", "1", "是", "可以", "能", "可用"}
+_FALSE_WORDS = {"false", "no", "n", "0", "否", "不", "不能", "不可用"}
+
+
+def to_number(value: Any) -> Optional[float]:
+    """把 "8" / "8分" / "8/10" / "7-8" (取中间值) 转成数字；无法识别返回 None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if not isinstance(value, str):
+        return None
+    text = value.strip()
+    range_match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*[-~～到至]\s*(\d+(?:\.\d+)?)\s*分?\s*", text)
+    if range_match:
+        return (float(range_match.group(1)) + float(range_match.group(2))) / 2
+    match = _NUMBER_RE.search(text)
+    if not match:
+        return None
+    number = float(match.group())
+    return int(number) if number.is_integer() else number
+
+
+def to_bool(value: Any) -> Optional[bool]:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return bool(value)
+    if isinstance(value, str):
+        text = value.strip().lower()
+        if text in _TRUE_WORDS:
+            return True
+        if text in _FALSE_WORDS:
+            return False
+    return None
+
+
+# 字段 -> (类型, 取值范围)；类型为 number / bool / str
+VL_ANALYSIS_SCHEMA = {
+    "brand": ("str", None),
+    "possible_model": ("str", None),
+    "condition_score": ("number", (1, 10)),
+    "base_damage": ("str", None),
+    "edge_damage": ("str", None),
+    "can_use": ("bool", None),
+    "is_old_model": ("bool", None),
+    "reasoning": ("str", None),
+}
+VL_REQUIRED_FIELDS = ("brand", "condition_score")
+
+
+def coerce_to_schema(data: Dict[str, Any], schema: Dict[str, tuple] = None,
+                     required: Tuple[str, ...] = VL_REQUIRED_FIELDS) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    按 schema 纠正类型 ("8" -> 8, "true" -> True, 分数夹到 1-10)；无法纠正的字段删除
+    :return: (纠正后的新 dict, 问题列表 ["condition_score:invalid", "brand:missing", ...])
+    """
+    schema = schema or VL_ANALYSIS_SCHEMA
+    result = dict(data)
+    issues = []
+    for field, (kind, bounds) in schema.items():
+        if field not in result or result[field] is None:
+            if field in required:
+                issues.append(f"{field}:missing")
+            result.pop(field, None)
+            continue
+        value = result[field]
+        if kind == "number":
+            number = to_number(value)
+            if number is None:
+                issues.append(f"{field}:invalid")
+                result.pop(field)
+                continue
+            if bounds:
+                clamped = min(bounds[1], max(bounds[0], number))
+                if clamped != number:
+                    issues.append(f"{field}:out_of_range")
+                number = clamped
+            result[field] = number
+        elif kind == "bool":
+            flag = to_bool(value)
+            if flag is None:
+                issues.append(f"{field}:invalid")
+                result.pop(field)
+                continue
+            result[field] = flag
+        elif not isinstance(value, str):
+            result[field] = str(value)
+    return result, issues
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+文件名：utils/logger.py
+功能：结构化日志 (队列异步输出 + 请求 ID + 分模块级别 + 高频日志采样)
+说明：
+- 业务线程只把日志记录放进有界队列，真正的 I/O 由后台 QueueListener 线程完成；队列满时直接丢弃并计数，绝不阻塞请求
+- SNOWBOARD_LOG_LEVEL=INFO                           全局级别
+- SNOWBOARD_LOG_LEVELS=llm.qwen_vl=DEBUG,utils.db_manager=WARNING   分模块级别
+- SNOWBOARD_LOG_FORMAT=json|text                    输出格式 (默认 json)
+- 高频日志用 extra={"sample_rate": 0.1} 只保留约 10%
+- 导入本模块不会改动 root logger；由入口 (api/app.py、main.py、app_ui_deploy.py) 显式调用 setup_logging()
+- 队列满被丢弃的条数见 dropped_log_records()，/metrics 以 snowboard_log_records_dropped 输出
+用法：
+    from utils.logger import get_logger, setup_logging
+    setup_logging()  # 仅入口调用一次
+    logger = get_logger(__name__)
+    logger.info("模型调用成功", extra={"attempt": 1, "latency_ms": 812})
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime
+from typing import Optional
+
+LOG_LEVEL = os.getenv("SNOWBOARD_LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("SNOWBOARD_LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("SNOWBOARD_LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.getenv("SNOWBOARD_LOG_QUEUE_SIZE", "10000"))
+
+request_id_var: contextvars.ContextVar = contextvars.ContextVar("request_id", default="-")
+
+# LogRecord 自带的属性，格式化时不当作业务字段输出
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id",
+                                                                         "sample_rate"}
+
+_setup_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+dropped_records = 0
+
+
+class RequestContextFilter(logging.Filter):
+    """在业务线程里把请求 ID 固化到日志记录上 (放到队列后就拿不到 contextvar 了)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """带 sample_rate 的记录按概率保留；WARNING 及以上永远保留"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = getattr(record, "sample_rate", None)
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        return random.random() < float(rate)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def enqueue(self, record: logging.LogRecord):
+        global dropped_records
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(f"{k}={v}" for k, v in record.__dict__.items()
+                          if k not in _RESERVED and not k.startswith("_"))
+        line = (f"{datetime.fromtimestamp(record.created).strftime('%H:%M:%S')} {record.levelname:<7} "
+                f"[{getattr(record, 'request_id', '-')}] {record.name}: {record.getMessage()}")
+        if fields:
+            line += f" | {fields}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def _apply_levels():
+    logging.getLogger().setLevel(LOG_LEVEL)
+    for item in LOG_LEVELS.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+
+def setup_logging():
+    """幂等：第一次调用时给 root logger 挂上队列 handler 并启动后台输出线程 (由程序入口调用)"""
+    global _listener
+    if _listener is not None:
+        return
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        stream = logging.StreamHandler(sys.stderr)
+        stream.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+        log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        queue_handler = NonBlockingQueueHandler(log_queue)
+        queue_handler.addFilter(RequestContextFilter())
+        queue_handler.addFilter(SamplingFilter())
+
+        root = logging.getLogger()
+        root.addHandler(queue_handler)
+        _apply_levels()
+
+        _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(name)
+
+
+def dropped_log_records() -> int:
+    """队列满时被丢弃的日志条数"""
+    return dropped_records
+
+
+def set_request_id(request_id: str):
+    """在请求入口调用，返回的 token 可用于 request_id_var.reset"""
+    return request_id_var.set(request_id)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+文件名：utils/logo_matcher.py
+功能：离线 LOGO 匹配 (ORB 特征 + FLANN LSH 近邻索引)，在调用视觉模型前先猜品牌
+说明：
+- 品牌是价格的第一决定因素，但目前完全靠 qwen-vl-max 认 LOGO，Prompt 里还要每次列 30+ 个品牌
+- 参考图库放在 data/logos/<品牌>/*.jpg|png (目录名即品牌，需与 ORIGINAL_PRICE_REF 一致)，
+  首次使用时提取特征并建索引，之后常驻内存
+- LOGO_MATCH_MODE=hint  高置信度时把品牌作为线索拼进 Prompt (默认)
+  LOGO_MATCH_MODE=skip  置信度够高时直接确定品牌，远程模型只负责成色评估
+  LOGO_MATCH_MODE=off   关闭
+- OpenCV (opencv-python-headless) 为可选依赖；未安装或图库为空时 match_logo 返回 None
+"""
+import os
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from utils.logger import get_logger
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:
+    cv2 = None
+
+logger = get_logger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOGO_DIR = os.getenv("LOGO_GALLERY_DIR", os.path.join(PROJECT_ROOT, "data", "logos"))
+LOGO_MATCH_MODE = os.getenv("LOGO_MATCH_MODE", "hint").strip().lower()
+LOGO_HINT_CONFIDENCE = float(os.getenv("LOGO_HINT_CONFIDENCE", "0.5"))
+LOGO_SKIP_CONFIDENCE = float(os.getenv("LOGO_SKIP_CONFIDENCE", "0.8"))
+LOGO_MIN_MATCHES = int(os.getenv("LOGO_MIN_MATCHES", "20"))  # 票数达到这个数才给满置信度
+
+QUERY_MAX_SIDE = 1024
+RATIO_TEST = 0.75  # Lowe 比值检验
+MAX_HAMMING = 64  # 256 位 ORB 描述子，超过这个距离的匹配直接丢弃
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+
+# FLANN_INDEX_LSH = 6：二进制描述子专用的局部敏感哈希索引
+LSH_PARAMS = dict(algorithm=6, table_number=6, key_size=12, multi_probe_level=1)
+
+
+class LogoMatcher:
+    def __init__(self, gallery_dir: str = LOGO_DIR):
+        self.gallery_dir = gallery_dir
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._index = None
+        self._labels: List[str] = []  # 每一行描述子属于哪个品牌
+        self._orb = None
+
+    @property
+    def available(self) -> bool:
+        self._ensure_loaded()
+        return self._index is not None
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if cv2 is None or not os.path.isdir(self.gallery_dir):
+                return
+            self._orb = cv2.ORB_create(nfeatures=1500)
+            gallery_orb = cv2.ORB_create(nfeatures=500)
+
+            blocks, labels = [], []
+            for brand in sorted(os.listdir(self.gallery_dir)):
+                brand_dir = os.path.join(self.gallery_dir, brand)
+                if not os.path.isdir(brand_dir):
+                    continue
+                for name in sorted(os.listdir(brand_dir)):
+                    if not name.lower().endswith(IMAGE_EXTS):
+                        continue
+                    img = cv2.imread(os.path.join(brand_dir, name), cv2.IMREAD_GRAYSCALE)
+                    if img is None:
+                        continue
+                    _, desc = gallery_orb.detectAndCompute(img, None)
+                    if desc is None:
+                        continue
+                    blocks.append(desc)
+                    labels.extend([brand.upper()] * len(desc))
+
+            if not blocks:
+                logger.info("LOGO 图库为空，跳过本地品牌匹配", extra={"gallery_dir": self.gallery_dir})
+                return
+            self._labels = labels
+            self._index = cv2.flann_Index(np.vstack(blocks), LSH_PARAMS)
+            logger.info("LOGO 索引构建完成", extra={
+                "brands": len(set(labels)), "descriptors": len(labels)})
+
+    def match(self, image_bytes: bytes) -> Optional[Dict[str, Any]]:
+        """
+        :return: {"brand", "confidence", "votes", "runner_up"}；无法匹配时返回 None
+        """
+        if not self.available or not image_bytes:
+            return None
+        img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            return None
+        scale = QUERY_MAX_SIDE / max(img.shape)
+        if scale < 1:
+            img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        _, desc = self._orb.detectAndCompute(img, None)
+        if desc is None or len(desc) < 2:
+            return None
+        with self._lock:
+            indices, dists = self._index.knnSearch(desc, 2, params={})
+
+        votes: Counter = Counter()
+        for (i1, i2), (d1, d2) in zip(indices, dists):
+            # LSH 找不够近邻时会返回 -1
+            if i1 < 0 or d1 > MAX_HAMMING:
+                continue
+            if i2 >= 0 and self._labels[i1] != self._labels[i2] and d1 >= RATIO_TEST * d2:
+                continue
+            votes[self._labels[i1]] += 1
+
+        if not votes:
+            return None
+        ranked = votes.most_common(2)
+        brand, top = ranked[0]
+        second = ranked[1][1] if len(ranked) > 1 else 0
+        # 置信度 = 领先程度 x 证据量：票数太少或被第二名咬得太紧都会拉低
+        confidence = (top / (top + second)) * min(1.0, top / LOGO_MIN_MATCHES)
+        return {
+            "brand": brand,
+            "confidence": round(confidence, 3),
+            "votes": top,
+            "runner_up": ranked[1][0] if len(ranked) > 1 else None,
+        }
+
+
+logo_matcher = LogoMatcher()
+
+
+def match_logo(image_bytes: bytes) -> Optional[Dict[str, Any]]:
+    if LOGO_MATCH_MODE == "off":
+        return None
+    try:
+        return logo_matcher.match(image_bytes)
+    except Exception as e:
+        logger.warning("LOGO 匹配失败", extra={"error": str(e)})
+        return None
+
+
+def warm_up():
+    """后台预热：提前提取图库特征、构建索引"""
+    if LOGO_MATCH_MODE != "off":
+        logo_matcher._ensure_loaded()
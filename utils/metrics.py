@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+文件名：utils/metrics.py
+功能：进程内指标 (计数器 / 直方图) + 分阶段计时
+说明：
+- render_prometheus() 输出 Prometheus 文本格式，供 /metrics 抓取 (多 worker 时每个进程各自一份)
+- stage_timer() 既写入全局直方图，也记到当前请求的计时列表里，用于生成 Server-Timing 响应头
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Optional
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0)
+
+_registry: List["_Metric"] = []
+_request_timings: contextvars.ContextVar = contextvars.ContextVar("request_timings", default=None)
+
+
+def _label_key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {v:g}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, list] = {}  # key -> [每个桶的计数..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for i, upper in enumerate(self.buckets):
+                    cumulative += series[i]
+                    lines.append(f"{self.name}_bucket{_format_labels(key, (('le', f'{upper:g}'),))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+# ==========================================
+# 1. 业务指标
+# ==========================================
+STAGE_DURATION = Histogram("snowboard_stage_duration_seconds", "各处理阶段耗时 (秒)")
+REQUEST_DURATION = Histogram("snowboard_request_duration_seconds", "HTTP 请求总耗时 (秒)")
+REQUESTS_TOTAL = Counter("snowboard_requests_total", "HTTP 请求数")
+VL_RETRIES = Counter("snowboard_vl_retries_total", "视觉模型重试次数")
+VL_CASCADE_CALLS = Counter("snowboard_vl_cascade_calls_total", "级联中各层模型的调用次数 (tier=fast/strong)")
+VL_ESCALATIONS = Counter("snowboard_vl_escalations_total", "快模型结果升级到强模型的次数 (按原因)")
+FALLBACK_RESULTS = Counter("snowboard_fallback_results_total", "返回兜底结果的次数 (按原因)")
+CACHE_HITS = Counter("snowboard_cache_hits_total", "各类缓存命中次数")
+CACHE_MISSES = Counter("snowboard_cache_misses_total", "各类缓存未命中次数")
+JSON_PARSE_OUTCOMES = Counter("snowboard_json_parse_total", "模型 JSON 解析结果 (clean/extracted/repaired/failed)")
+SCHEMA_ISSUES = Counter("snowboard_schema_issues_total", "模型输出字段缺失/类型错误/越界次数 (按字段)")
+LOG_RECORDS_DROPPED = Gauge("snowboard_log_records_dropped", "日志队列满时被丢弃的日志条数 (进程启动以来)")
+RATE_LIMIT_FAIL_OPEN = Counter("snowboard_rate_limit_fail_open_total", "限流库被锁/不可用时退回进程内令牌桶的次数")
+QUALITY_REJECTS = Counter("snowboard_quality_rejects_total", "本地质量检查判定不合格的图片数")
+CHAT_ANSWERS = Counter("snowboard_chat_answers_total", "追问由哪条路径回答 (source=local/cache/llm, 按意图)")
+SINGLE_FLIGHT_REQUESTS = Counter("snowboard_single_flight_requests_total",
+                                 "相同请求合并：role=leader 实际执行 / follower 复用结果 / timeout 等待超时自行执行 / overflow 等待者已满直接执行")
+SINGLE_FLIGHT_INFLIGHT = Gauge("snowboard_single_flight_inflight", "正在执行、可被合并的请求数 (按 group)")
+SINGLE_FLIGHT_FAN_IN = Histogram("snowboard_single_flight_fan_in", "每次实际执行被多少个请求共享 (含自身)",
+                                 buckets=(1, 2, 3, 5, 10, 20, 50, 100))
+
+
+# ==========================================
+# 2. 分阶段计时
+# ==========================================
+def start_request_timing() -> List[Tuple[str, float]]:
+    """在请求入口调用，返回本次请求的计时列表"""
+    timings: List[Tuple[str, float]] = []
+    _request_timings.set(timings)
+    return timings
+
+
+@contextmanager
+def stage_timer(stage: str, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_DURATION.observe(elapsed, stage=stage, **labels)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed * 1000))
+
+
+def server_timing_header(timings: List[Tuple[str, float]], total_ms: Optional[float] = None) -> str:
+    """同名阶段 (如多次 vl_attempt) 合并耗时，desc 里注明次数"""
+    merged: Dict[str, List[float]] = {}
+    for stage, ms in timings:
+        merged.setdefault(stage, []).append(ms)
+    parts = []
+    for stage, values in merged.items():
+        entry = f"{stage};dur={sum(values):.1f}"
+        if len(values) > 1:
+            entry += f';desc="{len(values)}x"'
+        parts.append(entry)
+    if total_ms is not None:
+        parts.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(parts)
+
+
+def render_prometheus() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+文件名：utils/single_flight.py
+功能：相同请求合并 (single-flight)
+说明：
+- 爆款商品被很多人同时鉴定、或前端重复提交时，会有多个完全相同的 /analyze-multiple、/calculate-price
+  同时在跑，每个都各自付一遍视觉模型 + 点评的钱
+- 按请求指纹 (调用方 key_id + 图片摘要 + 线索 + 参数) 合并：同一指纹只有第一个请求 (leader) 真正执行，
+  执行期间到达的相同请求 (follower) 等它的结果，不再发起模型调用
+- 只合并“同时在跑”的请求，结果不做缓存：leader 结束后再来的请求会重新执行
+- follower 最多等 SINGLE_FLIGHT_WAIT_TIMEOUT 秒，超时就自己执行；每个 flight 最多挂 SINGLE_FLIGHT_MAX_FOLLOWERS 个
+  follower，再来的直接自己执行 —— 等待会占住线程池的线程，leader 卡住时不能把线程池耗光
+- SINGLE_FLIGHT=off 可关闭
+"""
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, Tuple
+
+from utils.metrics import SINGLE_FLIGHT_REQUESTS, SINGLE_FLIGHT_INFLIGHT, SINGLE_FLIGHT_FAN_IN
+
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "on").strip().lower() not in ("off", "0", "false")
+SINGLE_FLIGHT_WAIT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_WAIT_TIMEOUT", "30"))
+SINGLE_FLIGHT_MAX_FOLLOWERS = int(os.getenv("SINGLE_FLIGHT_MAX_FOLLOWERS", "8"))
+
+
+def fingerprint(*parts: Any) -> str:
+    """把请求的关键部分 (图片摘要、线索、参数...) 序列化后取 sha256"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    def __init__(self, group: str, wait_timeout: float = SINGLE_FLIGHT_WAIT_TIMEOUT,
+                 max_followers: int = SINGLE_FLIGHT_MAX_FOLLOWERS):
+        self.group = group
+        self.wait_timeout = wait_timeout
+        self.max_followers = max_followers
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        :return: (结果, 是否复用了别人的执行结果)；leader 抛出的异常会原样抛给所有 follower
+        """
+        if not SINGLE_FLIGHT:
+            return fn(), False
+
+        with self._lock:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            overflow = not is_leader and flight.followers >= self.max_followers
+            if is_leader:
+                flight = self._flights[key] = _Flight()
+            elif not overflow:
+                flight.followers += 1
+        if overflow:
+            # 等的人已经够多了，不再占一个线程干等
+            SINGLE_FLIGHT_REQUESTS.inc(group=self.group, role="overflow")
+            return fn(), False
+        if not is_leader:
+            return self._follow(flight, fn)
+
+        SINGLE_FLIGHT_REQUESTS.inc(group=self.group, role="leader")
+        SINGLE_FLIGHT_INFLIGHT.inc(group=self.group)
+        try:
+            flight.result = fn()
+            return flight.result, False
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+            SINGLE_FLIGHT_INFLIGHT.dec(group=self.group)
+            SINGLE_FLIGHT_FAN_IN.observe(1 + flight.followers, group=self.group)
+
+    def _follow(self, flight: _Flight, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        if not flight.done.wait(self.wait_timeout):
+            # leader 卡太久：不再干等，自己执行一次
+            SINGLE_FLIGHT_REQUESTS.inc(group=self.group, role="timeout")
+            return fn(), False
+        SINGLE_FLIGHT_REQUESTS.inc(group=self.group, role="follower")
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, True
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+文件名：utils/usage_tracker.py
+功能：收集一次请求内的所有大模型调用 (模型名、token 用量、耗时)
+用法：
+    with track_llm_usage() as calls:
+        ...  # 期间 llm/ 与 pricing/ 里的调用会通过 record_llm_call 追加到 calls
+"""
+import contextvars
+import json
+import os
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+_current_calls: contextvars.ContextVar = contextvars.ContextVar("llm_usage_calls", default=None)
+
+# 每千 token 单价 (元)，按 DashScope 公开价目估算；调价时用 MODEL_PRICES='{"qwen-plus": [0.0008, 0.002]}' 覆盖
+# [输入单价, 输出单价]，图片 token 计入输入
+MODEL_PRICES = {
+    "qwen-vl-max": [0.003, 0.009],
+    "qwen-vl-plus": [0.0015, 0.0045],
+    "qwen-plus": [0.0008, 0.002],
+}
+MODEL_PRICES.update(json.loads(os.getenv("MODEL_PRICES", "{}")))
+
+
+def _read(usage: Any, *names) -> int:
+    """DashScope 的 usage 既像 dict 又像对象，两种方式都试一下"""
+    if usage is None:
+        return 0
+    for name in names:
+        value = None
+        if isinstance(usage, dict):
+            value = usage.get(name)
+        if value is None:
+            value = getattr(usage, name, None)
+        if value is not None:
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                continue
+    return 0
+
+
+def normalize_usage(usage: Any) -> Dict[str, int]:
+    """统一成 {input_tokens, output_tokens, image_tokens}"""
+    return {
+        "input_tokens": _read(usage, "input_tokens", "prompt_tokens"),
+        "output_tokens": _read(usage, "output_tokens", "completion_tokens"),
+        "image_tokens": _read(usage, "image_tokens"),
+    }
+
+
+def usage_from_message(message: Any) -> Dict[str, int]:
+    """从 LangChain AIMessage 中取 token 用量 (ChatTongyi 放在 response_metadata.token_usage)"""
+    metadata = getattr(message, "response_metadata", None) or {}
+    usage = metadata.get("token_usage")
+    if not usage:
+        usage = getattr(message, "usage_metadata", None)
+    return normalize_usage(usage)
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    """按 MODEL_PRICES 估算费用 (元)；未知模型按 0 计"""
+    price_in, price_out = MODEL_PRICES.get(model, (0.0, 0.0))
+    # DashScope 返回的 input_tokens 已包含图片 token，这里不重复计费
+    return round((input_tokens * price_in + output_tokens * price_out) / 1000, 6)
+
+
+def record_llm_call(model: str, kind: str, usage: Optional[Dict[str, int]] = None,
+                    latency_ms: float = 0.0, success: bool = True, prompt_version: str = None, **attrs):
+    """
+    登记一次模型调用；不在 track_llm_usage 作用域内时直接忽略
+    :param prompt_version: Prompt 版本号，用来对比改 Prompt 前后的 token 与耗时
+    :param attrs: 其它可分析的维度，如 image_bytes (上传图片大小)、hint_used (是否带用户线索)
+    """
+    calls = _current_calls.get()
+    if calls is None:
+        return
+    entry = {"model": model, "kind": kind, "prompt_version": prompt_version,
+             "latency_ms": round(latency_ms, 1), "success": success}
+    entry.update(usage or normalize_usage(None))
+    entry["cost"] = estimate_cost(model, entry["input_tokens"], entry["output_tokens"])
+    entry.update(attrs)
+    calls.append(entry)
+
+
+def current_calls() -> List[Dict[str, Any]]:
+    """当前请求内已登记的调用 (不在作用域内时返回空列表)"""
+    return list(_current_calls.get() or [])
+
+
+@contextmanager
+def track_llm_usage():
+    calls: List[Dict[str, Any]] = []
+    token = _current_calls.set(calls)
+    try:
+        yield calls
+    finally:
+        _current_calls.reset(token)
+
+
+def summarize_calls(calls: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "llm_calls": len(calls),
+        "input_tokens": sum(c.get("input_tokens", 0) for c in calls),
+        "output_tokens": sum(c.get("output_tokens", 0) for c in calls),
+        "image_tokens": sum(c.get("image_tokens", 0) for c in calls),
+        "latency_ms": round(sum(c.get("latency_ms", 0) for c in calls), 1),
+        "cost": round(sum(c.get("cost", 0) for c in calls), 6),
+    }